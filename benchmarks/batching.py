@@ -0,0 +1,91 @@
+"""
+Compare frames/sec sent by an agent with and without batching,
+over QueueTransport and over WebsocketTransport to a local sink.
+
+    python benchmarks/batching.py
+"""
+import asyncio
+import time
+
+import websockets
+
+from zentropi import Agent
+from zentropi.codec import JSON_CODEC
+from zentropi.codec import negotiate_codec
+
+FRAMES = 20000
+HOST = '127.0.0.1'
+PORT = 26599
+
+
+async def start_agent(agent, endpoint):
+    shutdown_trigger = asyncio.Event()
+    task = asyncio.create_task(
+        agent.start(endpoint, 'test-token', shutdown_trigger=shutdown_trigger, handle_signals=False))
+    while not agent._connected:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)  # Let filter and join go out first.
+    return shutdown_trigger, task
+
+
+async def bench_queue(batch_max_frames):
+    agent = Agent('bench-agent', batch_max_frames=batch_max_frames)
+    shutdown_trigger, task = await start_agent(agent, 'queue://')
+    queue = agent._connection.queue_send
+    while not queue.empty():
+        queue.get_nowait()
+    start = time.perf_counter()
+    for i in range(FRAMES):
+        await agent.emit('bench', value=i)
+    for _ in range(FRAMES):
+        await queue.get()
+    elapsed = time.perf_counter() - start
+    shutdown_trigger.set()
+    await task
+    return FRAMES / elapsed
+
+
+async def bench_websocket(batch_max_frames, codec):
+    received = 0
+    done = asyncio.Event()
+
+    async def sink(websocket, *args):
+        nonlocal received
+        login = JSON_CODEC.loads(await websocket.recv())
+        peer_codec = negotiate_codec([codec] if codec in login.data.get('codecs', []) else [])
+        await websocket.send(login.reply('login-ok', data={'codec': peer_codec.name, 'batch': True}).to_json())
+        async for message in websocket:
+            codec_ = JSON_CODEC if isinstance(message, str) else peer_codec
+            for frame in codec_.loads_many(message):
+                if frame.name == 'bench':
+                    received += 1
+            if received >= FRAMES:
+                done.set()
+
+    server = await websockets.serve(sink, HOST, PORT)
+    agent = Agent('bench-agent', batch_max_frames=batch_max_frames)
+    shutdown_trigger, task = await start_agent(agent, f'ws://{HOST}:{PORT}/')
+    start = time.perf_counter()
+    for i in range(FRAMES):
+        await agent.emit('bench', value=i)
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    shutdown_trigger.set()
+    await task
+    server.close()
+    await server.wait_closed()
+    return FRAMES / elapsed
+
+
+async def main():
+    print(f'{"transport":<20}{"unbatched/s":>14}{"batched/s":>14}')
+    print(f'{"queue":<20}{await bench_queue(1):>14,.0f}{await bench_queue(64):>14,.0f}')
+    for codec in ['json', 'msgpack']:
+        label = f'websocket ({codec})'
+        unbatched = await bench_websocket(1, codec)
+        batched = await bench_websocket(64, codec)
+        print(f'{label:<20}{unbatched:>14,.0f}{batched:>14,.0f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+Measure how fast the in-process broker routes frames, on its own,
+for a fleet of agents each filtering for a few of many frame names,
+and end to end between agents connected on queue://.
+
+    python benchmarks/broker.py
+"""
+import asyncio
+import time
+
+from zentropi import Agent
+from zentropi import Frame
+from zentropi.broker import Broker
+
+FRAMES = 100000
+SUBSCRIBERS = (1, 10, 100)
+AGENT_FRAMES = 20000
+FLEET = 1000
+FLEET_NAMES = 2000  # Frame names in use, each agent filters for NAMES_PER_AGENT of them.
+NAMES_PER_AGENT = 20
+FLEET_SPACES = 10
+
+
+def bench_route(subscribers):
+    broker = Broker()
+    delivered = []
+    for i in range(subscribers + 1):
+        subscriber = broker.connect(f'agent-{i}', delivered.append)
+        broker.receive(subscriber, Frame('login', kind=1, data={'token': ''}))
+        broker.receive(subscriber, Frame('join', kind=1, data={'spaces': ['*']}))
+        names = {'event': [f'event-{i % 10}'], 'message': [], 'request': []}
+        broker.receive(subscriber, Frame('filter', kind=1, data={'names': names}))
+    sender = broker._subscribers[0]
+    frames = [Frame(f'event-{i % 10}', data={'value': i}) for i in range(FRAMES)]
+    delivered.clear()
+    start = time.perf_counter()
+    for frame in frames:
+        broker.route(sender, frame)
+    elapsed = time.perf_counter() - start
+    print(f'route, {subscribers:4} subscribers: {FRAMES / elapsed:12,.0f} frames/s, '
+          f'{len(delivered) / elapsed:12,.0f} deliveries/s')
+
+
+def bench_fleet():
+    broker = Broker()
+    delivered = 0
+
+    def deliver(frame):
+        nonlocal delivered
+        delivered += 1
+
+    for i in range(FLEET):
+        subscriber = broker.connect(f'agent-{i}', deliver)
+        broker.receive(subscriber, Frame('login', kind=1, data={'token': ''}))
+        broker.receive(subscriber, Frame('join', kind=1, data={'spaces': [f'space-{i % FLEET_SPACES}']}))
+        names = [f'event-{(i * 7 + j * 101) % FLEET_NAMES}' for j in range(NAMES_PER_AGENT)]
+        broker.receive(subscriber, Frame('filter', kind=1, data={'names': {'event': names}}))
+    senders = broker._subscribers[:FLEET_SPACES]
+    frames = [Frame(f'event-{i % FLEET_NAMES}', data={'value': i}) for i in range(FRAMES)]
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        broker.route(senders[i % FLEET_SPACES], frame)
+    elapsed = time.perf_counter() - start
+    print(f'route, {FLEET} agents in {FLEET_SPACES} spaces, {NAMES_PER_AGENT} of {FLEET_NAMES} names each: '
+          f'{FRAMES / elapsed:10,.0f} frames/s, {delivered / elapsed:10,.0f} deliveries/s, '
+          f'{len(broker._index):,} index keys')
+
+
+async def bench_agents(subscribers):
+    broker = Broker()
+    broker.serve_queue('bench')
+    received = 0
+    done = asyncio.Event()
+    agents = [Agent(f'agent-{i}') for i in range(subscribers)]
+    for agent in agents:
+        @agent.on_event('bench')
+        async def bench_event(frame):
+            nonlocal received
+            received += 1
+            if received == AGENT_FRAMES * subscribers:
+                done.set()
+
+    sender = Agent('sender')
+    stops = []
+    for agent in [sender] + agents:
+        shutdown_trigger = asyncio.Event()
+        task = asyncio.create_task(
+            agent.start('queue://bench', 'token', shutdown_trigger=shutdown_trigger, handle_signals=False))
+        while 'frame-send-loop' not in agent._spawned_tasks:
+            await asyncio.sleep(0)
+        stops.append((shutdown_trigger, task))
+    start = time.perf_counter()
+    for i in range(AGENT_FRAMES):
+        await sender.emit('bench', value=i)
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    print(f'agents, {subscribers:3} subscribers: {AGENT_FRAMES / elapsed:12,.0f} frames/s, '
+          f'{received / elapsed:12,.0f} deliveries/s')
+    for shutdown_trigger, task in stops:
+        shutdown_trigger.set()
+        await task
+    await broker.close()
+
+
+async def main():
+    for subscribers in SUBSCRIBERS:
+        bench_route(subscribers)
+    bench_fleet()
+    for subscribers in SUBSCRIBERS[:2]:
+        await bench_agents(subscribers)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
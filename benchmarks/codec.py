@@ -0,0 +1,41 @@
+"""
+Compare encode/decode throughput and bytes on wire for frame codecs.
+
+    python benchmarks/codec.py
+"""
+from timeit import timeit
+
+from zentropi import Frame
+from zentropi import Kind
+from zentropi.codec import CODECS
+
+NUMBER = 20000
+
+FRAMES = {
+    'empty event': Frame('heartbeat'),
+    'measure event': Frame('temperature', data={'value': 21.5, 'unit': 'C'}),
+    'request': Frame('weather-history', kind=Kind.REQUEST, data={'station': 'backyard', 'hours': 24}),
+    'response': Frame('weather-history', kind=Kind.RESPONSE,
+                      data={'_response': [[1583452800 + i * 60, 21.5 + i / 10] for i in range(200)]},
+                      meta={'reply_to': Frame('weather-history').uuid}),
+}
+
+
+def bench(codec, frame):
+    payload = codec.dumps(frame)
+    encode = timeit(lambda: codec.dumps(frame), number=NUMBER)
+    decode = timeit(lambda: codec.loads(payload), number=NUMBER)
+    lazy = timeit(lambda: codec.loads(payload, lazy=True).meta, number=NUMBER)
+    return len(payload), NUMBER / encode, NUMBER / decode, NUMBER / lazy
+
+
+def main():
+    print(f'{"frame":<16}{"codec":<10}{"bytes":>8}{"encode/s":>14}{"decode/s":>14}{"header+meta/s":>16}')
+    for label, frame in FRAMES.items():
+        for name, codec in CODECS.items():
+            size, encode, decode, lazy = bench(codec, frame)
+            print(f'{label:<16}{name:<10}{size:>8}{encode:>14,.0f}{decode:>14,.0f}{lazy:>16,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Compare handler dispatch throughput of spawning a task per frame
+with running handlers on a pool of worker tasks.
+
+    python benchmarks/dispatch.py
+"""
+import asyncio
+import time
+
+from zentropi import Agent
+from zentropi import Frame
+
+FRAMES = 50000
+
+
+async def bench(dispatch):
+    agent = Agent('bench-agent', dispatch=dispatch)
+    handled = 0
+    done = asyncio.Event()
+
+    @agent.on_event('bench')
+    async def bench_event(frame):
+        nonlocal handled
+        handled += 1
+        if handled == FRAMES:
+            done.set()
+
+    shutdown_trigger = asyncio.Event()
+    task = asyncio.create_task(agent.start(shutdown_trigger=shutdown_trigger, handle_signals=False))
+    await asyncio.sleep(0)
+    frames = [Frame('bench', data={'value': i}) for i in range(FRAMES)]
+    start = time.perf_counter()
+    for frame in frames:
+        await agent.handle_frame(frame)
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    shutdown_trigger.set()
+    await task
+    return FRAMES / elapsed
+
+
+async def main():
+    for dispatch in ['spawn', 'pool']:
+        print(f'{dispatch:<8}{await bench(dispatch):>12,.0f} frames/s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+"""
+Measure handler lookup time by pattern as the number of
+registered prefix and suffix patterns grows.
+
+    python benchmarks/patterns.py
+"""
+import timeit
+
+from zentropi import Kind
+from zentropi.base_agent import BaseAgent
+
+LOOKUPS = 100000
+
+
+def bench(patterns):
+    agent = BaseAgent()
+    for i in range(patterns):
+        agent.add_handler(Kind.EVENT, f'sensor-{i}.*', print)
+        agent.add_handler(Kind.EVENT, f'*-switch-{i}', print)
+    names = [f'sensor-{patterns - 1}.temperature', f'kitchen-switch-{patterns - 1}', 'unhandled']
+    elapsed = timeit.timeit(
+        lambda: [agent.get_handler(Kind.EVENT, name) for name in names],
+        number=LOOKUPS // len(names))
+    return elapsed / LOOKUPS * 1e6
+
+
+def main():
+    for patterns in [10, 100, 1000, 10000]:
+        print(f'{patterns * 2:>8} patterns{bench(patterns):>10.2f} us/lookup')
+
+
+if __name__ == '__main__':
+    main()
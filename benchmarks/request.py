@@ -0,0 +1,91 @@
+"""
+Measure request round-trip latency percentiles and memory
+per in-flight request between two agents joined by queues.
+
+    python benchmarks/request.py
+"""
+import asyncio
+import time
+import tracemalloc
+
+from zentropi import Agent
+
+REQUESTS = 20000
+CONCURRENCY = 100
+IN_FLIGHT = 10000
+
+
+async def start_agent(agent):
+    shutdown_trigger = asyncio.Event()
+    task = asyncio.create_task(
+        agent.start('queue://', 'test-token', shutdown_trigger=shutdown_trigger, handle_signals=False))
+    while not agent._connected:
+        await asyncio.sleep(0)
+    return shutdown_trigger, task
+
+
+async def relay(source, destination):
+    while True:
+        await destination.queue_recv.put(await source.queue_send.get())
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def bench_latency(requester):
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            await requester.request('echo', timeout=10, value=1)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(REQUESTS // CONCURRENCY) for _ in range(CONCURRENCY)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f'{len(latencies)} requests, {CONCURRENCY} concurrent: {len(latencies) / elapsed:,.0f} requests/s')
+    for pct in [50, 90, 99, 99.9]:
+        print(f'  p{pct:<5} {percentile(latencies, pct) * 1000:8.3f} ms')
+
+
+async def bench_memory(requester):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tasks = [asyncio.create_task(requester.request('nobody', timeout=60)) for _ in range(IN_FLIGHT)]
+    await asyncio.sleep(0.1)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    print(f'{IN_FLIGHT} in-flight requests: {size / IN_FLIGHT:,.0f} bytes each, including the caller task')
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def main():
+    requester = Agent('requester')
+    responder = Agent('responder')
+
+    @responder.on_request('echo')
+    async def echo(frame):
+        return frame.data
+
+    stops = [await start_agent(requester), await start_agent(responder)]
+    relays = [
+        asyncio.create_task(relay(requester._connection, responder._connection)),
+        asyncio.create_task(relay(responder._connection, requester._connection)),
+    ]
+    await bench_latency(requester)
+    await bench_memory(requester)
+    for task in relays:
+        task.cancel()
+    for shutdown_trigger, task in stops:
+        shutdown_trigger.set()
+        await task
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""
+Compare request latency and throughput between two processes over
+each transport, with a broker and an echo agent in a child process.
+
+    python benchmarks/transports.py
+"""
+import asyncio
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+from zentropi import Agent
+from zentropi.broker import Broker
+from zentropi.transport.shm import shm_available
+
+LATENCY_REQUESTS = 5000
+THROUGHPUT_REQUESTS = 20000
+CONCURRENCY = 100
+WS_PORT = 26581
+TCP_PORT = 26582
+UNIX_PATH = os.path.join(tempfile.gettempdir(), 'zentropi-bench.sock')
+SEQPACKET_PATH = os.path.join(tempfile.gettempdir(), 'zentropi-bench-seqpacket.sock')
+
+
+def endpoints():
+    found = {
+        'ws': f'ws://127.0.0.1:{WS_PORT}',
+        'tcp': f'tcp://127.0.0.1:{TCP_PORT}',
+        'tcp-nagle': f'tcp://127.0.0.1:{TCP_PORT}?nodelay=0',
+    }
+    if hasattr(socket, 'AF_UNIX'):
+        found['unix'] = f'unix://{UNIX_PATH}'
+        found['unix-seqpacket'] = f'unix://{SEQPACKET_PATH}?seqpacket'
+    if shm_available():
+        found['shm'] = 'shm://bench'
+    return found
+
+
+async def serve(ready, stop):
+    broker = Broker()
+    broker.serve_queue('bench')
+    await broker.serve_websocket(port=WS_PORT)
+    await broker.serve_tcp(port=TCP_PORT)
+    if hasattr(socket, 'AF_UNIX'):
+        await broker.serve_unix(UNIX_PATH)
+        await broker.serve_unix(SEQPACKET_PATH, seqpacket=True)
+    if shm_available():
+        await broker.serve_shm('bench')
+    echo = Agent('echo')
+
+    @echo.on_request('echo')
+    async def echo_request(frame):
+        return frame.data
+
+    shutdown_trigger = asyncio.Event()
+    task = asyncio.create_task(echo.start('queue://bench', 'token', shutdown_trigger=shutdown_trigger,
+                                          handle_signals=False))
+    ready.set()
+    while not stop.is_set():
+        await asyncio.sleep(0.05)
+    shutdown_trigger.set()
+    await task
+    await broker.close()
+
+
+def run_broker(ready, stop):
+    asyncio.run(serve(ready, stop))
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def bench(name, endpoint):
+    agent = Agent('bench', dispatch='pool')
+    shutdown_trigger = asyncio.Event()
+    task = asyncio.create_task(agent.start(endpoint, 'token', shutdown_trigger=shutdown_trigger,
+                                           handle_signals=False))
+    while 'frame-send-loop' not in agent._spawned_tasks:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)  # Let the broker take the filter and join.
+    latencies = []
+    for i in range(LATENCY_REQUESTS):
+        start = time.perf_counter()
+        await agent.request('echo', timeout=5, value=i)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    async def worker(count):
+        for i in range(count):
+            await agent.request('echo', timeout=5, value=i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(THROUGHPUT_REQUESTS // CONCURRENCY) for _ in range(CONCURRENCY)])
+    elapsed = time.perf_counter() - start
+    print(f'{name:>14}: p50 {percentile(latencies, 50) * 1e6:7.0f} us, p99 {percentile(latencies, 99) * 1e6:7.0f} us, '
+          f'{THROUGHPUT_REQUESTS / elapsed:8,.0f} requests/s with {CONCURRENCY} concurrent')
+    shutdown_trigger.set()
+    await task
+
+
+async def main():
+    for name, endpoint in endpoints().items():
+        await bench(name, endpoint)
+
+
+if __name__ == '__main__':
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    broker = multiprocessing.Process(target=run_broker, args=(ready, stop))
+    broker.start()
+    ready.wait()
+    try:
+        asyncio.run(main())
+    finally:
+        stop.set()
+        broker.join()
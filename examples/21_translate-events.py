@@ -4,7 +4,7 @@ from zentropi import Agent
 a = Agent('translate-events')
 
 
-@a.on_event('*')
+@a.on_event('random-*')
 async def translate_events(frame):
     if frame.name == 'random-value':
         await a.event('intel-backlight', **frame.data)
@@ -72,11 +72,11 @@ setup(
         'websockets',
         'apscheduler',
         'zeroconf',
-        'ratelimit',
         'asyncio_dgram',
         # eg: 'aspectlib==1.1.1', 'six>=1.7',
     ],
     extras_require={
+        'msgpack': ['msgpack'],
         # eg:
         #   'rst': ['docutils>=0.11'],
         #   ':python_version=="2.6"': ['argparse'],
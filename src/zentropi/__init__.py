@@ -47,7 +47,14 @@ from .frame import Frame
 from .kind import Kind
 from .transport.base import BaseTransport
 from .transport.queue import QueueTransport
-from .transport.websocket import WebsocketTransport
+
+
+def __getattr__(name):
+    # Imported on first use, so that only agents on websockets need the library.
+    if name == 'WebsocketTransport':
+        from .transport.websocket import WebsocketTransport
+        return WebsocketTransport
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 __all__ = [
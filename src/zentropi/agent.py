@@ -2,11 +2,14 @@ import asyncio
 import logging
 import random
 import string
+import time
 from asyncio import AbstractEventLoop
 from asyncio import CancelledError
 from asyncio import Event
 from asyncio import Queue
 from asyncio.tasks import Task
+from collections import deque
+from inspect import isasyncgen
 
 from signal import SIGINT
 from signal import SIGTERM
@@ -18,18 +21,33 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from . import KB
 from . import configure_logging
 from .base_agent import BaseAgent
+from .base_agent import frame_deadline
+from .cache import canonical_key
 from .frame import Frame
 from .kind import Kind
 from .mdns import resolve_zeroconf_address
+from .metrics import MetricsExporter
+from .patterns import WILDCARD
+from .patterns import is_pattern
+from .send_queue import Overflow
+from .send_queue import SendQueue
+from .stream import STREAM_CREDIT
+from .stream import STREAM_CREDIT_TIMEOUT
+from .stream import ResponseStream
+from .stream import unwrap_response
+from .timer import TimerWheel
 from .transport.base import BaseTransport
-from .transport.datagram import DatagramTransport
-from .transport.queue import QueueTransport
-from .transport.websocket import WebsocketTransport
 
 logger = logging.getLogger(__name__)
 
 INTERNAL_EVENT_NAMES = {"startup", "shutdown"}
 
+# spawn runs each frame's handler in a task of its own,
+# pool runs handlers in-line on a fixed number of worker tasks.
+DISPATCH_MODES = ("spawn", "pool")
+STATS_REQUEST = "zentropi-stats"
+REQUEST_CANCEL = "request-cancel"
+
 
 def random_string(length: int):
     return "".join(
@@ -38,12 +56,33 @@ def random_string(length: int):
 
 
 def select_transport(endpoint: str):
+    """The transport class for the endpoint's scheme, imported only when
+    used so that agents do not load the libraries of the others.
+    """
     if endpoint.startswith("queue://"):
+        from .transport.queue import QueueTransport
+
         return QueueTransport
     elif endpoint.startswith("ws://") or endpoint.startswith("wss://"):
+        from .transport.websocket import WebsocketTransport
+
         return WebsocketTransport
     elif endpoint.startswith("dgram://"):
+        from .transport.datagram import DatagramTransport
+
         return DatagramTransport
+    elif endpoint.startswith("shm://"):
+        from .transport.shm import ShmTransport
+
+        return ShmTransport
+    elif endpoint.startswith("unix://"):
+        from .transport.unix import UnixTransport
+
+        return UnixTransport
+    elif endpoint.startswith("tcp://"):
+        from .transport.tcp import TcpTransport
+
+        return TcpTransport
     raise ValueError(f"Unknown schema for endpoint: {endpoint}")
 
 
@@ -59,7 +98,24 @@ def clean_space_names(spaces):
 
 
 class Agent(BaseAgent):
-    def __init__(self, name: str) -> None:
+    def __init__(
+        self,
+        name: str,
+        batch_max_frames: int = 64,
+        batch_max_bytes: int = 64 * KB,
+        batch_linger: float = 0.0,
+        send_queue_size: int = 10000,
+        send_queue_overflow: str = "block",
+        reconnect_delay: float = 0.1,
+        reconnect_max_delay: float = 30.0,
+        dispatch: str = "spawn",
+        dispatch_workers: int = 16,
+        fan_out: str = "sequential",
+        stats_handler: bool = False,
+        metrics_port: Optional[int] = None,
+        metrics_host: str = "127.0.0.1",
+        handler_timeout: float = 10,
+    ) -> None:
         self.name = name
         self._scheduler = None
         self._shutdown_trigger = None
@@ -74,8 +130,44 @@ class Agent(BaseAgent):
         self._running = False
         self._send_queue = None
         self._frame_max_size = 1 * KB
-        self._response_wait_queues = {}
-        super().__init__()
+        self._response_futures = {}
+        self._response_timers = TimerWheel()
+        self._response_streams = {}
+        self._response_gathers = {}
+        self._shared_requests = {}  # Key of name and data to [request task, callers waiting].
+        self._stream_credits = {}
+        self._batch_max_frames = batch_max_frames
+        self._batch_max_bytes = batch_max_bytes
+        self._batch_linger = batch_linger
+        self._send_queue_size = send_queue_size
+        self._send_queue_overflow = Overflow(send_queue_overflow)
+        self._reconnect_delay = reconnect_delay
+        self._reconnect_max_delay = reconnect_max_delay
+        self._reconnect_count = 0
+        self._connection_lost = None
+        self._wire_bytes = [0, 0]  # Sent and received over previous connections
+        self._session = random_string(16)  # Tells the broker a reconnect from the connection it replaces
+        self._handler_timeout = handler_timeout
+        self._metrics_exporter = None
+        if metrics_port is not None:
+            self._metrics_exporter = MetricsExporter(self, host=metrics_host, port=metrics_port)
+        if dispatch not in DISPATCH_MODES:
+            raise ValueError(f"Expected dispatch to be one of {DISPATCH_MODES}, got: {dispatch!r}")
+        self._dispatch = dispatch
+        self._dispatch_workers = dispatch_workers
+        self._dispatch_queue = None
+        self._dispatch_pending = set()  # Requests waiting in the dispatch queue or a handler's backlog
+        self._dispatch_running = {}  # Requests being handled, to the worker handling them
+        # Handlers with limited concurrency to [frames dispatched, deque of frames waiting for a slot].
+        self._handler_slots = {}
+        self._cancelled_requests = set()
+        super().__init__(fan_out=fan_out)
+        if stats_handler:
+
+            async def respond_stats():
+                return self.stats()
+
+            self.on_request(STATS_REQUEST)(respond_stats)
 
     ### Signal Handling
 
@@ -154,13 +246,24 @@ class Agent(BaseAgent):
                 self._loop.add_signal_handler(SIGINFO, self._siginfo_handler)
             except ImportError:
                 pass
-        self._send_queue = Queue()
+        self._send_queue = SendQueue(
+            maxsize=self._send_queue_size, overflow=self._send_queue_overflow
+        )
+        self._connection_lost = Event()
+        if self._dispatch == "pool":
+            self._dispatch_queue = Queue()
+            for worker in range(self._dispatch_workers):
+                self.spawn(f"dispatch-worker-{worker}", self._dispatch_worker(), single=True)
         self._scheduler = AsyncIOScheduler()
-        self._scheduler.add_job(self._ensure_connection, "interval", seconds=5)
         self._scheduler.start()
+        if self._metrics_exporter is not None:
+            await self._metrics_exporter.start()
         logger.info(f"Agent {self.name} is starting.")
         self._running = True
         await self._ensure_connection()
+        if (self._endpoint or self._token) and not self._shutdown_trigger.is_set():
+            # Not when the agent was stopped, say as its login failed.
+            self.spawn("connection-loop", self._connection_loop(), single=True)
         await self._run_startup_handler()
         await self._start_interval_handlers()
         logger.info(f"Agent {self.name} is running.")
@@ -168,7 +271,18 @@ class Agent(BaseAgent):
         logger.info(f"Agent {self.name} is stopping.")
         await self._run_shutdown_handler()
         await self._close_connection()
+        if self._dispatch_queue is not None:
+            # Workers exit on None even if their cancellation gets lost
+            # in a handler's wait_for that completes at the same time.
+            for _ in range(self._dispatch_workers):
+                self._dispatch_queue.put_nowait(None)
         await self.cancel_spawned_tasks()
+        self._dispatch_queue = None
+        self._handler_slots.clear()
+        self._response_timers.cancel()
+        self.shutdown_executors()
+        if self._metrics_exporter is not None:
+            await self._metrics_exporter.close()
         self._running = False
 
     def stop(self) -> None:
@@ -191,6 +305,43 @@ class Agent(BaseAgent):
 
     ### Connection
 
+    def _reconnect_backoff(self, attempt: int) -> float:
+        """Exponential backoff with jitter, so that many agents
+        do not reconnect to a restarted server all at once."""
+        delay = min(self._reconnect_max_delay, self._reconnect_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _connection_loop(self):
+        attempt = 0
+        try:
+            while not self._shutdown_trigger.is_set():
+                if self._connected:
+                    attempt = 0
+                    await self._connection_lost.wait()
+                    self._connection_lost.clear()
+                    continue
+                delay = self._reconnect_backoff(attempt)
+                attempt += 1
+                logger.info(f"Reconnecting to {self._endpoint} in {delay:.2f} seconds.")
+                await asyncio.sleep(delay)
+                if self._shutdown_trigger.is_set():
+                    break
+                await self._ensure_connection()
+                if self._connected:
+                    self._reconnect_count += 1
+        except CancelledError:
+            logger.debug("Connection loop cancelled")
+
+    def _warn_connection_closed(self):
+        # Closing the connection while stopping wakes up the loops before they are cancelled.
+        if not self._shutdown_trigger.is_set():
+            logger.warning("Connection closed")
+
+    def _lost_connection(self):
+        self._connected = False
+        if self._connection_lost and not self._shutdown_trigger.is_set():
+            self._connection_lost.set()
+
     async def _ensure_connection(self):
         logger.debug("Checking connection status")
         if self._connected:
@@ -210,7 +361,17 @@ class Agent(BaseAgent):
                 # raise ConnectionError('Unable to resolve address through zeroconf')
         if not self._transport:
             self._transport = select_transport(self._endpoint)
+        if self._connection is not None:
+            self._wire_bytes[0] += self._connection.bytes_sent
+            self._wire_bytes[1] += self._connection.bytes_received
+            # Stop the loops using the lost connection, then let go of its socket or memory.
+            await self._cancel_send_recv_loops()
+            try:
+                await self._connection.close()
+            except Exception as e:
+                logger.debug(f"Unable to close the lost connection: {e!r}")
         self._connection = self._transport()
+        self._connection.session = self._session
         try:
             await self._connection.connect(endpoint=self._endpoint, token=self._token)
             self._connected = True
@@ -220,6 +381,7 @@ class Agent(BaseAgent):
             )
             await self._connection.close()
             self.stop()
+            return
         except Exception as e:
             logger.info(f"Unable to connect to {self._endpoint}, will try again later.")
             return
@@ -240,31 +402,87 @@ class Agent(BaseAgent):
         try:
             while self._connected:
                 frame = await self._connection.recv()
+                self._stats.received(frame)
                 if frame.kind == Kind.EVENT and frame.name in INTERNAL_EVENT_NAMES:
-                    logger.debug(f"Skip frame with internal name: {frame.to_dict()!r}")
+                    logger.debug(f"Skip frame with internal name: {frame.name!r}")
                     continue
                 if frame.kind == Kind.RESPONSE:
-                    response_to_uuid = frame.meta.get("reply_to")
-                    if response_to_uuid in self._response_wait_queues:
-                        await self._response_wait_queues[response_to_uuid].put(frame)
+                    reply_to = frame.meta.get("reply_to")
+                    future = self._response_futures.get(reply_to)
+                    if future and not future.done():
+                        future.set_result(frame)
+                    elif reply_to in self._response_streams:
+                        self._response_streams[reply_to].feed(frame)
+                    elif reply_to in self._response_gathers:
+                        self._response_gathers[reply_to].put_nowait(frame)
+                    continue
+                if frame.kind == Kind.REQUEST and self._deadline_passed(frame):
+                    continue
+                if frame.kind == Kind.COMMAND and frame.name == REQUEST_CANCEL:
+                    self._cancel_handler(frame.data.get("name", ""), frame.meta.get("reply_to"))
+                    continue
+                if frame.kind == Kind.COMMAND and frame.name == STREAM_CREDIT:
+                    credit = self._stream_credits.get(frame.meta.get("reply_to"))
+                    if credit:
+                        for _ in range(frame.data.get("credit", 0)):
+                            credit.release()
                     continue
                 await self.handle_frame(frame)
         except CancelledError:
             logger.debug("Receive loop cancelled")
         except ConnectionError:
-            logger.warning("Connection closed")
-            self._connected = False
+            self._warn_connection_closed()
+            self._lost_connection()
+
+    def _deadline_passed(self, frame: Frame) -> bool:
+        deadline = frame_deadline(frame)
+        if deadline is None or deadline > time.time():
+            return False
+        logger.debug(f"Skip request {frame.name!r} as its deadline has passed")
+        self._stats.expired += 1
+        return True
 
     async def _frame_send_loop(self):
+        frames = []
         try:
             while self._connected:
-                frame = await self._send_queue.get()
-                await self._connection.send(frame)
+                frames = [await self._send_queue.get()]
+                if not self._connected:
+                    break
+                if self._batch_max_frames <= 1:
+                    await self._connection.send(frames[0])
+                else:
+                    frames = await self._collect_batch(frames[0])
+                    await self._connection.send_batch(frames, max_bytes=self._batch_max_bytes)
+                for frame in frames:
+                    self._stats.sent(frame)
+                frames = []
         except CancelledError:
-            logger.debug("Receive loop cancelled")
+            logger.debug("Send loop cancelled")
         except ConnectionError:
-            logger.warning("Connection closed")
-            self._connected = False
+            self._warn_connection_closed()
+            self._lost_connection()
+        finally:
+            # Frames that may not have made it out are sent again after reconnecting.
+            self._send_queue.requeue(frames)
+
+    async def _collect_batch(self, frame: Frame):
+        """Take whatever else is queued behind frame, up to the batch size,
+        waiting up to batch_linger seconds for more to arrive."""
+        frames = [frame]
+        deadline = self._loop.time() + self._batch_linger
+        while len(frames) < self._batch_max_frames:
+            if not self._send_queue.empty():
+                frames.append(self._send_queue.get_nowait())
+                continue
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                frames.append(await asyncio.wait_for(self._send_queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return frames
 
     async def _close_connection(self):
         if not self._connected:
@@ -274,28 +492,54 @@ class Agent(BaseAgent):
 
     ### Send Frames
 
+    def stats(self) -> dict:
+        """Counters and latency histograms of handlers, requests and
+        the send queue, with durations in seconds.
+        """
+        stats = self._stats.snapshot()
+        stats["send_queue"] = self.send_queue_stats()
+        stats["rate_limits"] = self.rate_limit_stats()
+        stats["caches"] = self.cache_stats()
+        stats["in_flight_requests"] = len(self._response_futures)
+        stats["tasks"] = len(self._spawned_tasks)
+        stats["reconnects"] = self._reconnect_count
+        connection = self._connection
+        stats["transport"] = {
+            "name": type(connection).__name__ if connection is not None else None,
+            "bytes_sent": self._wire_bytes[0] + getattr(connection, "bytes_sent", 0),
+            "bytes_received": self._wire_bytes[1] + getattr(connection, "bytes_received", 0),
+        }
+        return stats
+
+    def send_queue_stats(self) -> dict:
+        if self._send_queue is None:
+            return {}
+        return self._send_queue.stats()
+
     async def send(self, frame: Frame, queue=True):
         if not (self._endpoint and self._token):
             logger.debug("Agent not connected, handling sent frame locally")
             await self.handle_frame(frame)
             return
-        if queue:
+        if queue or not self._connected:
             logger.debug("Queue frame for remote server")
             await self._send_queue.put(frame)
         else:
             logger.debug("Sending frame to remote server")
             try:
                 await self._connection.send(frame)
+                self._stats.sent(frame)
             except ConnectionError:
                 logger.warning("Connection was closed.")
-                self._connected = False
+                self._lost_connection()
+                self._send_queue.requeue([frame])
 
     async def command(self, _name: str, _queue=False, **_data):
-        frame = Frame(_name, kind=Kind.COMMAND, data=_data)
+        frame = Frame._trusted(_name, kind=Kind.COMMAND, data=_data)
         await self.send(frame, queue=_queue)
 
     async def emit(self, _name: str, **_data):
-        frame = Frame(_name, kind=Kind.EVENT, data=_data)
+        frame = Frame._trusted(_name, kind=Kind.EVENT, data=_data)
         await self.send(frame)
 
     event = emit
@@ -303,28 +547,127 @@ class Agent(BaseAgent):
     async def message(self, _name: str, text="", locale="en_US", **_data):
         meta = {"locale": locale}
         _data.update({"text": text})
-        frame = Frame(_name, kind=Kind.MESSAGE, data=_data, meta=meta)
+        frame = Frame._trusted(_name, kind=Kind.MESSAGE, data=_data, meta=meta)
         await self.send(frame)
 
-    async def request(self, _name: str, timeout: int, **_data):
-        frame = Frame(_name, kind=Kind.REQUEST, data=_data)
-        await self.send(frame)
+    async def _cancel_request(self, frame: Frame) -> None:
+        """Tell responders to stop working on a request nobody waits for anymore."""
+        cancel = Frame._trusted(
+            REQUEST_CANCEL, kind=Kind.COMMAND, data={"name": frame.name}, meta={"reply_to": frame.uuid}
+        )
         try:
-            return await asyncio.wait_for(
-                self._wait_for_response(frame), timeout=timeout
-            )
+            await self.send(cancel)
         except Exception as e:
-            raise TimeoutError("Timed out waiting for response") from e
+            logger.debug(f"Unable to cancel request {frame.name}: {e!r}")
+
+    async def request(self, _name: str, timeout: int, _coalesce: bool = False, **_data):
+        """Send a request and wait up to timeout seconds for its response.
+
+        With _coalesce, requests of the same name and data made while one
+        is in flight share its frame and its response, and the timeout of
+        the first. The request is only abandoned once every caller is.
+        """
+        if not _coalesce:
+            return await self._request(_name, timeout, _data)
+        key = canonical_key(_name, _data)
+        shared = self._shared_requests.get(key)
+        if shared is None:
+            task = asyncio.ensure_future(self._request(_name, timeout, _data))
+            shared = self._shared_requests[key] = [task, 0]
+            task.add_done_callback(lambda _: self._forget_shared_request(key, shared))
+        else:
+            self._stats.coalesced += 1
+        task = shared[0]
+        shared[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            shared[1] -= 1
+            if not shared[1] and not task.done():
+                task.cancel()
+                self._forget_shared_request(key, shared)
+
+    def _forget_shared_request(self, key: str, shared: list) -> None:
+        if self._shared_requests.get(key) is shared:
+            del self._shared_requests[key]
+
+    async def _request(self, _name: str, timeout: int, _data: dict):
+        frame = Frame._trusted(_name, kind=Kind.REQUEST, data=_data, meta={"deadline": time.time() + timeout})
+        future = asyncio.get_event_loop().create_future()
+        self._response_futures[frame.uuid] = future
+        timer = self._response_timers.add(future, timeout, "Timed out waiting for response")
+        start = time.perf_counter()
+        error = timed_out = False
+        try:
+            await self.send(frame)
+            response = await future
+        except TimeoutError:
+            timed_out = True
+            await self._cancel_request(frame)
+            raise
+        except CancelledError:
+            await self._cancel_request(frame)
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            del self._response_futures[frame.uuid]
+            self._response_timers.discard(future, timer)
+            self._stats.request(_name).record(time.perf_counter() - start, error=error, timeout=timed_out)
+        return unwrap_response(response)
+
+    async def request_stream(self, _name: str, timeout: float, _window: int = 8, **_data):
+        """Send a request and iterate over the chunks of its response,
+        waiting up to timeout seconds for each chunk. The responder may
+        run at most _window chunks ahead of the caller.
+        """
+        frame = Frame._trusted(_name, kind=Kind.REQUEST, data=_data, meta={"stream": _window})
+        stream = ResponseStream(self, frame, timeout=timeout, window=_window)
+        self._response_streams[frame.uuid] = stream
+        try:
+            await self.send(frame)
+            async for chunk in stream:
+                yield chunk
+        finally:
+            del self._response_streams[frame.uuid]
+            if not stream.done:
+                await self._cancel_request(frame)
 
-    async def _wait_for_response(self, frame: Frame):
-        self._response_wait_queues[frame.uuid] = Queue()
+    async def gather(
+        self,
+        _name: str,
+        timeout: float,
+        min_responses: int = 0,
+        max_responses: Optional[int] = None,
+        **_data,
+    ):
+        """Send one request and iterate over the responses of every agent
+        that answers it, until max_responses have arrived or timeout seconds
+        have passed. Raises TimeoutError if fewer than min_responses arrived.
+        """
+        frame = Frame._trusted(_name, kind=Kind.REQUEST, data=_data, meta={"deadline": time.time() + timeout})
+        responses = asyncio.Queue()
+        self._response_gathers[frame.uuid] = responses
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        count = 0
         try:
-            response = await self._response_wait_queues[frame.uuid].get()
-            if "_response" in response.data:
-                return response.data["_response"]
-            return response.data
+            await self.send(frame)
+            while max_responses is None or count < max_responses:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    response = await asyncio.wait_for(responses.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                count += 1
+                yield unwrap_response(response)
         finally:
-            del self._response_wait_queues[frame.uuid]
+            del self._response_gathers[frame.uuid]
+        if count < min_responses:
+            raise TimeoutError(f"Timed out with {count} of {min_responses} responses")
 
     ### Standard frame formatters
 
@@ -353,50 +696,190 @@ class Agent(BaseAgent):
 
     async def filter_frames(self):
         filters = {"event": {}, "message": {}, "size": self._frame_max_size}
-        filters["event"] = list(set(self._event_handlers.keys()) - INTERNAL_EVENT_NAMES)
-        filters["message"] = list(self._message_handlers.keys())
-        filters["request"] = list(self._request_handlers.keys())
-        await self.command("filter", names=filters, size=self._frame_max_size)
+        filters["event"] = list(set(self._filter_names(Kind.EVENT)) - INTERNAL_EVENT_NAMES)
+        filters["message"] = self._filter_names(Kind.MESSAGE)
+        filters["request"] = self._filter_names(Kind.REQUEST)
+        patterns = {
+            "event": self._handler_patterns[Kind.EVENT].describe(),
+            "message": self._handler_patterns[Kind.MESSAGE].describe(),
+            "request": self._handler_patterns[Kind.REQUEST].describe(),
+        }
+        await self.command("filter", names=filters, patterns=patterns, size=self._frame_max_size)
+
+    def _filter_names(self, kind: Kind) -> list:
+        # A lone '*' is sent with the names, as servers already know it.
+        return [name for name in self._handlers_map[kind] if name == WILDCARD or not is_pattern(name)]
 
     async def handle_frame(self, frame: Frame):
         kind = frame.kind
         name = frame.name
         if not self.get_handler(kind, name):
             return
+        if self._dispatch_queue is not None:
+            if kind == Kind.REQUEST:
+                self._dispatch_pending.add(frame.uuid)
+            self._dispatch_frame(frame)
+            return
         self.spawn(
             f"handler-{frame.name}-{frame.uuid}",
             self.handle_response(frame),
             single=True,
         )
 
+    def _dispatch_frame(self, frame: Frame) -> None:
+        """Queue frame for the dispatch workers once each of its handlers
+        with limited concurrency has a free slot. Until then it waits in
+        the backlog of a handler without one rather than on a worker, so
+        a busy handler does not hold up the others.
+        """
+        limited = [
+            handler
+            for handler in self.get_handlers(frame.kind, frame.name)
+            if getattr(handler, "concurrency", None) and not handler.stream
+        ]
+        for handler in limited:
+            slots = self._handler_slots.get(handler)
+            if slots is None:
+                slots = self._handler_slots[handler] = [0, deque()]
+            if slots[0] >= handler.concurrency:
+                slots[1].append(frame)
+                return
+        for handler in limited:
+            self._handler_slots[handler][0] += 1
+        self._dispatch_queue.put_nowait((frame, limited))
+
+    def _release_slots(self, limited: list) -> None:
+        for handler in limited:
+            self._handler_slots[handler][0] -= 1
+        for handler in limited:
+            slots = self._handler_slots[handler]
+            while slots[1] and slots[0] < handler.concurrency:
+                self._dispatch_frame(slots[1].popleft())
+
+    async def _dispatch_worker(self):
+        worker = asyncio.current_task()
+        try:
+            while True:
+                item = await self._dispatch_queue.get()
+                if item is None:
+                    break
+                frame, limited = item
+                try:
+                    await self._dispatch_one(worker, frame)
+                finally:
+                    if self._dispatch_queue is not None:
+                        self._release_slots(limited)
+        except CancelledError:
+            logger.debug("Dispatch worker cancelled")
+
+    async def _dispatch_one(self, worker: Task, frame: Frame):
+        if frame.kind == Kind.REQUEST:
+            self._dispatch_pending.discard(frame.uuid)
+            if frame.uuid in self._cancelled_requests:
+                self._cancelled_requests.discard(frame.uuid)
+                return
+            self._dispatch_running[frame.uuid] = worker
+        try:
+            await self.handle_response(frame)
+        except CancelledError:
+            # Only the request was cancelled, the worker carries on.
+            if frame.uuid not in self._cancelled_requests:
+                raise
+            if hasattr(worker, "uncancel"):
+                worker.uncancel()
+            logger.debug(f"Cancelled handler for {frame.name}")
+        except Exception:
+            logger.exception(f"Encountered error handling {frame.kind.name}: {frame.name}")
+        finally:
+            self._dispatch_running.pop(frame.uuid, None)
+            self._cancelled_requests.discard(frame.uuid)
+
+    def _cancel_handler(self, name: str, uuid: str) -> None:
+        """Stop handling the request with uuid, whether it runs in a task
+        of its own, runs on a dispatch worker or waits for one.
+        """
+        if self._dispatch_queue is None:
+            task = self._spawned_tasks.get(f"handler-{name}-{uuid}")
+            if task is not None:
+                logger.debug(f"Cancelling handler for {name}")
+                task.cancel()
+            return
+        if uuid in self._cancelled_requests:
+            return
+        if uuid in self._dispatch_running:
+            self._cancelled_requests.add(uuid)
+            self._dispatch_running[uuid].cancel()
+        elif uuid in self._dispatch_pending:
+            self._cancelled_requests.add(uuid)
+
     async def handle_response(self, frame: Frame):
         kind = frame.kind
         name = frame.name
-        response = await self.run_handler(kind, name, frame, timeout=10)
+        response = await self.run_handler(kind, name, frame, timeout=self._handler_timeout)
+        if isasyncgen(response):
+            await self._stream_response(frame, response)
+            return
         if not response:
             return
         logger.debug(f"Handler for frame {frame.name} returned response {response!r}")
         if isinstance(response, dict):
-            await self.send(frame.reply(data=response))
+            await self.send(frame.reply(data=response, validate=False))
         else:
-            await self.send(frame.reply(data={"_response": response}))
+            await self.send(frame.reply(data={"_response": response}, validate=False))
+
+    async def _stream_response(self, frame: Frame, chunks):
+        window = frame.meta.get("stream")
+        try:
+            if not window:
+                # The requester expects a single response, so send every chunk in it.
+                response = [chunk async for chunk in chunks]
+                await self.send(frame.reply(data={"_response": response}, validate=False))
+                return
+            credit = asyncio.Semaphore(window)
+            self._stream_credits[frame.uuid] = credit
+            seq = 0
+            async for chunk in chunks:
+                await self._acquire_credit(credit)
+                data = chunk if isinstance(chunk, dict) else {"_response": chunk}
+                await self.send(frame.reply(data=data, meta={"seq": seq}, validate=False))
+                seq += 1
+            await self.send(frame.reply(meta={"seq": seq, "end": True}, validate=False))
+        except asyncio.TimeoutError:
+            logger.warning(f"Gave up streaming response to {frame.name}, requester stopped consuming")
+        finally:
+            self._stream_credits.pop(frame.uuid, None)
+            await chunks.aclose()
+
+    async def _acquire_credit(self, credit: asyncio.Semaphore) -> None:
+        if not credit.locked():
+            await credit.acquire()
+            return
+        # Not wait_for, which on some Python versions swallows a cancellation
+        # (such as by a request-cancel) arriving just as the credit does.
+        acquire = asyncio.ensure_future(credit.acquire())
+        try:
+            done, _ = await asyncio.wait({acquire}, timeout=STREAM_CREDIT_TIMEOUT)
+        finally:
+            if not acquire.done():
+                acquire.cancel()
+        if not done:
+            raise asyncio.TimeoutError()
 
     async def _start_interval_handlers(self):
-        for name, int_task in self._interval_handlers.items():
-            interval = int_task.interval
-            logger.debug(f"Starting interval handler: {name} @ {interval} seconds.")
-            self._scheduler.add_job(int_task, "interval", seconds=interval)
+        for name, int_tasks in self._interval_handlers.items():
+            for int_task in int_tasks:
+                interval = int_task.interval
+                logger.debug(f"Starting interval handler: {name} @ {interval} seconds.")
+                self._scheduler.add_job(int_task, "interval", seconds=interval)
 
     async def _run_startup_handler(self):
-        if "startup" in self._event_handlers:
+        for startup_handler in self._event_handlers.get("startup", []):
             logger.debug(f"Running startup event handler.")
-            startup_handler = self._event_handlers["startup"]
             startup_frame = Frame("startup", kind=Kind.EVENT)
             await startup_handler(startup_frame)
 
     async def _run_shutdown_handler(self):
-        if "shutdown" in self._event_handlers:
+        for shutdown_handler in self._event_handlers.get("shutdown", []):
             logger.debug(f"Running shutdown event handler.")
-            shutdown_handler = self._event_handlers["shutdown"]
             shutdown_frame = Frame("shutdown", kind=Kind.EVENT)
             await shutdown_handler(shutdown_frame)
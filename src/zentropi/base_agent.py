@@ -2,34 +2,67 @@ import asyncio
 import logging
 import random
 import string
+import time
 from concurrent.futures import TimeoutError as FuturesTimeoutError
 from concurrent.futures import CancelledError as FuturesCancelledError
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
+from functools import partial
+from inspect import isasyncgenfunction
 from inspect import iscoroutinefunction
+from inspect import ismethod
 from inspect import signature
 from typing import Awaitable
 from typing import Callable
 from typing import Optional
+from typing import Pattern
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Union
 
 from asgiref.sync import sync_to_async
-from ratelimit import limits
-from ratelimit.exception import RateLimitException
 
 from . import configure_logging
 from .kind import Kind
+from .cache import ResponseCache
+from .cache import canonical_key
 from .frame import Frame
+from .patterns import PatternTable
+from .patterns import is_pattern
+from .rate_limit import RateLimiter
+from .stats import Stats
 
 logger = logging.getLogger(__name__)
 
+# How several handlers for the same kind and name run: one after another
+# in order of priority, or all at once.
+FAN_OUT_MODES = ('sequential', 'concurrent')
 
-def detect_handler_properties(func):
+# Named executors for sync handlers, besides asgiref's default single thread:
+# a thread pool shared by all handlers, a thread pool of the handler's own
+# or a process pool shared by all handlers, for CPU heavy work.
+EXECUTORS = ('shared', 'dedicated', 'process')
+
+
+def frame_deadline(frame) -> Optional[float]:
+    """The absolute time (as from time.time) by which the sender
+    of a request stops waiting for its response, if it set one.
+    """
+    meta = getattr(frame, 'meta', None)
+    if meta:
+        return meta.get('deadline')
+    return None
+
+
+def detect_handler_properties(func, executor: Union[str, Executor, None] = None):
     if iscoroutinefunction(func):
         setattr(func, 'run_async', True)
     else:
         setattr(func, 'run_async', False)
+    setattr(func, 'stream', isasyncgenfunction(func))
 
     params = signature(func).parameters
     if params.get('frame', None):
@@ -37,6 +70,23 @@ def detect_handler_properties(func):
     else:
         setattr(func, 'pass_frame', False)
 
+    if executor is not None and not isinstance(executor, Executor) and executor not in EXECUTORS:
+        raise ValueError(f'Expected executor to be one of {EXECUTORS} or an Executor, got: {executor!r}')
+    setattr(func, 'executor', executor)
+    check_process_handler(func)
+
+
+def check_process_handler(func) -> None:
+    """Process pools pickle the handler by its module and name, which
+    rules out methods, bound to an agent that cannot be pickled, and
+    functions defined inside another.
+    """
+    executor = getattr(func, 'executor', None)
+    if executor != 'process' and not isinstance(executor, ProcessPoolExecutor):
+        return
+    if ismethod(func) or '<locals>' in getattr(func, '__qualname__', ''):
+        raise ValueError(f'Expected a module level function to run in a process, got: {func.__qualname__}')
+
 period_miltipliers = {
     's': 1,
     'm': 60,
@@ -63,16 +113,52 @@ def parse_rate_limit(limit: str):
         raise ValueError(f'Expected rate limit in format calls/period (10/1m), got: {limit}')
 
 
-def apply_rate_limits(rate_limits: Optional[List[str]], func: Callable):
+def apply_rate_limits(rate_limits: Optional[List[str]],
+                      func: Callable,
+                      policy: str = 'shed',
+                      key: str = 'handler'):
     if not rate_limits:
+        setattr(func, 'rate_limiter', None)
         return func
     if not isinstance(rate_limits, (list, set)):
         raise TypeError(f'Expected rate_limits to be a list or set, got: {(type(rate_limits))}')
-    for rate_limit in rate_limits:
-        calls, period = parse_rate_limit(rate_limit)
-        func = limits(calls=calls, period=period)(func)
+    limits = [parse_rate_limit(rate_limit) for rate_limit in rate_limits]
+    setattr(func, 'rate_limiter', RateLimiter(limits, policy=policy, key=key))
     return func
 
+def configure_handler(func: Callable,
+                      rate_limits: Optional[List[str]] = None,
+                      concurrency: Optional[int] = None,
+                      executor: Union[str, Executor, None] = None,
+                      priority: int = 0,
+                      rate_limit_policy: str = 'shed',
+                      rate_limit_key: str = 'handler',
+                      timeout: Optional[float] = None,
+                      cache: Union[float, ResponseCache, None] = None,
+                      kind: Optional[Kind] = None):
+    """Check and set the options the on_* decorators pass through:
+    concurrency, executor, priority, rate_limit_policy, rate_limit_key,
+    timeout and, for request handlers only, cache.
+
+    A cache given as a ttl is built for each agent the handler is added
+    to, a ResponseCache passed in is shared by all of them.
+    """
+    detect_handler_properties(func, executor=executor)
+    if cache is not None and kind not in (None, Kind.REQUEST):
+        raise ValueError(f'Expected cache only on request handlers, got it on a {kind.name} handler: {func.__name__}')
+    if concurrency is not None and concurrency < 1:
+        raise ValueError(f'Expected concurrency to be at least 1, got: {concurrency}')
+    if cache is not None and func.stream:
+        raise ValueError(f'Expected a handler that returns its response to cache, got a stream: {func.__name__}')
+    if cache is not None and not isinstance(cache, ResponseCache) and cache <= 0:
+        raise ValueError(f'Expected a positive cache ttl, got: {cache}')
+    setattr(func, 'concurrency', concurrency)
+    setattr(func, 'priority', priority)
+    setattr(func, 'timeout', timeout)
+    setattr(func, 'cache', cache)
+    return apply_rate_limits(rate_limits, func, policy=rate_limit_policy, key=rate_limit_key)
+
+
 def random_string(length: int):
     return ''.join([random.choice(string.ascii_letters + string.digits) for n in range(length)])
 
@@ -90,46 +176,51 @@ def on_interval(name: str, interval: float):
     return wrapper
 
 
-def on_command(name: str, rate_limits: Optional[List[str]] = None):
+def on_command(name: Union[str, Pattern], rate_limits: Optional[List[str]] = None, **options):
     def wrapper(func: Callable):
         setattr(func, 'handler', name)
         setattr(func, 'kind', Kind.COMMAND)
-        detect_handler_properties(func)
-        return apply_rate_limits(rate_limits, func)
+        return configure_handler(func, rate_limits=rate_limits, kind=Kind.COMMAND, **options)
     return wrapper
 
 
-def on_event(name: str, rate_limits: Optional[List[str]] = None):
+def on_event(name: Union[str, Pattern], rate_limits: Optional[List[str]] = None, **options):
     def wrapper(func: Callable):
         setattr(func, 'handler', name)
         setattr(func, 'kind', Kind.EVENT)
-        detect_handler_properties(func)
-        return apply_rate_limits(rate_limits, func)
+        return configure_handler(func, rate_limits=rate_limits, kind=Kind.EVENT, **options)
     return wrapper
 
 
 
-def on_message(name: str, rate_limits: Optional[List[str]] = None):
+def on_message(name: Union[str, Pattern], rate_limits: Optional[List[str]] = None, **options):
     def wrapper(func: Callable):
         setattr(func, 'handler', name)
         setattr(func, 'kind', Kind.MESSAGE)
-        detect_handler_properties(func)
-        return apply_rate_limits(rate_limits, func)
+        return configure_handler(func, rate_limits=rate_limits, kind=Kind.MESSAGE, **options)
     return wrapper
 
 
-def on_request(name: str, rate_limits: Optional[List[str]] = None):
+def on_request(name: Union[str, Pattern], rate_limits: Optional[List[str]] = None, **options):
     def wrapper(func: Callable):
         setattr(func, 'handler', name)
         setattr(func, 'kind', Kind.REQUEST)
-        detect_handler_properties(func)
-        return apply_rate_limits(rate_limits, func)
+        return configure_handler(func, rate_limits=rate_limits, kind=Kind.REQUEST, **options)
     return wrapper
 
 
 class BaseAgent(object):
-    def __init__(self) -> None:
+    def __init__(self, fan_out: str = 'sequential') -> None:
+        if fan_out not in FAN_OUT_MODES:
+            raise ValueError(f'Expected fan_out to be one of {FAN_OUT_MODES}, got: {fan_out!r}')
+        self._fan_out = fan_out
         self._spawned_tasks = {}  # Spawned tasks
+        self._handler_limits = {}  # Semaphores for handlers with limited concurrency
+        self._handler_caches = {}  # Response caches of request handlers, built on registration
+        self._sync_runners = {}  # Awaitable wrappers of sync handlers, built on registration
+        self._executors = {}  # Pools created for handlers, by name or dedicated handler
+        self._stats = Stats()
+        # Handlers by name, each a list with the highest priority first.
         self._interval_handlers = {}
         self._event_handlers = {}
         self._command_handlers = {}
@@ -142,6 +233,7 @@ class BaseAgent(object):
             Kind.MESSAGE: self._message_handlers,
             Kind.REQUEST: self._request_handlers,
         }
+        self._handler_patterns = {kind: PatternTable() for kind in self._handlers_map}
         self._detect_handlers()
 
     def configure_logging(self,
@@ -155,10 +247,55 @@ class BaseAgent(object):
             log_file=log_file,
             log_level=log_level)
 
-    def add_handler(self, kind: Kind, name: str, handler: Callable):
-        if name in self._handlers_map[kind]:
-            raise KeyError(f'Handler already set for kind {kind.name} {name}')
-        self._handlers_map[kind][name] = handler
+    def add_handler(self, kind: Kind, name: Union[str, Pattern], handler: Callable):
+        check_process_handler(handler)
+        handlers = self._handlers_map[kind]
+        if name not in handlers:
+            handlers[name] = []
+            if is_pattern(name):
+                self._handler_patterns[kind].add(name)
+        handlers[name].append(handler)
+        # Stable, so handlers of equal priority run in order of registration.
+        handlers[name].sort(key=lambda h: -getattr(h, 'priority', 0))
+        if not getattr(handler, 'run_async', True) and not getattr(handler, 'stream', False):
+            self._sync_runners[handler] = self._sync_runner(handler)
+        cache = getattr(handler, 'cache', None)
+        if cache is not None:
+            self._handler_caches[handler] = cache if isinstance(cache, ResponseCache) else ResponseCache(ttl=cache)
+
+    def _sync_runner(self, handler: Callable):
+        executor = getattr(handler, 'executor', None)
+        if executor is None:
+            return sync_to_async(handler)
+
+        async def run(*args):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self._get_executor(handler, executor), partial(handler, *args))
+
+        return run
+
+    def _get_executor(self, handler: Callable, executor: Union[str, Executor]) -> Executor:
+        if isinstance(executor, Executor):
+            return executor
+        key = handler if executor == 'dedicated' else executor
+        if key not in self._executors:
+            if executor == 'process':
+                self._executors[key] = ProcessPoolExecutor()
+            else:
+                name = getattr(handler, '__name__', 'handler') if executor == 'dedicated' else 'shared'
+                self._executors[key] = ThreadPoolExecutor(
+                    max_workers=getattr(handler, 'concurrency', None) if executor == 'dedicated' else None,
+                    thread_name_prefix=f'zentropi-{name}')
+        return self._executors[key]
+
+    def shutdown_executors(self, wait: bool = False) -> None:
+        """Shut down the pools created for handlers, they are created
+        again if a handler runs afterwards. Executors passed in by
+        the caller are left to the caller to shut down.
+        """
+        executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=wait)
 
     def _detect_handlers(self):
         for attr_name in dir(self):
@@ -180,75 +317,173 @@ class BaseAgent(object):
 
         return wrapper
 
-    def on_command(self, name: str, rate_limits: Optional[List[str]] = None):
+    def on_command(self, name: Union[str, Pattern], rate_limits: Optional[List[str]] = None, **options):
         def wrapper(func: Callable):
-            detect_handler_properties(func)
+            func = configure_handler(func, rate_limits=rate_limits, kind=Kind.COMMAND, **options)
             self.add_handler(Kind.COMMAND, name, func)
-            return apply_rate_limits(rate_limits, func)
+            return func
 
         return wrapper
 
-    def on_event(self, name: str, rate_limits: Optional[List[str]] = None):
+    def on_event(self, name: Union[str, Pattern], rate_limits: Optional[List[str]] = None, **options):
         def wrapper(func: Callable):
-            detect_handler_properties(func)
+            func = configure_handler(func, rate_limits=rate_limits, kind=Kind.EVENT, **options)
             self.add_handler(Kind.EVENT, name, func)
-            return apply_rate_limits(rate_limits, func)
+            return func
 
         return wrapper
 
-    def on_message(self, name: str, rate_limits: Optional[List[str]] = None):
+    def on_message(self, name: Union[str, Pattern], rate_limits: Optional[List[str]] = None, **options):
         def wrapper(func: Callable):
-            detect_handler_properties(func)
+            func = configure_handler(func, rate_limits=rate_limits, kind=Kind.MESSAGE, **options)
             self.add_handler(Kind.MESSAGE, name, func)
-            return apply_rate_limits(rate_limits, func)
+            return func
 
         return wrapper
 
-    def on_request(self, name: str, rate_limits: Optional[List[str]] = None):
+    def on_request(self, name: Union[str, Pattern], rate_limits: Optional[List[str]] = None, **options):
         def wrapper(func: Callable):
-            detect_handler_properties(func)
+            func = configure_handler(func, rate_limits=rate_limits, kind=Kind.REQUEST, **options)
             self.add_handler(Kind.REQUEST, name, func)
-            return apply_rate_limits(rate_limits, func)
+            return func
 
         return wrapper
 
+    def rate_limit_stats(self) -> Dict[str, dict]:
+        """Shed and delayed frame counts of rate limited handlers."""
+        stats = {}
+        for kind, handlers in self._handlers_map.items():
+            for name, funcs in handlers.items():
+                for handler in funcs:
+                    rate_limiter = getattr(handler, 'rate_limiter', None)
+                    if rate_limiter is not None:
+                        stats[f'{kind.name}:{name}:{handler.__name__}'] = rate_limiter.stats()
+        return stats
+
+    def cache_stats(self) -> Dict[str, dict]:
+        """Hit, miss and coalesced call counts of cached request handlers."""
+        stats = {}
+        for name, funcs in self._handlers_map[Kind.REQUEST].items():
+            for handler in funcs:
+                cache = self._handler_caches.get(handler)
+                if cache is not None:
+                    stats[f'{Kind.REQUEST.name}:{name}:{handler.__name__}'] = cache.stats()
+        return stats
+
     def get_handler(self, kind: Kind, name: str):
+        handlers = self.get_handlers(kind, name)
+        if handlers:
+            return handlers[0]
+
+    def get_handlers(self, kind: Kind, name: str) -> List[Callable]:
         handlers = self._handlers_map[kind]
         if name in handlers:
             return handlers[name]
-        elif '*' in handlers:
-            return handlers['*']
+        pattern = self._handler_patterns[kind].match(name)
+        if pattern is not None:
+            return handlers[pattern]
         logger.debug(f'Unhandled frame {kind.name}: {name}')
+        return []
 
     async def run_handler(self, kind: Kind, name: str, frame: Frame, timeout: float):
-        args = []
-        handler = self.get_handler(kind=kind, name=name)
-        if not handler:
+        """Run every handler for the frame, all sharing the one frame.
+
+        Returns the first result other than None in order of priority.
+        If handlers fail the others still run, then the first error is raised.
+        """
+        handlers = self.get_handlers(kind=kind, name=name)
+        if len(handlers) == 1:
+            return await self._run_one(handlers[0], kind, name, frame, timeout)
+        if not handlers:
             return
+        if self._fan_out == 'concurrent':
+            results = await asyncio.gather(
+                *[self._run_one(handler, kind, name, frame, timeout) for handler in handlers],
+                return_exceptions=True)
+        else:
+            results = []
+            for handler in handlers:
+                try:
+                    results.append(await self._run_one(handler, kind, name, frame, timeout))
+                except Exception as e:
+                    results.append(e)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        for result in results:
+            if result is not None:
+                return result
+
+    async def _run_one(self, handler: Callable, kind: Kind, name: str, frame: Frame, timeout: float):
+        args = []
         if handler.pass_frame:
             args.append(frame)
+        cache = self._handler_caches.get(handler)
+        if cache is not None:
+            # Hits skip the rate limits, concurrent misses share one run.
+            return await cache.get_or_run(
+                canonical_key(name, frame.data), partial(self._run_limited, handler, kind, name, frame, args, timeout))
+        return await self._run_limited(handler, kind, name, frame, args, timeout)
+
+    async def _run_limited(self, handler: Callable, kind: Kind, name: str, frame: Frame, args: list, timeout: float):
+        rate_limiter = getattr(handler, 'rate_limiter', None)
+        if rate_limiter is not None and not await rate_limiter.acquire(frame):
+            # Already counted by the rate limiter, shedding is no error.
+            logger.debug(f'Shed {kind.name}: {name} over the rate limit of {handler.__name__}')
+            return
+        if handler.stream:
+            # The agent consumes the async generator at the pace of the requester.
+            return handler(*args)
+        concurrency = getattr(handler, 'concurrency', None)
+        if not concurrency:
+            return await self._run_handler(handler, kind, name, args, self._timeout_for(handler, frame, timeout))
+        if handler not in self._handler_limits:
+            self._handler_limits[handler] = asyncio.Semaphore(concurrency)
+        async with self._handler_limits[handler]:
+            return await self._run_handler(handler, kind, name, args, self._timeout_for(handler, frame, timeout))
+
+    def _timeout_for(self, handler: Callable, frame: Frame, timeout: float) -> float:
+        """The handler's own timeout if it has one, else the given one,
+        cut short by the frame's deadline.
+        """
+        timeout = getattr(handler, 'timeout', None) or timeout
+        deadline = frame_deadline(frame)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        return timeout
+
+    async def _run_handler(self, handler: Callable, kind: Kind, name: str, args: list, timeout: float):
+        start = time.perf_counter()
+        error = timed_out = False
         try:
+            if timeout <= 0:
+                raise FuturesTimeoutError('Deadline passed before the handler ran')
             if handler.run_async:
                 return await asyncio.wait_for(
                     handler(*args),
                     timeout=timeout)
+            runner = self._sync_runners.get(handler)
+            if runner is None:
+                runner = self._sync_runners[handler] = self._sync_runner(handler)
             return await asyncio.wait_for(
-                sync_to_async(handler)(*args),
+                runner(*args),
                 timeout=timeout)
         except FuturesTimeoutError as e:
+            timed_out = True
             msg = f'Handler timed out for {kind.name}: {name}'
             logger.warning(msg)
             raise TimeoutError(msg) from e
-        except RateLimitException as e:
-            msg = f'Rate limiting handler for {kind.name}: {name}'
-            logger.warning(msg)
-            raise RuntimeError(msg) from e
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._stats.handler(kind, name).record(time.perf_counter() - start, error=error, timeout=timed_out)
 
     async def watch(self, name: str, coro: Awaitable):
         try:
             logger.debug(f'Awaiting coro {name}')
             await coro
-        except FuturesCancelledError:
+        except (FuturesCancelledError, asyncio.CancelledError):
             logger.debug(f'Spawned task {name} was cancelled')
         except Exception as e:
             msg = f'Encountered error in spawned task {name}'
@@ -0,0 +1,547 @@
+import asyncio
+import logging
+import os
+import re
+import socket
+import stat
+from collections import OrderedDict
+from functools import partial
+from typing import Callable
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from .codec import JSON_CODEC
+from .codec import negotiate_codec
+from .frame import Frame
+from .kind import Kind
+from .patterns import WILDCARD
+from .patterns import PatternTable
+
+logger = logging.getLogger(__name__)
+
+# Requests remembered so that their responses go back to the requester only.
+MAX_PENDING_REQUESTS = 65536
+# Frames a remote agent may have waiting to be written before more are dropped.
+OUTBOX_SIZE = 10000
+BATCH_MAX_FRAMES = 64
+BATCH_MAX_BYTES = 60 * 1024  # Fits a datagram.
+
+PROTOCOL_COMMANDS = ('login', 'join', 'leave', 'filter')
+LOGIN_REPLIES = ('login-ok', 'login-fail')
+FILTERED_KINDS = (('event', Kind.EVENT), ('message', Kind.MESSAGE), ('request', Kind.REQUEST))
+INDEXED_KINDS = (Kind.COMMAND, Kind.EVENT, Kind.MESSAGE, Kind.REQUEST)
+
+_local_brokers = {}  # Brokers serving queue:// endpoints in this process, by name.
+
+
+def local_broker(name: str) -> Optional['Broker']:
+    return _local_brokers.get(name)
+
+
+def frame_size(frame: Frame) -> Optional[int]:
+    """Size of the frame as it arrived on the wire, None if it never did."""
+    raw = getattr(frame, '_raw', None)
+    return len(raw) if raw is not None else None
+
+
+class Subscriber(object):
+    """An agent connected to the broker, with the spaces it joined
+    and the frames it asked for.
+    """
+
+    def __init__(self, name: str, deliver: Callable[[Frame], None]) -> None:
+        self.name = name
+        self.deliver = deliver
+        self.connected = True
+        self.logged_in = False
+        self.codec = JSON_CODEC
+        self.batch = False
+        self.spaces = set()
+        self.names = None  # Frame names accepted by kind, None until the agent sends a filter.
+        self.patterns = {}
+        self.size = None
+        self.session = None  # Of the agent, which it logs in with again on reconnecting.
+        self.indexed = []  # Keys it is found under in the broker's index.
+
+    def __repr__(self) -> str:
+        return f'<Subscriber {self.name}>'
+
+    def index_keys(self) -> List[tuple]:
+        """The (space, kind, name) keys the broker finds this subscriber under.
+
+        Every key is also made for the space None, which senders in all
+        spaces look up. The name is '*' for kinds taken by any name and
+        None for kinds with patterns, which are matched one by one.
+        """
+        if not self.logged_in or not self.spaces:
+            return []
+        names = []
+        for kind in INDEXED_KINDS:
+            accepted = None if self.names is None else self.names.get(kind)
+            if accepted is None or WILDCARD in accepted:
+                names.append((kind, WILDCARD))
+                continue
+            names.extend((kind, name) for name in accepted)
+            if kind in self.patterns:
+                names.append((kind, None))
+        return [(space, kind, name) for space in list(self.spaces) + [None] for kind, name in names]
+
+    def filter(self, data: dict) -> None:
+        names = data.get('names') or {}
+        self.names = {}
+        self.patterns = {}
+        for key, kind in FILTERED_KINDS:
+            self.names[kind] = set(names.get(key) or [])
+            patterns = (data.get('patterns') or {}).get(key) or {}
+            table = PatternTable()
+            for glob in patterns.get('glob') or []:
+                table.add(glob)
+            for regex in patterns.get('regex') or []:
+                try:
+                    table.add(re.compile(regex))
+                except re.error as e:
+                    logger.warning(f'Ignoring invalid pattern {regex!r} from {self.name}: {e}')
+            if len(table):
+                self.patterns[kind] = table
+        self.size = data.get('size') or names.get('size')
+
+
+class Broker(object):
+    """Routes frames between the agents that log in to it, to those
+    sharing a space with the sender whose filters accept the frame,
+    and responses back to the agent that sent the request.
+
+    Subscribers are kept in an index by space, kind and frame name,
+    updated as they join, leave and filter, so routing a frame costs
+    by the subscribers it goes to rather than all of them.
+
+    Agents in the same process connect on queue://name after
+    serve_queue(name) and exchange copies of frame objects without
+    encoding them, remote agents connect over websockets, datagrams,
+    TCP or unix sockets, and agents on the same host over shared memory.
+
+    Frames are only checked against the size an agent filters for when
+    they arrived encoded, frames passed in process are never encoded.
+    """
+
+    def __init__(self, tokens: Optional[Iterable[str]] = None) -> None:
+        self.tokens = None if tokens is None else set(tokens)  # None lets any token in.
+        self.routed = 0
+        self.delivered = 0
+        self.dropped = 0
+        self._subscribers = []
+        self._index = {}  # (space, kind, name) to the set of subscribers found under it.
+        self._requesters = OrderedDict()  # Request uuid to the subscriber waiting for responses.
+        self._queue_names = []
+        self._closers = []
+        self._streams = {}  # Stream connections accepted, to the tasks serving them.
+        self._sessions = {}  # Session of the agent to the subscriber it last logged in as.
+
+    def stats(self) -> dict:
+        return {
+            'subscribers': len(self._subscribers),
+            'routed': self.routed,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'pending_requests': len(self._requesters),
+            'index_keys': len(self._index),
+        }
+
+    def connect(self, name: str, deliver: Callable[[Frame], None]) -> Subscriber:
+        subscriber = Subscriber(name, deliver)
+        self._subscribers.append(subscriber)
+        return subscriber
+
+    def disconnect(self, subscriber: Subscriber) -> None:
+        if subscriber.connected:
+            subscriber.connected = False
+            self._subscribers.remove(subscriber)
+            self._unindex(subscriber)
+            if self._sessions.get(subscriber.session) is subscriber:
+                del self._sessions[subscriber.session]
+
+    def _reindex(self, subscriber: Subscriber) -> None:
+        self._unindex(subscriber)
+        subscriber.indexed = subscriber.index_keys()
+        for key in subscriber.indexed:
+            found = self._index.get(key)
+            if found is None:
+                found = self._index[key] = set()
+            found.add(subscriber)
+
+    def _unindex(self, subscriber: Subscriber) -> None:
+        for key in subscriber.indexed:
+            found = self._index[key]
+            found.discard(subscriber)
+            if not found:
+                del self._index[key]
+        subscriber.indexed = []
+
+    def receive(self, subscriber: Subscriber, frame: Frame) -> None:
+        """Handle a frame sent by subscriber."""
+        if not subscriber.logged_in or (frame.kind == Kind.COMMAND and frame.name == 'login'):
+            self._login(subscriber, frame)
+        elif frame.kind == Kind.COMMAND and frame.name in PROTOCOL_COMMANDS:
+            self._protocol_command(subscriber, frame)
+        else:
+            self.route(subscriber, frame)
+
+    def _login(self, subscriber: Subscriber, frame: Frame) -> None:
+        if frame.kind != Kind.COMMAND or frame.name != 'login':
+            logger.warning(f'Expected login from {subscriber.name}, got {frame.kind.name}: {frame.name}')
+            return
+        # Logging in again, say from the same address after a restart, starts over.
+        subscriber.logged_in = False
+        subscriber.spaces = set()
+        subscriber.names = None
+        subscriber.patterns = {}
+        self._unindex(subscriber)
+        data = frame.data
+        if self.tokens is not None and data.get('token') not in self.tokens:
+            logger.warning(f'Login failed for {subscriber.name}')
+            subscriber.deliver(frame.reply('login-fail', validate=False))
+            return
+        subscriber.codec = negotiate_codec(data.get('codecs') or [])
+        subscriber.batch = bool(data.get('batch'))
+        subscriber.logged_in = True
+        self._replace_session(subscriber, data.get('session'))
+        self._reindex(subscriber)
+        subscriber.deliver(frame.reply(
+            'login-ok', data={'codec': subscriber.codec.name, 'batch': subscriber.batch}, validate=False))
+
+    def _replace_session(self, subscriber: Subscriber, session: Optional[str]) -> None:
+        """Disconnect whoever last logged in with the session, the same agent
+        on a connection it gave up on, say a datagram peer on another port.
+        """
+        if not session:
+            return
+        previous = self._sessions.get(session)
+        if previous is not None and previous is not subscriber:
+            logger.debug(f'{subscriber.name} replaces {previous.name}, the same agent reconnecting')
+            self.disconnect(previous)
+        subscriber.session = session
+        self._sessions[session] = subscriber
+
+    def _protocol_command(self, subscriber: Subscriber, frame: Frame) -> None:
+        if frame.name == 'join':
+            subscriber.spaces.update(frame.data.get('spaces') or [])
+        elif frame.name == 'leave':
+            subscriber.spaces.difference_update(frame.data.get('spaces') or [])
+        elif frame.name == 'filter':
+            subscriber.filter(frame.data)
+        self._reindex(subscriber)
+
+    def route(self, sender: Subscriber, frame: Frame) -> None:
+        self.routed += 1
+        if frame.kind == Kind.RESPONSE:
+            requester = self._requesters.get(frame.meta.get('reply_to'))
+            if requester is not None and requester.connected:
+                self._deliver(requester, frame)
+            return
+        if frame.kind == Kind.REQUEST:
+            self._requesters[frame.uuid] = sender
+            if len(self._requesters) > MAX_PENDING_REQUESTS:
+                self._requesters.popitem(last=False)
+        if not sender.spaces:
+            return
+        # Senders in every space reach everyone, others reach their
+        # spaces and those who joined every space.
+        spaces = (None,) if WILDCARD in sender.spaces else tuple(sender.spaces) + (WILDCARD,)
+        index = self._index
+        kind = frame.kind
+        name = frame.name
+        found = []
+        for space in spaces:
+            for key in ((space, kind, name), (space, kind, WILDCARD)):
+                subscribers = index.get(key)
+                if subscribers:
+                    found.append(subscribers)
+            subscribers = index.get((space, kind, None))
+            if subscribers:
+                found.append({s for s in subscribers if s.patterns[kind].match(name) is not None})
+        if not found:
+            return
+        recipients = found[0] if len(found) == 1 else set().union(*found)
+        size = frame_size(frame)
+        for subscriber in recipients:
+            if subscriber is sender or (size is not None and subscriber.size and size > subscriber.size):
+                continue
+            self._deliver(subscriber, frame)
+
+    def _deliver(self, subscriber: Subscriber, frame: Frame) -> None:
+        try:
+            subscriber.deliver(frame)
+            self.delivered += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f'Dropped {frame.kind.name}: {frame.name} for {subscriber.name}, too many frames waiting')
+
+    ### In process
+
+    def serve_queue(self, name: str = 'local') -> None:
+        """Accept agents in this process connecting to queue://name."""
+        _local_brokers[name] = self
+        self._queue_names.append(name)
+
+    ### Remote
+
+    async def serve_websocket(self, host: str = '127.0.0.1', port: int = 26514) -> int:
+        """Accept agents over websockets, returns the port listened on."""
+        import websockets
+
+        server = await websockets.serve(self._serve_websocket, host, port)
+
+        async def close():
+            server.close()
+            await server.wait_closed()
+
+        self._closers.append(close)
+        return server.sockets[0].getsockname()[1]
+
+    async def _serve_websocket(self, websocket, path=None) -> None:
+        outbox = asyncio.Queue(OUTBOX_SIZE)
+        subscriber = self.connect(f'ws:{websocket.remote_address}', outbox.put_nowait)
+        writer = asyncio.ensure_future(self._write(subscriber, outbox, websocket.send))
+        try:
+            async for message in websocket:
+                self._receive_payload(subscriber, message)
+        except Exception as e:
+            logger.debug(f'Websocket of {subscriber.name} closed: {e!r}')
+        finally:
+            writer.cancel()
+            self.disconnect(subscriber)
+
+    async def serve_datagram(self, host: str = '127.0.0.1', port: int = 26514) -> int:
+        """Accept agents over datagrams, returns the port listened on."""
+        import asyncio_dgram
+
+        stream = await asyncio_dgram.bind((host, port))
+        task = asyncio.ensure_future(self._serve_datagram(stream))
+
+        async def close():
+            task.cancel()
+            stream.close()
+
+        self._closers.append(close)
+        return stream.sockname[1]
+
+    async def _serve_datagram(self, stream) -> None:
+        import asyncio_dgram
+
+        remotes = {}  # Address to subscriber and its writer.
+        try:
+            while True:
+                payload, address = await stream.recv()
+                if address not in remotes:
+                    for stale in [a for a, (s, _) in remotes.items() if not s.connected]:
+                        remotes.pop(stale)[1].cancel()
+                    outbox = asyncio.Queue(OUTBOX_SIZE)
+                    subscriber = self.connect(f'dgram:{address}', outbox.put_nowait)
+                    writer = asyncio.ensure_future(self._write(subscriber, outbox, _datagram_sender(stream, address)))
+                    remotes[address] = (subscriber, writer)
+                self._receive_payload(remotes[address][0], payload)
+        except asyncio_dgram.TransportClosed:
+            logger.debug('Datagram server closed')
+        finally:
+            for subscriber, writer in remotes.values():
+                writer.cancel()
+                self.disconnect(subscriber)
+
+    async def serve_shm(self, name: str = 'local') -> None:
+        """Accept agents on this host connecting to shm://name."""
+        from .transport.shm import ShmListener
+
+        listener = ShmListener(name, self._serve_shm)
+        listener.start()
+
+        async def close():
+            listener.close()
+
+        self._closers.append(close)
+
+    def _serve_shm(self, channel) -> None:
+        outbox = asyncio.Queue(OUTBOX_SIZE)
+        subscriber = self.connect(f'shm:{channel.id}', outbox.put_nowait)
+        writer = asyncio.ensure_future(self._write(subscriber, outbox, channel.send))
+
+        def receive():
+            for payload in channel.receive():
+                self._receive_payload(subscriber, payload)
+
+        def closed():
+            receive()  # What the agent wrote before it closed.
+            writer.cancel()
+            self.disconnect(subscriber)
+
+        channel.on_close(closed)
+        channel.listen(receive)
+        channel.connect_out()
+        channel.wake()
+
+    async def serve_tcp(self, host: str = '127.0.0.1', port: int = 26514, nodelay: bool = True) -> int:
+        """Accept agents over TCP with length prefixed frames,
+        returns the port listened on.
+        """
+        server = await asyncio.start_server(partial(self._serve_stream, 'tcp', nodelay=nodelay), host, port)
+
+        async def close():
+            server.close()
+            await server.wait_closed()
+
+        self._closers.append(close)
+        return server.sockets[0].getsockname()[1]
+
+    async def serve_unix(self, path: str, seqpacket: bool = False, mode: Optional[int] = None) -> None:
+        """Accept agents connecting to unix://path, with SOCK_SEQPACKET
+        rather than a stream when seqpacket is set.
+
+        Who may connect is left to the permissions of path, set to mode
+        if given, say 0o660 for the broker's group, or else by the umask.
+        """
+        if not seqpacket:
+            server = await asyncio.start_unix_server(partial(self._serve_stream, 'unix'), path)
+        else:
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)  # Left over by a broker that did not close, as start_unix_server does.
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            sock.bind(path)
+            sock.listen()
+            sock.setblocking(False)
+            task = asyncio.ensure_future(self._accept_packets(sock))
+        if mode is not None:
+            os.chmod(path, mode)
+
+        async def close():
+            if not seqpacket:
+                server.close()
+                await server.wait_closed()
+            else:
+                task.cancel()
+                sock.close()
+            if os.path.exists(path):
+                os.unlink(path)
+
+        self._closers.append(close)
+
+    async def _accept_packets(self, sock: socket.socket) -> None:
+        from .transport.stream import PacketConnection
+
+        loop = asyncio.get_event_loop()
+        connections = set()
+        try:
+            while True:
+                conn, _ = await loop.sock_accept(sock)
+                task = asyncio.ensure_future(self._serve_connection(PacketConnection(conn), 'unix'))
+                connections.add(task)
+                task.add_done_callback(connections.discard)
+        finally:
+            for task in connections:
+                task.cancel()
+
+    async def _serve_stream(self, scheme: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                            nodelay: Optional[bool] = None) -> None:
+        from .transport.stream import StreamConnection
+        from .transport.tcp import set_nodelay
+
+        if nodelay is not None:
+            set_nodelay(writer, nodelay)
+        connection = StreamConnection(reader, writer)
+        self._streams[connection] = asyncio.current_task()
+        try:
+            await self._serve_connection(connection, scheme)
+        finally:
+            del self._streams[connection]
+
+    async def _serve_connection(self, connection, scheme: str) -> None:
+        outbox = asyncio.Queue(OUTBOX_SIZE)
+        # Unix sockets of clients are seldom bound to a path.
+        subscriber = self.connect(f'{scheme}:{connection.peer or hex(id(connection))}', outbox.put_nowait)
+        writer = asyncio.ensure_future(self._write(subscriber, outbox, connection.send, together=True))
+        try:
+            while subscriber.connected:
+                self._receive_payload(subscriber, await connection.read())
+        except ConnectionError as e:
+            logger.debug(f'Connection of {subscriber.name} closed: {e!r}')
+        finally:
+            writer.cancel()
+            self.disconnect(subscriber)
+            await connection.close()
+
+    def _receive_payload(self, subscriber: Subscriber, payload) -> None:
+        codec = JSON_CODEC if isinstance(payload, str) or not subscriber.logged_in else subscriber.codec
+        try:
+            frames = codec.loads_many(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f'Dropped undecodable payload from {subscriber.name}: {e}')
+            return
+        for frame in frames:
+            self.receive(subscriber, frame)
+
+    async def _write(self, subscriber: Subscriber, outbox: asyncio.Queue, send, together: bool = False) -> None:
+        """Write what is waiting in outbox with send, called once per
+        payload or, when together is set, once with all of them.
+        """
+        try:
+            while True:
+                frames = [await outbox.get()]
+                while len(frames) < BATCH_MAX_FRAMES and not outbox.empty():
+                    frames.append(outbox.get_nowait())
+                if together:
+                    await send(list(self._payloads(subscriber, frames)))
+                    continue
+                for payload in self._payloads(subscriber, frames):
+                    await send(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f'Unable to write to {subscriber.name}: {e!r}')
+            self.disconnect(subscriber)
+
+    def _payloads(self, subscriber: Subscriber, frames: List[Frame]):
+        payloads = []
+        size = 0
+        for frame in frames:
+            if frame.kind == Kind.COMMAND and frame.name in LOGIN_REPLIES:
+                # The agent reads the reply to its login before it knows the codec.
+                yield JSON_CODEC.encode(frame)
+                continue
+            payload = subscriber.codec.encode(frame)
+            if not subscriber.batch:
+                yield payload
+                continue
+            if payloads and size + len(payload) > BATCH_MAX_BYTES:
+                yield subscriber.codec.join(payloads)
+                payloads = []
+                size = 0
+            payloads.append(payload)
+            size += len(payload)
+        if payloads:
+            yield subscriber.codec.join(payloads)
+
+    async def close(self) -> None:
+        for name in self._queue_names:
+            if _local_brokers.get(name) is self:
+                del _local_brokers[name]
+        self._queue_names = []
+        for close in self._closers:
+            await close()
+        self._closers = []
+        # Servers leave the connections they accepted open.
+        streams = dict(self._streams)
+        for connection in streams:
+            await connection.close()
+        if streams:
+            await asyncio.wait(streams.values())
+        for subscriber in list(self._subscribers):
+            self.disconnect(subscriber)
+        self._requesters.clear()
+
+
+def _datagram_sender(stream, address):
+    async def send(payload) -> None:
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        await stream.send(payload, address)
+
+    return send
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable
+from typing import Callable
+from typing import Optional
+
+_MISS = object()
+
+
+def canonical_key(name: str, data: Optional[dict]) -> str:
+    """Hash of the name and data, the same for equal data in any key order."""
+    canonical = json.dumps([name, data or {}], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ResponseCache(object):
+    """Keeps handler results for ttl seconds, evicting the least recently
+    used once it holds maxsize of them.
+
+    Concurrent calls for a key that is not cached share the one run of
+    the handler in flight. Failures are not cached, nor is None, which
+    sends no response, say for a request shed by a rate limit.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024) -> None:
+        if ttl <= 0 or maxsize < 1:
+            raise ValueError(f'Expected a positive ttl and maxsize, got: ttl={ttl}, maxsize={maxsize}')
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # Key to (expires at, value), least recently used first.
+        self._in_flight = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            'ttl': self.ttl,
+            'maxsize': self.maxsize,
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+        }
+
+    def get(self, key: str, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_run(self, key: str, run: Callable[[], Awaitable]):
+        while True:
+            value = self.get(key, _MISS)
+            if value is not _MISS:
+                self.hits += 1
+                return value
+            future = self._in_flight.get(key)
+            if future is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The run we waited on was cancelled rather than us, try again.
+                if not future.cancelled():
+                    raise
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await run()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved, whether or not anyone else waits.
+            raise
+        finally:
+            del self._in_flight[key]
+        if value is not None:
+            self.set(key, value)
+        future.set_result(value)
+        return value
@@ -0,0 +1,206 @@
+import json
+from typing import List
+
+from .frame import Frame
+from .frame import LazyFrame
+from .kind import Kind
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+# Frames are packed as a 5 element fixarray, batches as an ext type.
+FRAME_HEADER = b'\x95'
+BATCH_EXT_TYPE = 1
+
+# Below this size decoding a whole frame is cheaper than skipping over parts of it.
+LAZY_MIN_SIZE = 512
+
+
+class JsonCodec(object):
+    """Encodes frames as UTF-8 JSON, understood by every peer."""
+
+    name = 'json'
+    binary = False
+
+    def encode(self, frame: Frame) -> str:
+        raw = frame._encoded(self)
+        if raw is None:
+            return frame.to_json()
+        return raw.decode('utf-8') if isinstance(raw, bytes) else raw
+
+    def dumps(self, frame: Frame) -> bytes:
+        raw = frame._encoded(self)
+        if raw is None:
+            return frame.to_json().encode('utf-8')
+        return raw.encode('utf-8') if isinstance(raw, str) else raw
+
+    def join(self, payloads: List[str]) -> str:
+        """Combine encoded frames into one batch payload."""
+        if len(payloads) == 1:
+            return payloads[0]
+        return '[' + ','.join(payloads) + ']'
+
+    def loads_many(self, payload) -> List[Frame]:
+        """Decode a payload holding either a single frame or a batch."""
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        if not payload.lstrip().startswith('['):
+            return [self.loads(payload, lazy=True)]
+        return [Frame.from_dict(d, validate=False) for d in json.loads(payload)]
+
+    def loads(self, payload, lazy: bool = False) -> Frame:
+        if not lazy:
+            return Frame.from_json(payload, validate=False)
+        # JSON has no cheap way to skip over data and meta,
+        # so the lazy frame only keeps the payload for relaying.
+        d = json.loads(payload)
+        return LazyFrame._lazy(
+            payload,
+            self,
+            d['name'],
+            kind=d.get('kind', Kind.EVENT),
+            uuid=d.get('uuid'),
+            data=d.get('data'),
+            meta=d.get('meta'),
+        )
+
+
+class MsgpackCodec(object):
+    """Encodes frames as a MessagePack array:
+
+        [name, kind, uuid, data, meta]
+
+    The kind is sent as a small int, a hex uuid as 16 raw bytes
+    and empty data or meta as nil.
+    """
+
+    name = 'msgpack'
+    binary = True
+
+    def encode(self, frame: Frame) -> bytes:
+        return self.dumps(frame)
+
+    def join(self, payloads: List[bytes]) -> bytes:
+        """Combine encoded frames into one batch payload, an ext type
+        holding the frames back to back.
+        """
+        if len(payloads) == 1:
+            return payloads[0]
+        return msgpack.packb(msgpack.ExtType(BATCH_EXT_TYPE, b''.join(payloads)))
+
+    def loads_many(self, payload: bytes) -> List[Frame]:
+        """Decode a payload holding either a single frame or a batch."""
+        if payload[:1] == FRAME_HEADER:
+            return [self.loads(payload, lazy=True)]
+        try:
+            batch = msgpack.unpackb(payload)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+            raise ValueError(f'Unable to decode msgpack batch: {e}') from e
+        if not isinstance(batch, msgpack.ExtType) or batch.code != BATCH_EXT_TYPE:
+            raise ValueError(f'Expected a msgpack frame or batch, got {type(batch)}')
+        frames = []
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(batch.data)
+        start = 0
+        while start < len(batch.data):
+            unpacker.skip()
+            end = unpacker.tell()
+            frames.append(self.loads(batch.data[start:end], lazy=True))
+            start = end
+        return frames
+
+    def dumps(self, frame: Frame) -> bytes:
+        raw = frame._encoded(self)
+        if raw is not None:
+            return raw
+        uuid = frame.uuid
+        try:
+            uuid = bytes.fromhex(uuid) if len(uuid) == 32 else uuid
+        except ValueError:
+            pass
+        return msgpack.packb(
+            [
+                frame.name,
+                int(frame.kind),
+                uuid,
+                frame.data or None,
+                frame.meta or None,
+            ],
+            use_bin_type=True,
+        )
+
+    def loads(self, payload: bytes, lazy: bool = False) -> Frame:
+        try:
+            if lazy:
+                return self._loads_lazy(payload)
+            name, kind, uuid, data, meta = msgpack.unpackb(payload, raw=False)
+            if isinstance(uuid, bytes):
+                uuid = uuid.hex()
+            return Frame._trusted(name, kind=kind, uuid=uuid, data=data, meta=meta)
+        except (KeyError, ValueError, TypeError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+            raise ValueError(f'Unable to decode msgpack frame: {e}') from e
+
+    def _loads_lazy(self, payload: bytes) -> LazyFrame:
+        if len(payload) < LAZY_MIN_SIZE:
+            name, kind, uuid, data, meta = msgpack.unpackb(payload, raw=False)
+            if isinstance(uuid, bytes):
+                uuid = uuid.hex()
+            return LazyFrame._lazy(payload, self, name, kind=kind, uuid=uuid, data=data, meta=meta)
+        # Decode the header and only note where data and meta are.
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(payload)
+        if unpacker.read_array_header() != 5:
+            raise ValueError('Expected a frame with 5 fields')
+        name = unpacker.unpack()
+        kind = unpacker.unpack()
+        uuid = unpacker.unpack()
+        data_start = unpacker.tell()
+        unpacker.skip()
+        meta_start = unpacker.tell()
+        unpacker.skip()
+        if unpacker.tell() != len(payload):
+            raise ValueError('Unexpected trailing bytes after frame')
+        if isinstance(uuid, bytes):
+            uuid = uuid.hex()
+        # A nil (0xc0) data or meta needs no decoding.
+        data_raw = payload[data_start:meta_start] if payload[data_start] != 0xc0 else None
+        meta_raw = payload[meta_start:] if payload[meta_start] != 0xc0 else None
+        return LazyFrame._lazy(payload, self, name, kind=kind, uuid=uuid, data_raw=data_raw, meta_raw=meta_raw)
+
+    def loads_part(self, part: bytes):
+        return msgpack.unpackb(part, raw=False)
+
+
+JSON_CODEC = JsonCodec()
+
+CODECS = {JSON_CODEC.name: JSON_CODEC}
+
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def get_codec(name: str):
+    if not isinstance(name, str):
+        return name
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f'Unknown codec: {name!r}, expected one of {sorted(CODECS)}')
+
+
+def available_codecs() -> List[str]:
+    """Codec names in order of preference, binary codecs first."""
+    return sorted(CODECS, key=lambda name: (not CODECS[name].binary, name))
+
+
+def negotiate_codec(offered: List[str]):
+    """Pick the first offered codec that is available locally,
+    falling back to JSON for peers that do not offer any.
+    """
+    for name in offered or []:
+        if name in CODECS:
+            return CODECS[name]
+    return JSON_CODEC
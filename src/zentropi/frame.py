@@ -1,9 +1,11 @@
 import json
+from copy import deepcopy
+from os import urandom
 from typing import Dict
 from typing import Optional
-from uuid import uuid4
 
 from .kind import KIND_VALUES
+from .kind import KINDS
 from .kind import Kind
 
 
@@ -11,6 +13,10 @@ def deflate_dict(frame_as_dict: dict) -> dict:
     return {k: v for k, v in frame_as_dict.items() if v}
 
 
+def new_uuid() -> str:
+    return urandom(16).hex()
+
+
 class Frame(object):
     """Frame contains the information that is sent over wire
     between instances and agents.
@@ -31,11 +37,32 @@ class Frame(object):
         """
         self._name = name
         self._kind = Kind(kind or Kind.EVENT)
-        self._uuid = uuid or uuid4().hex
+        self._uuid = uuid or new_uuid()
         self._data = data
         self._meta = meta
         self.validate()
 
+    @classmethod
+    def _trusted(
+        cls,
+        name: str,
+        kind: Kind = Kind.EVENT,
+        uuid: Optional[str] = None,
+        data: Optional[Dict] = None,
+        meta: Optional[Dict] = None,
+    ) -> "Frame":
+        """
+        Construct a frame without validation, for frames built by
+        the library itself or decoded from a trusted peer.
+        """
+        frame = cls.__new__(cls)
+        frame._name = name
+        frame._kind = KINDS[kind]
+        frame._uuid = uuid or new_uuid()
+        frame._data = data
+        frame._meta = meta
+        return frame
+
     def validate(self) -> None:
         # name
         if not isinstance(self._name, str):
@@ -93,23 +120,121 @@ class Frame(object):
         )
 
     @staticmethod
-    def from_dict(frame_as_dict: dict) -> "Frame":
-        return Frame(**frame_as_dict)
+    def from_dict(frame_as_dict: dict, validate: bool = True) -> "Frame":
+        if validate:
+            return Frame(**frame_as_dict)
+        return Frame._trusted(**frame_as_dict)
+
+    def copy(self) -> "Frame":
+        """The same frame with data and meta of its own to change."""
+        return Frame._trusted(self._name, self._kind, self._uuid, _copied(self._data), _copied(self._meta))
 
     def to_json(self) -> str:
         return json.dumps(self.to_dict())
 
     @staticmethod
-    def from_json(frame_as_json) -> "Frame":
-        return Frame.from_dict(json.loads(frame_as_json))
+    def from_json(frame_as_json, validate: bool = True) -> "Frame":
+        return Frame.from_dict(json.loads(frame_as_json), validate=validate)
+
+    def _encoded(self, codec):
+        """Encoded form of this frame for codec, if already known."""
+        return None
+
+    def to_bytes(self, codec="json") -> bytes:
+        from .codec import get_codec
+
+        return get_codec(codec).dumps(self)
+
+    @staticmethod
+    def from_bytes(frame_as_bytes: bytes, codec="json") -> "Frame":
+        from .codec import get_codec
+
+        return get_codec(codec).loads(frame_as_bytes)
 
     def reply(
-        self, name: str = "", data: Optional[Dict] = None, meta: Optional[Dict] = None
+        self,
+        name: str = "",
+        data: Optional[Dict] = None,
+        meta: Optional[Dict] = None,
+        validate: bool = True,
     ) -> "Frame":
         if isinstance(meta, dict):
             meta.update({"reply_to": self.uuid})
         else:
             meta = {"reply_to": self.uuid}
+        frame = Frame if validate else Frame._trusted
         if self.kind == Kind.REQUEST:
-            return Frame(name=self.name, kind=Kind.RESPONSE, data=data, meta=meta)
-        return Frame(name=name or self.name, kind=self.kind, data=data, meta=meta)
+            return frame(name=self.name, kind=Kind.RESPONSE, data=data, meta=meta)
+        return frame(name=name or self.name, kind=self.kind, data=data, meta=meta)
+
+
+def _copied(d: Optional[Dict]) -> Optional[Dict]:
+    return None if d is None else dict(d)
+
+
+class LazyFrame(Frame):
+    """Frame decoded from the wire whose data and meta are decoded
+    on first access, keeping the raw payload it was decoded from.
+
+    Relaying a lazy frame whose data was never accessed and whose
+    meta is unchanged re-sends the raw payload instead of encoding
+    the frame again.
+    """
+
+    __slots__ = ("_raw", "_codec", "_data_raw", "_meta_raw", "_meta_copy")
+
+    @classmethod
+    def _lazy(
+        cls,
+        raw,
+        codec,
+        name: str,
+        kind: Kind,
+        uuid: str,
+        data_raw=None,
+        meta_raw=None,
+        data: Optional[Dict] = None,
+        meta: Optional[Dict] = None,
+    ) -> "LazyFrame":
+        frame = cls._trusted(name, kind=kind, uuid=uuid, data=data, meta=meta)
+        frame._raw = raw
+        frame._codec = codec
+        frame._data_raw = data_raw
+        frame._meta_raw = meta_raw
+        frame._meta_copy = None
+        return frame
+
+    @property
+    def data(self) -> dict:
+        if self._data_raw is not None:
+            self._data = self._codec.loads_part(self._data_raw)
+            self._data_raw = None
+        # The caller may modify data in place, so the raw payload is stale.
+        self._raw = None
+        return Frame.data.fget(self)
+
+    @property
+    def meta(self) -> dict:
+        if self._meta_raw is not None:
+            self._meta = self._codec.loads_part(self._meta_raw)
+            self._meta_raw = None
+        meta = Frame.meta.fget(self)
+        if self._meta_copy is None:
+            # Deep, as the caller may change nested values in place.
+            self._meta_copy = deepcopy(meta)
+        return meta
+
+    def copy(self) -> "LazyFrame":
+        # Undecoded parts are bytes, shared as they are, so the copy can still be relayed as it arrived.
+        frame = LazyFrame._lazy(
+            self._raw, self._codec, self._name, self._kind, self._uuid,
+            data_raw=self._data_raw, meta_raw=self._meta_raw, data=_copied(self._data), meta=_copied(self._meta))
+        frame._meta_copy = _copied(self._meta_copy)
+        return frame
+
+    def _encoded(self, codec):
+        if self._raw is None or codec is not self._codec:
+            return None
+        if self._meta_copy is not None and self._meta != self._meta_copy:
+            return None
+        return self._raw
@@ -30,3 +30,6 @@ KIND_LABELS = {
     int(Kind.REQUEST): Kind.REQUEST.name,
     int(Kind.RESPONSE): Kind.RESPONSE.name,
 }
+
+
+KINDS = {int(kind): kind for kind in Kind}
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from typing import List
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+QUANTILES = (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'), ('0.999', 'p99.9'))
+REQUEST_TIMEOUT = 5  # Seconds a scraper gets to send its request.
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class _Metrics(object):
+    """Collects samples grouped by metric, in the Prometheus text format."""
+
+    def __init__(self, agent_name: str) -> None:
+        self._agent = {'agent': agent_name}
+        self._metrics = {}  # Name to type, help and sample lines.
+
+    def add(self, name: str, metric_type: str, description: str, value, labels: Optional[dict] = None) -> None:
+        self._sample(name, metric_type, description, name, value, labels)
+
+    def summary(self, name: str, description: str, snapshot: dict, labels: Optional[dict] = None) -> None:
+        labels = labels or {}
+        for quantile, key in QUANTILES:
+            self.add(name, 'summary', description, snapshot[key], dict(labels, quantile=quantile))
+        self._sample(name, 'summary', description, f'{name}_sum', snapshot['sum'], labels)
+        self._sample(name, 'summary', description, f'{name}_count', snapshot['count'], labels)
+
+    def _sample(self, name: str, metric_type: str, description: str, sample: str, value, labels) -> None:
+        if name not in self._metrics:
+            self._metrics[name] = (metric_type, description, [])
+        self._metrics[name][2].append(f'{sample}{_labels(dict(self._agent, **(labels or {})))} {float(value)!r}')
+
+    def render(self) -> str:
+        lines = []
+        for name, (metric_type, description, samples) in self._metrics.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def _split_key(key: str) -> List[str]:
+    kind, _, name = key.partition(':')
+    return [kind.lower(), name]
+
+
+def render_metrics(agent) -> str:
+    """Render the agent's stats in the Prometheus text exposition format."""
+    stats = agent.stats()
+    metrics = _Metrics(agent.name)
+    for direction in ('sent', 'received'):
+        for kind, count in sorted(stats['frames'][direction].items()):
+            metrics.add(f'zentropi_frames_{direction}_total', 'counter',
+                        f'Frames {direction} by kind.', count, {'kind': kind.lower()})
+    transport = stats['transport']
+    if transport['name']:
+        for direction in ('sent', 'received'):
+            metrics.add(f'zentropi_transport_bytes_{direction}_total', 'counter',
+                        f'Payload bytes {direction} on the wire.', transport[f'bytes_{direction}'],
+                        {'transport': transport['name']})
+    send_queue = stats['send_queue']
+    if send_queue:
+        metrics.add('zentropi_send_queue_depth', 'gauge', 'Frames waiting to be sent.', send_queue['depth'])
+        metrics.add('zentropi_send_queue_dropped_total', 'counter',
+                    'Frames dropped by the send queue overflow policy.', send_queue['dropped'])
+        metrics.add('zentropi_send_queue_coalesced_total', 'counter',
+                    'Events replaced by a newer event while queued.', send_queue['coalesced'])
+        metrics.summary('zentropi_send_queue_delay_seconds', 'Time frames spent in the send queue.',
+                        send_queue['delay'])
+    metrics.add('zentropi_requests_in_flight', 'gauge', 'Requests waiting for a response.',
+                stats['in_flight_requests'])
+    metrics.add('zentropi_requests_expired_total', 'counter', 'Requests skipped as their deadline had passed.',
+                stats['expired_requests'])
+    metrics.add('zentropi_requests_coalesced_total', 'counter', 'Requests that shared an identical one in flight.',
+                stats['coalesced_requests'])
+    metrics.add('zentropi_tasks', 'gauge', 'Spawned tasks running.', stats['tasks'])
+    metrics.add('zentropi_reconnects_total', 'counter', 'Reconnection attempts.', stats['reconnects'])
+    for key, call_stats in sorted(stats['handlers'].items()):
+        kind, name = _split_key(key)
+        for counter in ('calls', 'errors', 'timeouts'):
+            metrics.add(f'zentropi_handler_{counter}_total', 'counter', f'Handler {counter}.',
+                        call_stats[counter], {'kind': kind, 'name': name})
+        metrics.summary('zentropi_handler_latency_seconds', 'Time handlers took to run.',
+                        call_stats['latency'], {'kind': kind, 'name': name})
+    for name, call_stats in sorted(stats['requests'].items()):
+        for counter in ('calls', 'errors', 'timeouts'):
+            metrics.add(f'zentropi_request_{counter}_total', 'counter', f'Request {counter}.',
+                        call_stats[counter], {'name': name})
+        metrics.summary('zentropi_request_latency_seconds', 'Time from sending a request to its response.',
+                        call_stats['latency'], {'name': name})
+    for key, limit_stats in sorted(stats['rate_limits'].items()):
+        kind, name = _split_key(key)
+        name, _, handler = name.rpartition(':')
+        for counter in ('shed', 'delayed'):
+            metrics.add(f'zentropi_rate_limit_{counter}_total', 'counter', f'Frames {counter} by rate limits.',
+                        limit_stats[counter], {'kind': kind, 'name': name, 'handler': handler})
+    for key, cache_stats in sorted(stats['caches'].items()):
+        kind, name = _split_key(key)
+        name, _, handler = name.rpartition(':')
+        labels = {'name': name, 'handler': handler}
+        for counter in ('hits', 'misses', 'coalesced'):
+            metrics.add(f'zentropi_cache_{counter}_total', 'counter', f'Cached request handler {counter}.',
+                        cache_stats[counter], labels)
+        metrics.add('zentropi_cache_size', 'gauge', 'Responses held by a request handler cache.',
+                    cache_stats['size'], labels)
+    return metrics.render()
+
+
+class MetricsExporter(object):
+    """Serves the agent's metrics over HTTP for Prometheus to scrape,
+    on /metrics, with nothing but asyncio streams.
+    """
+
+    def __init__(self, agent, host: str = '127.0.0.1', port: int = 9464) -> None:
+        self._agent = agent
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f'Serving metrics on http://{self.host}:{self.port}/metrics')
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=REQUEST_TIMEOUT)
+            while True:
+                header = await asyncio.wait_for(reader.readline(), timeout=REQUEST_TIMEOUT)
+                if header in (b'\r\n', b'\n', b''):
+                    break
+            method, path = (request_line.decode('latin-1').split() + ['', ''])[:2]
+            if method not in ('GET', 'HEAD'):
+                status, body = '405 Method Not Allowed', b'Method not allowed\n'
+            elif path.split('?', 1)[0] != '/metrics':
+                status, body = '404 Not Found', b'Not found\n'
+            else:
+                status, body = '200 OK', render_metrics(self._agent).encode('utf-8')
+            head = (
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'
+            )
+            writer.write(head.encode('latin-1') + (body if method != 'HEAD' else b''))
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f'Dropped metrics request: {e!r}')
+        except Exception:
+            logger.exception('Failed to serve metrics')
+        finally:
+            writer.close()
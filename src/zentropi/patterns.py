@@ -0,0 +1,117 @@
+import re
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Pattern
+from typing import Union
+
+WILDCARD = '*'
+
+_END = None  # Trie key under which a node stores the pattern ending there.
+_SCOPED_FLAGS = ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.VERBOSE, 'x'))
+
+
+def is_pattern(name: Union[str, Pattern]) -> bool:
+    """True for a compiled regex or a name with a wildcard, including a lone '*'."""
+    return not isinstance(name, str) or WILDCARD in name
+
+
+def glob_to_regex(glob: str) -> str:
+    return '.*'.join(re.escape(part) for part in glob.split(WILDCARD))
+
+
+class PatternTable(object):
+    """Matches frame names against wildcard patterns and regexes.
+
+    Patterns with a single leading or trailing wildcard, like *-on or
+    sensor.*, are kept in suffix and prefix tries, so matching walks the
+    name once however many of them there are. Other wildcard patterns
+    and compiled regexes are combined into one alternation.
+
+    The longest prefix wins, then the longest suffix, then the first
+    regex registered and last a lone '*'.
+    """
+
+    def __init__(self) -> None:
+        self._prefixes = {}
+        self._suffixes = {}
+        self._regexes = []  # Wildcard patterns and regexes, in order of registration.
+        self._combined = None
+        self._catch_all = None
+
+    def __len__(self) -> int:
+        return len(self.patterns())
+
+    def add(self, pattern: Union[str, Pattern]) -> None:
+        if pattern == WILDCARD:
+            self._catch_all = pattern
+        elif not isinstance(pattern, str) or pattern.count(WILDCARD) != 1 or WILDCARD not in (pattern[0], pattern[-1]):
+            self._regexes.append(pattern)
+            self._combined = None
+        elif pattern.endswith(WILDCARD):
+            self._insert(self._prefixes, pattern[:-1], pattern)
+        else:
+            self._insert(self._suffixes, reversed(pattern[1:]), pattern)
+
+    def _insert(self, trie: dict, chars, pattern: str) -> None:
+        node = trie
+        for char in chars:
+            node = node.setdefault(char, {})
+        node[_END] = pattern
+
+    def _longest(self, trie: dict, chars) -> Optional[str]:
+        node = trie
+        found = node.get(_END)
+        for char in chars:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(_END, found)
+        return found
+
+    def match(self, name: str) -> Optional[Union[str, Pattern]]:
+        """Return the registered pattern that matches name best, if any."""
+        found = self._longest(self._prefixes, name) if self._prefixes else None
+        if found is None and self._suffixes:
+            found = self._longest(self._suffixes, reversed(name))
+        if found is None and self._regexes:
+            if self._combined is None:
+                self._combined = self._compile()
+            match = self._combined.fullmatch(name)
+            if match:
+                found = self._regexes[int(match.lastgroup[2:])]
+        if found is None:
+            found = self._catch_all
+        return found
+
+    def _compile(self) -> Pattern:
+        alternatives = []
+        for index, pattern in enumerate(self._regexes):
+            if isinstance(pattern, str):
+                source = glob_to_regex(pattern)
+            else:
+                flags = ''.join(letter for flag, letter in _SCOPED_FLAGS if pattern.flags & flag)
+                source = f'(?{flags}:{pattern.pattern})' if flags else pattern.pattern
+            alternatives.append(f'(?P<_p{index}>{source})')
+        return re.compile('|'.join(alternatives))
+
+    def patterns(self) -> List[Union[str, Pattern]]:
+        patterns = []
+        for trie in (self._prefixes, self._suffixes):
+            stack = [trie]
+            while stack:
+                node = stack.pop()
+                patterns.extend(node[key] for key in node if key is _END)
+                stack.extend(node[key] for key in node if key is not _END)
+        patterns.extend(self._regexes)
+        if self._catch_all is not None:
+            patterns.append(self._catch_all)
+        return patterns
+
+    def describe(self) -> Dict[str, List[str]]:
+        """Patterns other than a lone '*' as sent to the server:
+        wildcard patterns as globs and compiled regexes by their source.
+        """
+        globs = sorted(p for p in self.patterns() if isinstance(p, str) and p != WILDCARD)
+        regexes = [p.pattern for p in self._regexes if not isinstance(p, str)]
+        return {'glob': globs, 'regex': regexes}
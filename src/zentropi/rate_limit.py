@@ -0,0 +1,142 @@
+import asyncio
+import time
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# What a rate limited handler does with a frame that arrives too soon:
+# drop it, or hold it until the rate allows for it.
+RATE_LIMIT_POLICIES = ('shed', 'delay')
+# Whether all frames for a handler share buckets, or each sender gets its own.
+RATE_LIMIT_KEYS = ('handler', 'sender')
+# Longest a delayed frame waits, frames that would wait longer are shed.
+RATE_LIMIT_MAX_DELAY = 10
+# Senders kept before idle buckets are forgotten.
+MAX_SENDERS = 1024
+
+
+def sender_of(frame) -> Optional[str]:
+    """The sender named in the frame's meta source, if any."""
+    meta = getattr(frame, 'meta', None) or {}
+    source = meta.get('source')
+    if isinstance(source, dict):
+        return source.get('uuid') or source.get('name')
+    return source
+
+
+class TokenBucket(object):
+    """Holds up to calls tokens, refilled at calls per period seconds.
+
+    Tokens may be taken in advance, leaving the bucket in debt,
+    which later callers wait out in turn.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, calls: int, period: float, now: Optional[float] = None) -> None:
+        self.rate = calls / period
+        self.capacity = calls
+        self.tokens = float(calls)
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available, as of the last refill."""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    @property
+    def full(self) -> bool:
+        return self.tokens >= self.capacity
+
+
+class RateLimiter(object):
+    """Admits frames for a handler within all of its rate limits.
+
+    Frames over the limit are shed, or with the delay policy held back
+    in order of arrival, so that bursts are smoothed out instead of lost.
+    """
+
+    def __init__(self,
+                 limits: List[Tuple[int, float]],
+                 policy: str = 'shed',
+                 key: str = 'handler',
+                 max_delay: float = RATE_LIMIT_MAX_DELAY) -> None:
+        if policy not in RATE_LIMIT_POLICIES:
+            raise ValueError(f'Expected rate limit policy to be one of {RATE_LIMIT_POLICIES}, got: {policy!r}')
+        if key not in RATE_LIMIT_KEYS:
+            raise ValueError(f'Expected rate limit key to be one of {RATE_LIMIT_KEYS}, got: {key!r}')
+        self.limits = limits
+        self.policy = policy
+        self.key = key
+        self.max_delay = max_delay
+        self.shed = 0
+        self.delayed = 0
+        self._buckets = {}  # Buckets by sender, or under None for the handler.
+
+    def stats(self) -> dict:
+        return {
+            'policy': self.policy,
+            'key': self.key,
+            'shed': self.shed,
+            'delayed': self.delayed,
+            'senders': len(self._buckets) if self.key == 'sender' else 0,
+        }
+
+    def _sender(self, frame) -> Optional[str]:
+        return sender_of(frame) if self.key == 'sender' else None
+
+    def _buckets_for(self, frame, now: float) -> List[TokenBucket]:
+        sender = self._sender(frame)
+        buckets = self._buckets.get(sender)
+        if buckets is None:
+            if len(self._buckets) >= MAX_SENDERS:
+                self._forget_idle(now)
+            buckets = self._buckets[sender] = [TokenBucket(calls, period, now) for calls, period in self.limits]
+        return buckets
+
+    def _forget_idle(self, now: float) -> None:
+        # A full bucket behaves like a new one, so it can go.
+        for sender, buckets in list(self._buckets.items()):
+            for bucket in buckets:
+                bucket.refill(now)
+            if all(bucket.full for bucket in buckets):
+                del self._buckets[sender]
+
+    def reserve(self, frame) -> Optional[float]:
+        """Take a token for the frame from every bucket and return
+        the seconds it must wait for them, or None if it is shed.
+        """
+        now = time.monotonic()
+        buckets = self._buckets_for(frame, now)
+        wait = 0.0
+        for bucket in buckets:
+            bucket.refill(now)
+            wait = max(wait, bucket.wait_time())
+        if wait and (self.policy == 'shed' or wait > self.max_delay):
+            self.shed += 1
+            return None
+        for bucket in buckets:
+            bucket.tokens -= 1
+        if wait:
+            self.delayed += 1
+        return wait
+
+    async def acquire(self, frame) -> bool:
+        """Wait until the frame may be handled, False if it was shed."""
+        wait = self.reserve(frame)
+        if wait is None:
+            return False
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # Hand the tokens back to the frames queued behind.
+                for bucket in self._buckets.get(self._sender(frame), []):
+                    bucket.tokens += 1
+                raise
+        return True
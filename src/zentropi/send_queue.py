@@ -0,0 +1,112 @@
+import time
+from asyncio import Queue
+from asyncio import QueueFull
+from collections import deque
+from enum import Enum
+
+from .frame import Frame
+from .kind import Kind
+from .stats import Histogram
+
+
+class Overflow(Enum):
+    """Overflow enumerates what a full SendQueue does with another frame."""
+    BLOCK = 'block'  # Wait for room, pushing back on the sender.
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    COALESCE = 'coalesce'  # Replace a queued event of the same name, else drop oldest.
+
+
+class SendQueue(Queue):
+    """Bounded queue of outbound frames with a selectable overflow policy.
+
+    Coalescing only applies to events, where a newer value
+    (such as from Agent.measure) supersedes an unsent one.
+    Every other kind of frame is dropped oldest first instead.
+    """
+
+    def __init__(self, maxsize: int = 0, overflow=Overflow.BLOCK) -> None:
+        super().__init__(maxsize=maxsize)
+        self.overflow = Overflow(overflow)
+        self.dropped = 0
+        self.coalesced = 0
+        self.delay = Histogram()  # Seconds frames were queued for until sent.
+
+    def _init(self, maxsize):
+        # Frames are queued in [frame, queued at] lists, so that a coalesced
+        # frame can be swapped in without losing its place.
+        self._queue = deque()
+        self._latest = {}
+
+    def _put(self, frame: Frame):
+        slot = [frame, time.monotonic()]
+        self._queue.append(slot)
+        if frame.kind == Kind.EVENT:
+            self._latest[frame.name] = slot
+
+    def _get(self) -> Frame:
+        slot = self._pop()
+        self.delay.record(time.monotonic() - slot[1])
+        return slot[0]
+
+    def _pop(self) -> list:
+        slot = self._queue.popleft()
+        if self._latest.get(slot[0].name) is slot:
+            del self._latest[slot[0].name]
+        return slot
+
+    @property
+    def depth(self) -> int:
+        return self.qsize()
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.depth,
+            'maxsize': self.maxsize,
+            'overflow': self.overflow.value,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'delay': self.delay.snapshot(),
+        }
+
+    async def put(self, frame: Frame) -> None:
+        if self.overflow is Overflow.BLOCK:
+            return await super().put(frame)
+        self.put_nowait(frame)
+
+    def put_nowait(self, frame: Frame) -> None:
+        if self.full():
+            if self.overflow is Overflow.BLOCK:
+                raise QueueFull
+            if self.overflow is Overflow.DROP_NEWEST:
+                self.dropped += 1
+                return
+            if self.overflow is Overflow.COALESCE and self._coalesce(frame):
+                return
+            self._drop_oldest()
+        super().put_nowait(frame)
+
+    def requeue(self, frames) -> None:
+        """Put frames back at the front of the queue in their original order,
+        for frames taken off the queue that could not be sent.
+        These may exceed maxsize, but then no more frames will be
+        accepted until the queue drains below it.
+        """
+        now = time.monotonic()
+        for frame in reversed(frames):
+            self._queue.appendleft([frame, now])
+            self._unfinished_tasks += 1
+            self._finished.clear()
+            self._wakeup_next(self._getters)
+
+    def _coalesce(self, frame: Frame) -> bool:
+        if frame.kind != Kind.EVENT or frame.name not in self._latest:
+            return False
+        self._latest[frame.name][0] = frame
+        self.coalesced += 1
+        return True
+
+    def _drop_oldest(self) -> None:
+        self._pop()
+        self.task_done()
+        self.dropped += 1
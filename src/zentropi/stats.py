@@ -0,0 +1,149 @@
+from typing import Dict
+
+# Values are recorded in microseconds. Below 2 ** SUB_BUCKET_BITS each value
+# has a bucket of its own, above it every power of two is split into
+# 2 ** (SUB_BUCKET_BITS - 1) buckets, which keeps the relative error
+# within 1 / 2 ** (SUB_BUCKET_BITS - 1), about 3% for 6 bits.
+SUB_BUCKET_BITS = 6
+_LINEAR = 1 << SUB_BUCKET_BITS
+_HALF = _LINEAR >> 1
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _bucket(value: int) -> int:
+    if value < _LINEAR:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return _LINEAR + (shift - 1) * _HALF + (value >> shift) - _HALF
+
+
+def _bucket_value(bucket: int) -> int:
+    """The middle of the range of values counted in bucket."""
+    if bucket < _LINEAR:
+        return bucket
+    shift = (bucket - _LINEAR) // _HALF + 1
+    lowest = ((bucket - _LINEAR) % _HALF + _HALF) << shift
+    return lowest + (1 << shift) // 2
+
+
+class Histogram(object):
+    """Counts durations in log-linear buckets, in the manner of an HDR
+    histogram, so that percentiles cost memory by the range of values
+    rather than the number recorded.
+    """
+
+    __slots__ = ('count', 'total', 'min', 'max', '_buckets')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._buckets = {}
+
+    def record(self, seconds: float) -> None:
+        if seconds < 0:
+            seconds = 0.0
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        bucket = _bucket(int(seconds * 1e6))
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, percentile: float) -> float:
+        """Seconds below which percentile percent of the values fall."""
+        if not self.count:
+            return 0.0
+        rank = max(1, -int(-self.count * percentile // 100))
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return min(max(_bucket_value(bucket) / 1e6, self.min), self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        snapshot = {
+            'count': self.count,
+            'min': self.min or 0.0,
+            'max': self.max or 0.0,
+            'mean': self.total / self.count if self.count else 0.0,
+            'sum': self.total,
+        }
+        for percentile in PERCENTILES:
+            snapshot[f'p{percentile:g}'] = self.percentile(percentile)
+        return snapshot
+
+
+class CallStats(object):
+    """Calls, errors and timeouts of a handler or request, and how long they took."""
+
+    __slots__ = ('calls', 'errors', 'timeouts', 'latency')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency = Histogram()
+
+    def record(self, seconds: float, error: bool = False, timeout: bool = False) -> None:
+        self.calls += 1
+        self.errors += error
+        self.timeouts += timeout
+        self.latency.record(seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'latency': self.latency.snapshot(),
+        }
+
+
+class Stats(object):
+    """Call statistics of handlers by kind and frame name,
+    of requests sent by request name and frame counts by kind.
+    """
+
+    def __init__(self) -> None:
+        self.handlers = {}
+        self.requests = {}
+        self.frames_sent = {}
+        self.frames_received = {}
+        self.expired = 0  # Requests skipped as their deadline passed before dispatch.
+        self.coalesced = 0  # Requests sent that joined an identical one in flight.
+
+    def sent(self, frame) -> None:
+        kind = frame.kind.name
+        self.frames_sent[kind] = self.frames_sent.get(kind, 0) + 1
+
+    def received(self, frame) -> None:
+        kind = frame.kind.name
+        self.frames_received[kind] = self.frames_received.get(kind, 0) + 1
+
+    def handler(self, kind, name: str) -> CallStats:
+        key = f'{kind.name}:{name}'
+        stats = self.handlers.get(key)
+        if stats is None:
+            stats = self.handlers[key] = CallStats()
+        return stats
+
+    def request(self, name: str) -> CallStats:
+        stats = self.requests.get(name)
+        if stats is None:
+            stats = self.requests[name] = CallStats()
+        return stats
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {
+            'handlers': {key: stats.snapshot() for key, stats in self.handlers.items()},
+            'requests': {key: stats.snapshot() for key, stats in self.requests.items()},
+            'frames': {'sent': dict(self.frames_sent), 'received': dict(self.frames_received)},
+            'expired_requests': self.expired,
+            'coalesced_requests': self.coalesced,
+        }
@@ -0,0 +1,75 @@
+import asyncio
+
+from .frame import Frame
+from .kind import Kind
+
+STREAM_CREDIT = "stream-credit"
+STREAM_CREDIT_TIMEOUT = 10  # Seconds a responder waits for the requester to catch up.
+
+
+def unwrap_response(frame: Frame):
+    if "_response" in frame.data:
+        return frame.data["_response"]
+    return frame.data
+
+
+class ResponseStream(object):
+    """Iterates over the chunks of a streamed response in sequence order.
+
+    Every chunk is a RESPONSE frame whose meta has reply_to, seq and,
+    on the last frame (which carries no chunk), end. The responder may
+    only send window chunks ahead of what was consumed here, so credit
+    is handed back with stream-credit commands as chunks are consumed.
+    A plain single response counts as a stream of one chunk.
+    """
+
+    def __init__(self, agent, request: Frame, timeout: float, window: int) -> None:
+        self._agent = agent
+        self._request = request
+        self._timeout = timeout
+        self._window = window
+        self._frames = asyncio.Queue()
+        self._pending = {}
+        self._next_seq = 0
+        self._consumed = 0
+        self.done = False
+
+    def feed(self, frame: Frame) -> None:
+        seq = frame.meta.get("seq")
+        if seq is None:
+            self._frames.put_nowait(frame)
+            self._frames.put_nowait(None)
+            return
+        self._pending[seq] = frame
+        while self._next_seq in self._pending:
+            frame = self._pending.pop(self._next_seq)
+            self._next_seq += 1
+            self._frames.put_nowait(None if frame.meta.get("end") else frame)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        try:
+            frame = await asyncio.wait_for(self._frames.get(), timeout=self._timeout)
+        except asyncio.TimeoutError as e:
+            raise TimeoutError("Timed out waiting for response") from e
+        if frame is None:
+            self.done = True
+            raise StopAsyncIteration
+        self._consumed += 1
+        if self._consumed >= max(1, self._window // 2):
+            await self._grant_credit(self._consumed)
+            self._consumed = 0
+        return unwrap_response(frame)
+
+    async def _grant_credit(self, credit: int) -> None:
+        frame = Frame._trusted(
+            STREAM_CREDIT,
+            kind=Kind.COMMAND,
+            data={"credit": credit},
+            meta={"reply_to": self._request.uuid},
+        )
+        await self._agent.send(frame)
@@ -0,0 +1,71 @@
+import asyncio
+from heapq import heappop
+from heapq import heappush
+from typing import Optional
+
+
+class TimerWheel(object):
+    """Fails futures with TimeoutError once their timeout passes.
+
+    Timeouts are rounded up to the next tick of resolution seconds and
+    futures due on the same tick share one bucket, so a single loop
+    timer serves every pending future instead of one wait_for task each.
+
+    Futures that complete before their timeout should be discarded with
+    the handle add returned, or their results are held until the tick.
+    """
+
+    def __init__(self, resolution: float = 0.01, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self._resolution = resolution
+        self._loop = loop
+        self._buckets = {}  # Tick to future to message, emptied buckets stay until their tick.
+        self._ticks = []  # Heap of ticks with a bucket.
+        self._handle = None
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def add(self, future: asyncio.Future, timeout: float, message: str = 'Timed out') -> int:
+        """Fail future after timeout seconds, returns the handle to discard it with."""
+        loop = self._loop or asyncio.get_event_loop()
+        tick = self._tick(loop.time() + timeout)
+        if tick not in self._buckets:
+            self._buckets[tick] = {}
+            heappush(self._ticks, tick)
+            if self._ticks[0] == tick:
+                self._schedule(loop)
+        self._buckets[tick][future] = message
+        return tick
+
+    def discard(self, future: asyncio.Future, handle: int) -> None:
+        bucket = self._buckets.get(handle)
+        if bucket is not None:
+            bucket.pop(future, None)
+
+    def _tick(self, when: float) -> int:
+        """The first tick at or after when, so that no future fails early."""
+        tick = -int(-when // self._resolution)
+        return tick + 1 if tick * self._resolution < when else tick
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._handle:
+            self._handle.cancel()
+        self._handle = loop.call_at(self._ticks[0] * self._resolution, self._expire, loop)
+
+    def _expire(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._handle = None
+        # Compared by the time of the tick, as scheduled, the loop may call a little early.
+        now = loop.time()
+        while self._ticks and self._ticks[0] * self._resolution <= now:
+            for future, message in self._buckets.pop(heappop(self._ticks)).items():
+                if not future.done():
+                    future.set_exception(TimeoutError(message))
+        if self._ticks:
+            self._schedule(loop)
+
+    def cancel(self) -> None:
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        self._buckets.clear()
+        self._ticks.clear()
@@ -1,11 +1,55 @@
 from abc import ABC
 from abc import abstractmethod
+from typing import List
 
+from ..codec import JSON_CODEC
+from ..codec import available_codecs
+from ..codec import negotiate_codec
 from ..frame import Frame
+from ..kind import Kind
 
 
 class BaseTransport(ABC):  # pragma: no cover
     connected = False
+    codec = JSON_CODEC
+    codecs = None  # Codec names offered at login, defaults to all available.
+    batch = False  # Whether the peer accepts several frames per message.
+    bytes_sent = 0  # Payload sizes, counting characters for text payloads.
+    bytes_received = 0
+    session = None  # Sent at login so the broker knows a reconnect of the same agent.
+
+    def login_frame(self, token) -> Frame:
+        data = {'token': token, 'codecs': list(self.codecs or available_codecs()), 'batch': True}
+        if self.session:
+            data['session'] = self.session
+        return Frame('login', kind=Kind.COMMAND, data=data)
+
+    def accept_login(self, endpoint, auth_ack: Frame) -> None:
+        if not auth_ack.name == 'login-ok':
+            raise PermissionError(f'Unable to connect to {endpoint}, got {auth_ack.to_dict()}')
+        # Peers that do not know about codecs or batches reply
+        # without them and get one JSON frame per message.
+        self.codec = negotiate_codec([auth_ack.data.get('codec')])
+        self.batch = bool(auth_ack.data.get('batch'))
+
+    def batch_payloads(self, frames: List[Frame], max_bytes: int):
+        """Encode frames into as few payloads as fit within max_bytes."""
+        payloads = []
+        size = 0
+        for frame in frames:
+            payload = self.codec.encode(frame)
+            if payloads and size + len(payload) > max_bytes:
+                yield self.codec.join(payloads)
+                payloads = []
+                size = 0
+            payloads.append(payload)
+            size += len(payload)
+        if payloads:
+            yield self.codec.join(payloads)
+
+    async def send_batch(self, frames: List[Frame], max_bytes: int) -> None:
+        for frame in frames:
+            await self.send(frame)
 
     @abstractmethod
     async def connect(self, endpoint, token) -> None:
@@ -1,30 +1,35 @@
+from collections import deque
+from typing import List
+
 import asyncio_dgram
-from ..frame import Frame
-from ..kind import Kind
+from ..codec import JSON_CODEC
 from .base import BaseTransport
 
 
+# Leave room for IP and UDP headers within the 64 KB datagram limit.
+MAX_DATAGRAM_SIZE = 60 * 1024
+
+
 class DatagramTransport(BaseTransport):
     def __init__(self):
         self._host = '127.0.0.1'
         self._port = 26514
         self.connection = None
         self.connected = False
-    
-    async def connect(self, endpoint, token):
-        from zentropi import Kind
-        from zentropi import Frame
+        self._received = deque()
 
+    async def connect(self, endpoint, token):
         self.token = token
         self.endpoint = endpoint
+        self.codec = JSON_CODEC
+        self.batch = False
+        self._received.clear()
         self._host, self._port = endpoint.replace('dgram://', '').split(':')
         self.connection = await asyncio_dgram.connect((self._host, self._port))
-        await self.send(Frame('login', kind=Kind.COMMAND, data=dict(token=token)))
+        await self.send(self.login_frame(token))
         auth_ack = await self.recv()
-        if auth_ack.name == 'login-ok':
-            self.connected = True
-        else:
-            raise PermissionError(f'Unable to connect to {endpoint}, got {auth_ack.to_dict()}')
+        self.accept_login(endpoint, auth_ack)
+        self.connected = True
 
 
     async def close(self):
@@ -32,9 +37,24 @@ class DatagramTransport(BaseTransport):
         self.connected = False
 
     async def send(self, frame):
-        await self.connection.send(frame.to_json().encode('utf-8'))
+        payload = self.codec.dumps(frame)
+        await self.connection.send(payload)
+        self.bytes_sent += len(payload)
+
+    async def send_batch(self, frames: List, max_bytes: int) -> None:
+        if not self.batch:
+            return await super().send_batch(frames, max_bytes)
+        for payload in self.batch_payloads(frames, min(max_bytes, MAX_DATAGRAM_SIZE)):
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            await self.connection.send(payload)
+            self.bytes_sent += len(payload)
 
     async def recv(self):
+        if self._received:
+            return self._received.popleft()
         data, remote_addr = await self.connection.recv()
-        frame = Frame.from_json(data.decode('utf-8'))
-        return frame
+        self.bytes_received += len(data)
+        frames = self.codec.loads_many(data)
+        self._received.extend(frames[1:])
+        return frames[0]
@@ -1,29 +1,72 @@
 from asyncio import Queue
+from typing import List
 
+from ..broker import OUTBOX_SIZE
+from ..broker import local_broker
 from ..frame import Frame
 from .base import BaseTransport
 
 
 class QueueTransport(BaseTransport):
+    """Passes frames through a pair of queues, or to the broker
+    serving queue://name in this process, if there is one.
+
+    Frames from the broker are copies, with data and meta of their own
+    but sharing any values nested in them with the sender's frame.
+    """
+
     def __init__(self):
         self.queue_recv = Queue()
         self.queue_send = Queue()
         self.connected = False
         self.token = None
         self.endpoint = ''
+        self._broker = None
+        self._subscriber = None
 
     async def connect(self, endpoint, token):
-        self.connected = True
         self.token = token
         self.endpoint = endpoint
+        self._broker = local_broker(endpoint.replace('queue://', '', 1))
+        if self._broker is not None:
+            # Bounded like the outbox of a remote agent, the broker drops frames for an agent that falls behind.
+            self.queue_recv = Queue(OUTBOX_SIZE)
+            self._subscriber = self._broker.connect(endpoint, self._deliver)
+            await self.send(self.login_frame(token))
+            auth_ack = await self.recv()
+            try:
+                self.accept_login(endpoint, auth_ack)
+            except PermissionError:
+                self._broker.disconnect(self._subscriber)
+                raise
+        self.connected = True
+
+    def _deliver(self, frame: Frame) -> None:
+        # Every agent gets a frame of its own, so that handlers changing
+        # data or meta do not change it for the sender and other agents.
+        self.queue_recv.put_nowait(frame.copy())
 
     async def close(self):
+        if self._broker is not None:
+            self._broker.disconnect(self._subscriber)
+            self._broker = None
         self.connected = False
         self.token = None
 
     async def send(self, frame: Frame) -> None:
+        if self._broker is not None:
+            self._broker.receive(self._subscriber, frame)
+            return
         await self.queue_send.put(frame)
 
+    async def send_batch(self, frames: List[Frame], max_bytes: int) -> None:
+        if self._broker is not None:
+            for frame in frames:
+                self._broker.receive(self._subscriber, frame)
+            return
+        for frame in frames:
+            self.queue_send.put_nowait(frame)
+
     async def recv(self) -> Frame:
         return await self.queue_recv.get()
 
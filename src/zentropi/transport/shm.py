@@ -0,0 +1,390 @@
+import asyncio
+import errno
+import logging
+import os
+import struct
+import tempfile
+from collections import deque
+from typing import Callable
+from typing import List
+from typing import Optional
+
+try:
+    from multiprocessing import resource_tracker
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    resource_tracker = shared_memory = None
+
+from ..codec import JSON_CODEC
+from ..frame import Frame
+from .base import BaseTransport
+
+logger = logging.getLogger(__name__)
+
+RING_SIZE = 1024 * 1024  # Bytes of payloads each direction holds.
+CONNECT_TIMEOUT = 5
+FULL_RING_DELAY = 0.0005  # Seconds between looking for room in a full ring.
+
+# A ring starts with its read and write positions, which only ever grow,
+# on a cache line of their own.
+_POSITIONS = struct.Struct('<QQ')
+_POSITION = struct.Struct('<Q')
+_LENGTH = struct.Struct('<I')
+_RING_HEADER_SIZE = 64
+
+
+def shm_available() -> bool:
+    return shared_memory is not None and hasattr(os, 'mkfifo')
+
+
+def rendezvous_path(name: str) -> str:
+    """The named pipe on which agents announce their channel to the broker serving shm://name."""
+    return os.path.join(tempfile.gettempdir(), f'zentropi-{name}.connect')
+
+
+def _shared_memory(name: str, create: bool = False, size: int = 0):
+    """A segment the resource tracker leaves alone, channels remove their own."""
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:  # Before Python 3.13.
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unlink(shm) -> None:
+    """Remove the segment unless the peer already has."""
+    tracked = not hasattr(shm, '_track')
+    if tracked:
+        # Before Python 3.13 unlink stops tracking too, which has already been done.
+        resource_tracker.register(shm._name, 'shared_memory')
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        if tracked:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+def _remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _wakeup_path(channel_id: str, direction: str) -> str:
+    return os.path.join(tempfile.gettempdir(), f'zentropi-{channel_id}.{direction}')
+
+
+class Ring(object):
+    """Length prefixed payloads in a buffer shared by one writer and one reader."""
+
+    def __init__(self, buffer: memoryview, capacity: int) -> None:
+        self.capacity = capacity
+        self._header = buffer[:_RING_HEADER_SIZE]
+        self._data = buffer[_RING_HEADER_SIZE:_RING_HEADER_SIZE + capacity]
+
+    def put(self, payload: bytes) -> bool:
+        """Copy payload into the ring, False if there is no room for it yet."""
+        size = _LENGTH.size + len(payload)
+        if size > self.capacity:
+            raise ValueError(f'Expected a payload of at most {self.capacity - _LENGTH.size} bytes, got: {len(payload)}')
+        read, write = _POSITIONS.unpack_from(self._header)
+        if size > self.capacity - (write - read):
+            return False
+        self._copy_in(write, _LENGTH.pack(len(payload)))
+        self._copy_in(write + _LENGTH.size, payload)
+        # The reader only looks at the payload once the write position moves past it.
+        _POSITION.pack_into(self._header, _POSITION.size, write + size)
+        return True
+
+    def get(self) -> Optional[bytes]:
+        read, write = _POSITIONS.unpack_from(self._header)
+        if read == write:
+            return None
+        length, = _LENGTH.unpack(self._copy_out(read, _LENGTH.size))
+        payload = self._copy_out(read + _LENGTH.size, length)
+        _POSITION.pack_into(self._header, 0, read + _LENGTH.size + length)
+        return payload
+
+    def _copy_in(self, position: int, data: bytes) -> None:
+        data = memoryview(data)
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        self._data[start:start + first] = data[:first]
+        if first < len(data):
+            self._data[:len(data) - first] = data[first:]
+
+    def _copy_out(self, position: int, size: int) -> bytes:
+        start = position % self.capacity
+        end = start + size
+        if end <= self.capacity:
+            return bytes(self._data[start:end])
+        return bytes(self._data[start:]) + bytes(self._data[:end - self.capacity])
+
+    def release(self) -> None:
+        self._header.release()
+        self._data.release()
+
+
+class ShmChannel(object):
+    """A shared memory segment holding a ring each way between an agent
+    and the broker, and a named pipe each way to wake up the reader.
+
+    The agent creates the channel and removes it when it is done, the
+    broker attaches to it. Either side closing its pipes tells the other,
+    which removes the channel too in case the agent died without closing.
+    """
+
+    def __init__(self, channel_id: str, shm, owner: bool) -> None:
+        self.id = channel_id
+        self.closed = False
+        self._shm = shm
+        self._owner = owner
+        span = _RING_HEADER_SIZE + RING_SIZE
+        rings = [Ring(shm.buf[i * span:(i + 1) * span], RING_SIZE) for i in range(2)]
+        # The agent writes to the first ring and wakes the broker with the up pipe.
+        if owner:
+            self._out, self._in = rings
+            self._wakeup_in, self._wakeup_out = _wakeup_path(channel_id, 'down'), _wakeup_path(channel_id, 'up')
+        else:
+            self._in, self._out = rings
+            self._wakeup_in, self._wakeup_out = _wakeup_path(channel_id, 'up'), _wakeup_path(channel_id, 'down')
+        self._in_fd = None
+        self._out_fd = None
+        self._on_wakeup = None
+        self._on_close = None
+        self._unread = []  # Payloads left in the ring when the peer closed.
+        self._peer_closed = False
+
+    @classmethod
+    def create(cls) -> 'ShmChannel':
+        channel_id = os.urandom(6).hex()
+        shm = _shared_memory(f'zentropi-{channel_id}', create=True, size=2 * (_RING_HEADER_SIZE + RING_SIZE))
+        for direction in ('up', 'down'):
+            os.mkfifo(_wakeup_path(channel_id, direction), 0o600)
+        return cls(channel_id, shm, owner=True)
+
+    @classmethod
+    def attach(cls, channel_id: str) -> 'ShmChannel':
+        shm = _shared_memory(f'zentropi-{channel_id}')
+        return cls(channel_id, shm, owner=False)
+
+    def listen(self, on_wakeup: Callable[[], None]) -> None:
+        """Call on_wakeup whenever the peer has written, or closed."""
+        self._on_wakeup = on_wakeup
+        self._in_fd = os.open(self._wakeup_in, os.O_RDONLY | os.O_NONBLOCK)
+        asyncio.get_event_loop().add_reader(self._in_fd, self._readable)
+
+    def connect_out(self) -> None:
+        """Open the pipe to the peer, once it listens on it."""
+        self._out_fd = os.open(self._wakeup_out, os.O_WRONLY | os.O_NONBLOCK)
+
+    def on_close(self, callback: Callable[[], None]) -> None:
+        self._on_close = callback
+
+    def _readable(self) -> None:
+        try:
+            data = os.read(self._in_fd, 4096)
+        except BlockingIOError:
+            return
+        if not data:
+            # The peer closed its end, after writing whatever it had.
+            self._unread = self.receive()
+            self._peer_closed = True
+            self.close()
+        self._on_wakeup()
+
+    def receive(self) -> List[bytes]:
+        if self.closed:
+            payloads, self._unread = self._unread, []
+            return payloads
+        payloads = []
+        payload = self._in.get()
+        while payload is not None:
+            payloads.append(payload)
+            payload = self._in.get()
+        return payloads
+
+    async def send(self, payload) -> None:
+        if self.closed:
+            raise ConnectionError('Shared memory channel was closed.')
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        if _LENGTH.size + len(payload) > self._out.capacity:
+            # It would never fit, dropping it leaves the channel to the payloads that do.
+            logger.warning(f'Dropped a payload of {len(payload)} bytes, '
+                           f'over the limit of {self._out.capacity - _LENGTH.size} bytes')
+            return
+        while not self._out.put(payload):
+            self.wake()
+            await asyncio.sleep(FULL_RING_DELAY)
+            if self.closed:
+                raise ConnectionError('Shared memory channel was closed.')
+        self.wake()
+
+    def wake(self) -> None:
+        if self.closed:
+            raise ConnectionError('Shared memory channel was closed.')
+        try:
+            os.write(self._out_fd, b'\0')
+        except BlockingIOError:
+            pass  # The pipe is full of wakeups the peer has yet to read.
+        except OSError as e:
+            self.close()
+            raise ConnectionError('Shared memory channel was closed.') from e
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._in_fd is not None:
+            asyncio.get_event_loop().remove_reader(self._in_fd)
+            os.close(self._in_fd)
+        if self._out_fd is not None:
+            os.close(self._out_fd)
+        self._in.release()
+        self._out.release()
+        self._shm.close()
+        if self._owner or self._peer_closed:
+            # Channels are used once, whoever closes last finds them gone.
+            _unlink(self._shm)
+            for path in (self._wakeup_in, self._wakeup_out):
+                _remove(path)
+        if self._on_close is not None:
+            self._on_close()
+
+
+class ShmListener(object):
+    """Takes the channels agents announce on the rendezvous pipe of name."""
+
+    def __init__(self, name: str, on_channel: Callable[[ShmChannel], None]) -> None:
+        self.name = name
+        self._on_channel = on_channel
+        self._path = rendezvous_path(name)
+        self._fd = None
+        self._pending = b''
+        self._channels = set()
+
+    def start(self) -> None:
+        if not shm_available():
+            raise RuntimeError('Shared memory transport needs multiprocessing.shared_memory and named pipes')
+        if os.path.exists(self._path):
+            os.unlink(self._path)  # Left behind by a broker that did not close.
+        os.mkfifo(self._path, 0o600)
+        # Opened for writing as well, so that reads never see the end of the pipe.
+        self._fd = os.open(self._path, os.O_RDWR | os.O_NONBLOCK)
+        asyncio.get_event_loop().add_reader(self._fd, self._readable)
+
+    def _readable(self) -> None:
+        try:
+            self._pending += os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        *lines, self._pending = self._pending.split(b'\n')
+        for line in lines:
+            channel_id = line.decode('ascii', 'replace')
+            try:
+                channel = ShmChannel.attach(channel_id)
+            except (OSError, ValueError) as e:
+                logger.warning(f'Unable to attach to shared memory channel {channel_id!r}: {e}')
+                continue
+            self._channels.add(channel)
+            channel.on_close(lambda channel=channel: self._channels.discard(channel))
+            self._on_channel(channel)
+
+    def close(self) -> None:
+        if self._fd is None:
+            return
+        asyncio.get_event_loop().remove_reader(self._fd)
+        os.close(self._fd)
+        os.unlink(self._path)
+        self._fd = None
+        for channel in list(self._channels):
+            channel.close()
+
+
+def announce(name: str, channel_id: str) -> None:
+    try:
+        fd = os.open(rendezvous_path(name), os.O_WRONLY | os.O_NONBLOCK)
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.ENXIO):
+            raise ConnectionError(f'No broker serving shm://{name}') from e
+        raise
+    try:
+        os.write(fd, f'{channel_id}\n'.encode('ascii'))
+    finally:
+        os.close(fd)
+
+
+class ShmTransport(BaseTransport):
+    """Exchanges encoded frames with a broker on the same host through
+    shared memory, on shm://name.
+    """
+
+    def __init__(self):
+        self.connected = False
+        self.token = None
+        self.endpoint = ''
+        self._channel = None
+        self._wakeup = None
+        self._received = deque()
+
+    async def connect(self, endpoint, token):
+        if not shm_available():
+            raise ConnectionError('Shared memory transport needs multiprocessing.shared_memory and named pipes')
+        self.token = token
+        self.endpoint = endpoint
+        self.codec = JSON_CODEC
+        self.batch = False
+        self._received.clear()
+        self._wakeup = asyncio.Event()
+        self._channel = ShmChannel.create()
+        try:
+            self._channel.listen(self._wakeup.set)
+            announce(endpoint.replace('shm://', '', 1), self._channel.id)
+            # The broker wakes us once it has attached.
+            await asyncio.wait_for(self._wakeup.wait(), timeout=CONNECT_TIMEOUT)
+            self._channel.connect_out()
+            await self.send(self.login_frame(token))
+            auth_ack = await asyncio.wait_for(self.recv(), timeout=CONNECT_TIMEOUT)
+        except BaseException:
+            self._channel.close()
+            raise
+        self.accept_login(endpoint, auth_ack)
+        self.connected = True
+
+    async def close(self):
+        if self._channel is not None:
+            self._channel.close()
+        self.connected = False
+        self.token = None
+
+    async def send(self, frame: Frame) -> None:
+        payload = self.codec.dumps(frame)
+        await self._channel.send(payload)
+        self.bytes_sent += len(payload)
+
+    async def send_batch(self, frames: List[Frame], max_bytes: int) -> None:
+        if not self.batch:
+            return await super().send_batch(frames, max_bytes)
+        for payload in self.batch_payloads(frames, max_bytes):
+            await self._channel.send(payload)
+            self.bytes_sent += len(payload)
+
+    async def recv(self) -> Frame:
+        while not self._received:
+            self._wakeup.clear()
+            payloads = self._channel.receive()
+            for payload in payloads:
+                self.bytes_received += len(payload)
+                try:
+                    self._received.extend(self.codec.loads_many(payload))
+                except Exception as e:
+                    raise ConnectionError('Received a payload that is not a frame.') from e
+            if payloads:
+                continue
+            if self._channel.closed:
+                raise ConnectionError('Shared memory channel was closed.')
+            await self._wakeup.wait()
+        return self._received.popleft()
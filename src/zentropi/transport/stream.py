@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import socket
+import struct
+from abc import abstractmethod
+from collections import deque
+from typing import List
+
+from .. import MB
+from ..codec import JSON_CODEC
+from ..frame import Frame
+from .base import BaseTransport
+
+logger = logging.getLogger(__name__)
+
+# Every payload on a stream is preceded by its length.
+HEADER = struct.Struct('>I')
+# Larger lengths are taken for garbage on the stream rather than a frame.
+MAX_PAYLOAD_SIZE = 16 * MB
+# Largest packet read from a socket that keeps message boundaries.
+MAX_PACKET_SIZE = 256 * 1024
+
+
+def _bytes(payload) -> bytes:
+    return payload.encode('utf-8') if isinstance(payload, str) else payload
+
+
+def _fitting(payloads: List[bytes], max_size: int) -> List[bytes]:
+    """The payloads as bytes, less those the peer could not read whole,
+    which are dropped rather than sent cut short or taken for garbage.
+    """
+    fitting = []
+    for payload in payloads:
+        payload = _bytes(payload)
+        if len(payload) > max_size:
+            logger.warning(f'Dropped a payload of {len(payload)} bytes, over the limit of {max_size} bytes')
+            continue
+        fitting.append(payload)
+    return fitting
+
+
+class StreamConnection(object):
+    """Length prefixed payloads over asyncio streams."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+
+    @property
+    def peer(self):
+        return self._writer.get_extra_info('peername')
+
+    async def read(self) -> bytes:
+        try:
+            length, = HEADER.unpack(await self._reader.readexactly(HEADER.size))
+            if length > MAX_PAYLOAD_SIZE:
+                raise ConnectionError(f'Expected a payload of at most {MAX_PAYLOAD_SIZE} bytes, got: {length}')
+            return await self._reader.readexactly(length)
+        except (EOFError, OSError) as e:
+            raise ConnectionError('Stream was closed.') from e
+
+    async def send(self, payloads: List[bytes]) -> None:
+        chunks = []
+        for payload in _fitting(payloads, MAX_PAYLOAD_SIZE):
+            chunks.append(HEADER.pack(len(payload)))
+            chunks.append(payload)
+        try:
+            self._writer.writelines(chunks)
+            await self._writer.drain()
+        except OSError as e:
+            raise ConnectionError('Stream was closed.') from e
+
+    async def close(self) -> None:
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+
+
+class PacketConnection(object):
+    """Payloads as the packets of a socket that keeps message boundaries,
+    like SOCK_SEQPACKET, so they need no length prefix.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        sock.setblocking(False)
+        self._sock = sock
+        self._buffer = bytearray(MAX_PACKET_SIZE)
+
+    @property
+    def peer(self):
+        return self._sock.getpeername()
+
+    async def read(self) -> bytes:
+        try:
+            size = await asyncio.get_event_loop().sock_recv_into(self._sock, self._buffer)
+        except OSError as e:
+            raise ConnectionError('Socket was closed.') from e
+        if not size:
+            raise ConnectionError('Socket was closed.')
+        return bytes(self._buffer[:size])
+
+    async def send(self, payloads: List[bytes]) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            for payload in _fitting(payloads, MAX_PACKET_SIZE):
+                await loop.sock_sendall(self._sock, payload)
+        except OSError as e:
+            raise ConnectionError('Socket was closed.') from e
+
+    async def close(self) -> None:
+        self._sock.close()
+
+
+class StreamTransport(BaseTransport):
+    """Sends one frame per payload on a connection opened by a subclass.
+
+    Every payload stands on its own, so batches are written together
+    without being joined, and frames arrive as they were encoded.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.connected = False
+        self.token = None
+        self.endpoint = ''
+        self._received = deque()
+
+    def login_frame(self, token) -> Frame:
+        frame = super().login_frame(token)
+        frame.data['batch'] = False  # Frames are written together but each in its own payload.
+        return frame
+
+    @abstractmethod
+    async def open(self, endpoint):
+        """Return a connection to endpoint with read, send and close."""
+
+    async def connect(self, endpoint, token):
+        self.token = token
+        self.endpoint = endpoint
+        self.codec = JSON_CODEC
+        self.batch = False
+        self._received.clear()
+        self.connection = await self.open(endpoint)
+        await self.send(self.login_frame(token))
+        auth_ack = await self.recv()
+        self.accept_login(endpoint, auth_ack)
+        self.connected = True
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+        self.connected = False
+        self.token = None
+
+    async def send(self, frame: Frame) -> None:
+        payload = self.codec.dumps(frame)
+        await self.connection.send([payload])
+        self.bytes_sent += len(payload)
+
+    async def send_batch(self, frames: List[Frame], max_bytes: int) -> None:
+        payloads = [self.codec.dumps(frame) for frame in frames]
+        await self.connection.send(payloads)
+        self.bytes_sent += sum(len(payload) for payload in payloads)
+
+    async def recv(self) -> Frame:
+        if self._received:
+            return self._received.popleft()
+        payload = await self.connection.read()
+        self.bytes_received += len(payload)
+        try:
+            frames = self.codec.loads_many(payload)
+            first = frames[0]
+        except Exception as e:
+            raise ConnectionError('Received a payload that is not a frame.') from e
+        self._received.extend(frames[1:])
+        return first
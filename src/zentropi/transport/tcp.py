@@ -0,0 +1,44 @@
+import asyncio
+import socket
+from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from .stream import StreamConnection
+from .stream import StreamTransport
+
+DEFAULT_PORT = 26514
+NODELAY_VALUES = ('0', '1')
+
+
+def tcp_address(endpoint: str) -> Tuple[str, int, bool]:
+    """Host, port and whether to set TCP_NODELAY for tcp://host:port,
+    which is on unless turned off with ?nodelay=0.
+    """
+    parts = urlsplit(endpoint)
+    query = parse_qs(parts.query)
+    nodelay = query.pop('nodelay', ['1'])[-1]
+    if parts.scheme != 'tcp' or not parts.hostname or query or nodelay not in NODELAY_VALUES:
+        raise ValueError(f'Expected tcp://host:port with an optional ?nodelay=0, got: {endpoint}')
+    return parts.hostname, parts.port or DEFAULT_PORT, nodelay == '1'
+
+
+def set_nodelay(writer: asyncio.StreamWriter, nodelay: bool) -> None:
+    """Send small writes without waiting for more, as asyncio does by default,
+    or leave them to Nagle's algorithm to coalesce.
+    """
+    sock = writer.get_extra_info('socket')
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(nodelay))
+
+
+class TcpTransport(StreamTransport):
+    """Length prefixed frames over TCP, without the handshake,
+    masking and framing of websockets.
+    """
+
+    async def open(self, endpoint):
+        host, port, nodelay = tcp_address(endpoint)
+        reader, writer = await asyncio.open_connection(host, port)
+        set_nodelay(writer, nodelay)
+        return StreamConnection(reader, writer)
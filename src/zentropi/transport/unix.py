@@ -0,0 +1,36 @@
+import asyncio
+import socket
+from typing import Tuple
+from urllib.parse import urlsplit
+
+from .stream import PacketConnection
+from .stream import StreamConnection
+from .stream import StreamTransport
+
+
+def unix_address(endpoint: str) -> Tuple[str, bool]:
+    """Path of unix:///path/to.sock and whether ?seqpacket was asked for."""
+    parts = urlsplit(endpoint)
+    if parts.scheme != 'unix' or parts.query not in ('', 'seqpacket'):
+        raise ValueError(f'Expected unix:///path/to.sock or unix:///path/to.sock?seqpacket, got: {endpoint}')
+    return parts.netloc + parts.path, parts.query == 'seqpacket'
+
+
+class UnixTransport(StreamTransport):
+    """Frames over a unix domain socket, length prefixed on a stream
+    or one per packet with unix:///path/to.sock?seqpacket.
+    """
+
+    async def open(self, endpoint):
+        path, seqpacket = unix_address(endpoint)
+        if not seqpacket:
+            reader, writer = await asyncio.open_unix_connection(path)
+            return StreamConnection(reader, writer)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        sock.setblocking(False)
+        try:
+            await asyncio.get_event_loop().sock_connect(sock, path)
+        except OSError:
+            sock.close()
+            raise
+        return PacketConnection(sock)
@@ -1,7 +1,10 @@
+from collections import deque
+from typing import List
+
 import websockets
 
+from ..codec import JSON_CODEC
 from ..frame import Frame
-from ..kind import Kind
 from .base import BaseTransport
 
 
@@ -11,17 +14,18 @@ class WebsocketTransport(BaseTransport):
         self.connected = False
         self.token = None
         self.endpoint = ''
+        self._received = deque()
 
     async def connect(self, endpoint, token):
         self.token = token
         self.endpoint = endpoint
+        self.codec = JSON_CODEC
+        self.batch = False
+        self._received.clear()
         self.connection = await websockets.connect(endpoint)
-        auth_frame = Frame('login', kind=Kind.COMMAND, data={'token': token})
-        await self.send(auth_frame)
-        # await self.connection.send(auth_frame.to_json())
+        await self.send(self.login_frame(token))
         auth_ack = await self.recv()
-        if not auth_ack.name == 'login-ok':
-            raise PermissionError(f'Unable to connect to {endpoint}, got {auth_ack.to_dict()}')
+        self.accept_login(endpoint, auth_ack)
         self.connected = True
 
     async def close(self):
@@ -31,13 +35,33 @@ class WebsocketTransport(BaseTransport):
 
     async def send(self, frame: Frame) -> None:
         try:
-            await self.connection.send(frame.to_json())
+            payload = self.codec.encode(frame)
+            await self.connection.send(payload)
+            self.bytes_sent += len(payload)
+        except Exception as e:
+            raise ConnectionError('Websocket was closed.') from e
+
+    async def send_batch(self, frames: List[Frame], max_bytes: int) -> None:
+        if not self.batch:
+            return await super().send_batch(frames, max_bytes)
+        try:
+            for payload in self.batch_payloads(frames, max_bytes):
+                await self.connection.send(payload)
+                self.bytes_sent += len(payload)
         except Exception as e:
             raise ConnectionError('Websocket was closed.') from e
 
     async def recv(self) -> Frame:
+        if self._received:
+            return self._received.popleft()
         try:
             _frame = await self.connection.recv()
-            return Frame.from_json(_frame)
+            self.bytes_received += len(_frame)
+            if isinstance(_frame, str):
+                frames = JSON_CODEC.loads_many(_frame)
+            else:
+                frames = self.codec.loads_many(_frame)
         except Exception as e:
             raise ConnectionError('Websocket was closed.') from e
+        self._received.extend(frames[1:])
+        return frames[0]
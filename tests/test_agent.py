@@ -1,14 +1,22 @@
 import asyncio
+import subprocess
+import sys
+import time
 from asyncio import Event
 
 import pytest
 from zentropi import Agent
+from zentropi import Frame
+from zentropi import Kind
 from zentropi.agent import clean_space_names
 from zentropi.agent import select_transport
 from zentropi.agent import random_string
 from zentropi.transport.base import BaseTransport
 from zentropi.transport.datagram import DatagramTransport
 from zentropi.transport.queue import QueueTransport
+from zentropi.transport.shm import ShmTransport
+from zentropi.transport.tcp import TcpTransport
+from zentropi.transport.unix import UnixTransport
 from zentropi.transport.websocket import WebsocketTransport
 
 
@@ -37,11 +45,31 @@ def test_select_transport_datagram():
     assert transport == DatagramTransport
 
 
+def test_select_transport_shm():
+    transport = select_transport('shm://')
+    assert transport == ShmTransport
+
+
+def test_select_transport_tcp():
+    transport = select_transport('tcp://127.0.0.1:26514')
+    assert transport == TcpTransport
+
+
+def test_select_transport_unix():
+    transport = select_transport('unix:///tmp/zentropi.sock')
+    assert transport == UnixTransport
+
+
 @pytest.mark.xfail(raises=ValueError)
 def test_select_transport_invalid():
     select_transport('boogie://')
 
 
+def test_select_transport_imports_lazily():
+    code = 'import sys, zentropi; zentropi.Agent; print(sorted(m for m in sys.modules if m.startswith("websockets")))'
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'[]'
+
+
 def test_clean_space_names_from_str():
     spaces = clean_space_names('this, this, that, test')
     assert spaces == {'this', 'that', 'test'}
@@ -91,3 +119,533 @@ async def test_agent_stop_with_stop():
     agent.stop()
     await asyncio.gather(task)
     assert agent._running is False
+
+
+@pytest.mark.asyncio
+async def test_agent_collect_batch():
+    agent = Agent('test-agent', batch_max_frames=3)
+    agent._loop = asyncio.get_event_loop()
+    agent._send_queue = asyncio.Queue()
+    for i in range(5):
+        agent._send_queue.put_nowait(i)
+    assert await agent._collect_batch(agent._send_queue.get_nowait()) == [0, 1, 2]
+    assert await agent._collect_batch(agent._send_queue.get_nowait()) == [3, 4]
+
+
+@pytest.mark.asyncio
+async def test_agent_collect_batch_lingers():
+    agent = Agent('test-agent', batch_max_frames=3, batch_linger=0.05)
+    agent._loop = asyncio.get_event_loop()
+    agent._send_queue = asyncio.Queue()
+    agent._loop.call_later(0.01, agent._send_queue.put_nowait, 1)
+    assert await agent._collect_batch(0) == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_agent_sends_batches_over_queue_transport():
+    agent = Agent('test-agent')
+    shutdown_trigger = Event()
+    task = asyncio.create_task(agent.start('queue://', 'test-token', shutdown_trigger=shutdown_trigger, handle_signals=False))
+    while not agent._connected:
+        await asyncio.sleep(0)
+    for i in range(10):
+        await agent.emit('test-event', value=i)
+    frames = []
+    while len(frames) < 10:
+        frame = await agent._connection.queue_send.get()
+        if frame.name == 'test-event':
+            frames.append(frame)
+    assert [f.data['value'] for f in frames] == list(range(10))
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+def test_agent_reconnect_backoff():
+    agent = Agent('test-agent', reconnect_delay=1, reconnect_max_delay=8)
+    for attempt, ceiling in enumerate([1, 2, 4, 8, 8]):
+        delay = agent._reconnect_backoff(attempt)
+        assert ceiling / 2 <= delay <= ceiling
+
+
+class FlakyTransport(QueueTransport):
+    """Queue transport that refuses the first connect and
+    drops the connection when it receives None."""
+    attempts = 0
+
+    async def connect(self, endpoint, token):
+        FlakyTransport.attempts += 1
+        if FlakyTransport.attempts == 1:
+            raise ConnectionRefusedError()
+        await super().connect(endpoint, token)
+
+    async def recv(self):
+        frame = await super().recv()
+        if frame is None:
+            raise ConnectionError()
+        return frame
+
+
+@pytest.mark.asyncio
+async def test_agent_reconnects_and_replays_frames():
+    agent = Agent('test-agent', reconnect_delay=0.01)
+    shutdown_trigger = Event()
+    task = asyncio.create_task(agent.start(
+        'queue://', 'test-token', shutdown_trigger=shutdown_trigger, transport=FlakyTransport, handle_signals=False))
+
+    async def wait_connected():
+        for _ in range(100):
+            if agent._connected:
+                return agent._connection
+            await asyncio.sleep(0.01)
+
+    first = await wait_connected()
+    assert FlakyTransport.attempts == 2
+    first.queue_recv.put_nowait(None)
+    await asyncio.sleep(0)
+    assert agent._connected is False
+    await agent.emit('while-disconnected')
+
+    second = await wait_connected()
+    assert second is not first
+    assert first.connected is False  # Closed before connecting again.
+    assert agent._reconnect_count == 2  # After the refused connect and after the drop.
+    names = []
+    while len(names) < 3:
+        names.append((await second.queue_send.get()).name)
+    assert names == ['filter', 'join', 'while-disconnected']
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+async def start_queue_agent(agent):
+    shutdown_trigger = Event()
+    task = asyncio.create_task(agent.start('queue://', 'test-token', shutdown_trigger=shutdown_trigger, handle_signals=False))
+    while not agent._connected:
+        await asyncio.sleep(0)
+    return shutdown_trigger, task
+
+
+async def next_frame(transport, name):
+    while True:
+        frame = await transport.queue_send.get()
+        if frame.name == name:
+            return frame
+
+
+@pytest.mark.asyncio
+async def test_agent_filter_sends_patterns():
+    agent = Agent('test-agent')
+
+    @agent.on_event('sensor.*')
+    async def sensor():
+        pass
+
+    @agent.on_event('test-event')
+    async def test_event():
+        pass
+
+    shutdown_trigger, task = await start_queue_agent(agent)
+    frame = await next_frame(agent._connection, 'filter')
+    assert 'test-event' in frame.data['names']['event']
+    assert 'sensor.*' not in frame.data['names']['event']
+    assert frame.data['patterns']['event'] == {'glob': ['sensor.*'], 'regex': []}
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+async def test_agent_request():
+    agent = Agent('test-agent')
+    shutdown_trigger, task = await start_queue_agent(agent)
+
+    async def responder():
+        frame = await next_frame(agent._connection, 'test-request')
+        await agent._connection.queue_recv.put(frame.reply(data={'_response': frame.data['value'] * 2}))
+
+    asyncio.create_task(responder())
+    assert await agent.request('test-request', timeout=60, value=21) == 42
+    assert agent._response_futures == {}
+    assert len(agent._response_timers) == 0
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=TimeoutError)
+async def test_agent_request_timeout():
+    agent = Agent('test-agent')
+    shutdown_trigger, task = await start_queue_agent(agent)
+    try:
+        await agent.request('test-request', timeout=0.01)
+    finally:
+        assert agent._response_futures == {}
+        shutdown_trigger.set()
+        await asyncio.gather(task)
+
+
+async def relay(source, destination):
+    while True:
+        await destination.queue_recv.put(await source.queue_send.get())
+
+
+async def start_agent_pair(requester, responder):
+    stops = [await start_queue_agent(requester), await start_queue_agent(responder)]
+    relays = [
+        asyncio.create_task(relay(requester._connection, responder._connection)),
+        asyncio.create_task(relay(responder._connection, requester._connection)),
+    ]
+
+    async def stop():
+        for task in relays:
+            task.cancel()
+        for shutdown_trigger, task in stops:
+            shutdown_trigger.set()
+            await task
+
+    return stop
+
+
+@pytest.mark.asyncio
+async def test_agent_coalesces_identical_requests():
+    requester, responder = Agent('requester'), Agent('responder')
+    calls = 0
+
+    @responder.on_request('double')
+    async def double(frame):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return frame.data['value'] * 2
+
+    stop = await start_agent_pair(requester, responder)
+    results = await asyncio.gather(
+        *[requester.request('double', timeout=1, _coalesce=True, value=21) for _ in range(3)],
+        requester.request('double', timeout=1, _coalesce=True, value=1),
+        requester.request('double', timeout=1, value=21))
+    assert results == [42, 42, 42, 2, 42]
+    assert calls == 3
+    assert requester.stats()['coalesced_requests'] == 2
+    assert requester._shared_requests == {}
+    await stop()
+
+
+@pytest.mark.asyncio
+async def test_agent_coalesced_request_outlives_one_caller():
+    agent = Agent('test-agent')
+    shutdown_trigger, task = await start_queue_agent(agent)
+    first = asyncio.ensure_future(agent.request('test-request', timeout=1, _coalesce=True))
+    second = asyncio.ensure_future(agent.request('test-request', timeout=1, _coalesce=True))
+    frame = await next_frame(agent._connection, 'test-request')
+    first.cancel()
+    await asyncio.sleep(0)
+    await agent._connection.queue_recv.put(frame.reply(data={'_response': 'ok'}))
+    assert await second == 'ok'
+    assert first.cancelled()
+    second = asyncio.ensure_future(agent.request('test-request', timeout=1, _coalesce=True))
+    await next_frame(agent._connection, 'test-request')
+    second.cancel()
+    await next_frame(agent._connection, 'request-cancel')
+    assert agent._shared_requests == {}
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+async def test_agent_stats_request():
+    requester, responder = Agent('requester'), Agent('responder', stats_handler=True)
+
+    @responder.on_request('fail')
+    async def fail():
+        raise RuntimeError('boom')
+
+    stop = await start_agent_pair(requester, responder)
+    with pytest.raises(TimeoutError):
+        await requester.request('fail', timeout=0.05)
+    stats = await requester.request('zentropi-stats', timeout=1)
+    assert stats['handlers']['REQUEST:fail']['errors'] == 1
+    assert stats['handlers']['REQUEST:fail']['latency']['count'] == 1
+    assert stats['in_flight_requests'] == 0
+    local = requester.stats()
+    assert local['send_queue']['delay']['count'] == 3  # Both requests and the cancel of the first.
+    assert local['requests']['zentropi-stats']['calls'] == 1
+    assert local['requests']['fail']['timeouts'] == 1
+    assert local['requests']['zentropi-stats']['latency']['max'] > 0
+    await stop()
+
+
+@pytest.mark.asyncio
+async def test_agent_skips_expired_requests():
+    agent = Agent('test-agent')
+    handled = []
+
+    @agent.on_request('test-request')
+    async def test_request(frame):
+        handled.append(frame.data['i'])
+        return 'ok'
+
+    shutdown_trigger, task = await start_queue_agent(agent)
+    for i, deadline in enumerate([time.time() - 1, time.time() + 10]):
+        await agent._connection.queue_recv.put(
+            Frame('test-request', kind=Kind.REQUEST, data={'i': i}, meta={'deadline': deadline}))
+    response = await next_frame(agent._connection, 'test-request')
+    assert response.kind == Kind.RESPONSE
+    assert handled == [1]
+    assert agent.stats()['expired_requests'] == 1
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+async def test_agent_request_sends_deadline():
+    agent = Agent('test-agent')
+    shutdown_trigger, task = await start_queue_agent(agent)
+    request = asyncio.create_task(agent.request('test-request', timeout=5))
+    frame = await next_frame(agent._connection, 'test-request')
+    assert 4 < frame.meta['deadline'] - time.time() <= 5
+    request.cancel()
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('dispatch', ['spawn', 'pool'])
+async def test_agent_request_timeout_cancels_handler(dispatch):
+    requester, responder = Agent('requester'), Agent('responder', dispatch=dispatch, dispatch_workers=1)
+    started, cancelled = Event(), Event()
+
+    @responder.on_request('slow')
+    async def slow():
+        started.set()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    @responder.on_request('fast')
+    async def fast():
+        return 'done'
+
+    stop = await start_agent_pair(requester, responder)
+    with pytest.raises(TimeoutError):
+        await requester.request('slow', timeout=0.1)
+    assert started.is_set()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    # A pool worker keeps serving requests after a cancelled one.
+    assert await requester.request('fast', timeout=1) == 'done'
+    assert not any(name.startswith('handler-') for name in responder._spawned_tasks)
+    await stop()
+
+
+@pytest.mark.asyncio
+async def test_agent_request_stream_closed_early_cancels_handler():
+    requester, responder = Agent('requester'), Agent('responder')
+    cancelled = Event()
+
+    @responder.on_request('count')
+    async def count():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            cancelled.set()
+
+    stop = await start_agent_pair(requester, responder)
+    chunks = requester.request_stream('count', timeout=1, _window=2)
+    assert await chunks.__anext__() == 0
+    await chunks.aclose()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    await stop()
+
+
+@pytest.mark.asyncio
+async def test_agent_request_stream():
+    requester, responder = Agent('requester'), Agent('responder')
+    produced = 0
+
+    @responder.on_request('count')
+    async def count(frame):
+        nonlocal produced
+        for i in range(frame.data['upto']):
+            produced += 1
+            yield i
+
+    stop = await start_agent_pair(requester, responder)
+    chunks = []
+    async for chunk in requester.request_stream('count', timeout=1, _window=2, upto=10):
+        chunks.append(chunk)
+        await asyncio.sleep(0.01)
+        assert produced - len(chunks) <= 2 + 1  # The window plus one waiting for credit.
+    assert chunks == list(range(10))
+    assert requester._response_streams == {}
+    assert responder._stream_credits == {}
+    await stop()
+
+
+@pytest.mark.asyncio
+async def test_agent_request_stream_from_plain_handler():
+    requester, responder = Agent('requester'), Agent('responder')
+
+    @responder.on_request('plain')
+    async def plain(frame):
+        return {'value': 42}
+
+    stop = await start_agent_pair(requester, responder)
+    chunks = [chunk async for chunk in requester.request_stream('plain', timeout=1)]
+    assert chunks == [{'value': 42}]
+    await stop()
+
+
+@pytest.mark.asyncio
+async def test_agent_request_from_streaming_handler():
+    requester, responder = Agent('requester'), Agent('responder')
+
+    @responder.on_request('count')
+    async def count(frame):
+        for i in range(3):
+            yield i
+
+    stop = await start_agent_pair(requester, responder)
+    assert await requester.request('count', timeout=1) == [0, 1, 2]
+    await stop()
+
+
+async def respond_many(agent, name, values):
+    frame = await next_frame(agent._connection, name)
+    for value in values:
+        await agent._connection.queue_recv.put(frame.reply(data={'_response': value}))
+
+
+@pytest.mark.asyncio
+async def test_agent_gather_until_max_responses():
+    agent = Agent('test-agent')
+    shutdown_trigger, task = await start_queue_agent(agent)
+    asyncio.create_task(respond_many(agent, 'status', ['a', 'b', 'c']))
+    responses = [r async for r in agent.gather('status', timeout=1, max_responses=2)]
+    assert responses == ['a', 'b']
+    assert agent._response_gathers == {}
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+async def test_agent_gather_until_deadline():
+    agent = Agent('test-agent')
+    shutdown_trigger, task = await start_queue_agent(agent)
+    asyncio.create_task(respond_many(agent, 'status', ['a', 'b', 'c']))
+    responses = [r async for r in agent.gather('status', timeout=0.05, min_responses=3)]
+    assert responses == ['a', 'b', 'c']
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=TimeoutError)
+async def test_agent_gather_below_min_responses():
+    agent = Agent('test-agent')
+    shutdown_trigger, task = await start_queue_agent(agent)
+    asyncio.create_task(respond_many(agent, 'status', ['a']))
+    try:
+        [r async for r in agent.gather('status', timeout=0.05, min_responses=2)]
+    finally:
+        shutdown_trigger.set()
+        await asyncio.gather(task)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_agent_invalid_dispatch():
+    Agent('test-agent', dispatch='threads')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('dispatch', ['spawn', 'pool'])
+async def test_agent_dispatch(dispatch):
+    agent = Agent('test-agent', dispatch=dispatch, dispatch_workers=4)
+    handled = []
+    running = 0
+    most_running = 0
+
+    @agent.on_event('test-event', concurrency=2)
+    async def test_event(frame):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        handled.append(frame.data['value'])
+
+    shutdown_trigger = Event()
+    task = asyncio.create_task(agent.start(shutdown_trigger=shutdown_trigger, handle_signals=False))
+    await asyncio.sleep(0)
+    for i in range(8):
+        await agent.emit('test-event', value=i)
+    for _ in range(100):
+        if len(handled) == 8:
+            break
+        await asyncio.sleep(0.01)
+    assert sorted(handled) == list(range(8))
+    assert most_running == 2
+    if dispatch == 'pool':
+        assert not any(name.startswith('handler-') for name in agent._spawned_tasks)
+    shutdown_trigger.set()
+    await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+async def test_agent_pool_limited_handler_does_not_hold_workers():
+    agent = Agent('test-agent', dispatch='pool', dispatch_workers=4)
+    slow_handled = []
+    fast_handled = []
+
+    @agent.on_event('slow', concurrency=1)
+    async def slow(frame):
+        await asyncio.sleep(0.2)
+        slow_handled.append(frame.data['value'])
+
+    @agent.on_event('fast')
+    async def fast(frame):
+        fast_handled.append(list(slow_handled))
+
+    shutdown_trigger = Event()
+    task = asyncio.create_task(agent.start(shutdown_trigger=shutdown_trigger, handle_signals=False))
+    await asyncio.sleep(0)
+    try:
+        for i in range(5):
+            await agent.emit('slow', value=i)
+        await agent.emit('fast')
+        for _ in range(200):
+            if len(slow_handled) == 5 and not agent._handler_slots[slow][0]:
+                break
+            await asyncio.sleep(0.01)
+        # With more slow frames than workers, fast still runs before the first slow one is done.
+        assert fast_handled == [[]]
+        assert slow_handled == list(range(5))
+        assert agent._handler_slots[slow][0] == 0
+    finally:
+        shutdown_trigger.set()
+        await asyncio.gather(task)
+
+
+@pytest.mark.asyncio
+async def test_agent_pool_worker_survives_handler_error():
+    agent = Agent('test-agent', dispatch='pool', dispatch_workers=1)
+    handled = []
+
+    @agent.on_event('test-event')
+    async def test_event(frame):
+        if frame.data['fail']:
+            raise ValueError('boom')
+        handled.append(frame)
+
+    shutdown_trigger = Event()
+    task = asyncio.create_task(agent.start(shutdown_trigger=shutdown_trigger, handle_signals=False))
+    await asyncio.sleep(0)
+    await agent.emit('test-event', fail=True)
+    await agent.emit('test-event', fail=False)
+    for _ in range(100):
+        if handled:
+            break
+        await asyncio.sleep(0.01)
+    assert len(handled) == 1
+    shutdown_trigger.set()
+    await asyncio.gather(task)
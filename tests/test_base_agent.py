@@ -1,4 +1,9 @@
 import asyncio
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
@@ -12,6 +17,18 @@ from zentropi.base_agent import on_request
 from zentropi.base_agent import parse_period
 from zentropi.base_agent import parse_rate_limit
 from zentropi.base_agent import apply_rate_limits
+from zentropi.frame import Frame
+
+
+@on_request('test-process-pid', executor='process')
+def process_pid():
+    return os.getpid()
+
+
+class ProcessAgent(BaseAgent):
+    @on_request('test-process-pid', executor='process')
+    def process_pid(self):
+        return os.getpid()
 
 
 def test_agent_class_method_decorators():
@@ -43,11 +60,11 @@ def test_agent_class_method_decorators():
     assert test_agent.test_interval.handler == 'test-interval'
     assert test_agent.test_interval.kind == Kind.INTERVAL
 
-    assert test_agent._interval_handlers['test-interval'] == test_agent.test_interval
-    assert test_agent._command_handlers['test-command'] == test_agent.test_command
-    assert test_agent._event_handlers['test-event'] == test_agent.test_event
-    assert test_agent._message_handlers['test-message'] == test_agent.test_message
-    assert test_agent._request_handlers['test-request'] == test_agent.test_request
+    assert test_agent._interval_handlers['test-interval'] == [test_agent.test_interval]
+    assert test_agent._command_handlers['test-command'] == [test_agent.test_command]
+    assert test_agent._event_handlers['test-event'] == [test_agent.test_event]
+    assert test_agent._message_handlers['test-message'] == [test_agent.test_message]
+    assert test_agent._request_handlers['test-request'] == [test_agent.test_request]
 
 
 def test_agent_function_decorators():
@@ -76,15 +93,14 @@ def test_agent_function_decorators():
     async def test_request():
         pass
 
-    assert test_agent._interval_handlers['test-interval'] == test_interval
-    assert test_agent._command_handlers['test-command'] == test_command
-    assert test_agent._event_handlers['test-event'] == test_event
-    assert test_agent._message_handlers['test-message'] == test_message
-    assert test_agent._request_handlers['test-request'] == test_request
+    assert test_agent._interval_handlers['test-interval'] == [test_interval]
+    assert test_agent._command_handlers['test-command'] == [test_command]
+    assert test_agent._event_handlers['test-event'] == [test_event]
+    assert test_agent._message_handlers['test-message'] == [test_message]
+    assert test_agent._request_handlers['test-request'] == [test_request]
 
 
-@pytest.mark.xfail(raises=KeyError)
-def test_agent_duplicate_handlers_raise_key_error():
+def test_agent_duplicate_handlers_run_in_order_of_priority():
     class TestAgent(BaseAgent):
         pass
 
@@ -94,10 +110,19 @@ def test_agent_duplicate_handlers_raise_key_error():
     async def test_command():
         pass
 
+    @test_agent.on_command('test-command', priority=10)
+    async def urgent_test_command():
+        pass
+
     @test_agent.on_command('test-command')
-    async def duplicate_test_command():
+    async def another_test_command():
         pass
 
+    handlers = test_agent.get_handlers(Kind.COMMAND, 'test-command')
+    assert handlers == [urgent_test_command, test_command, another_test_command]
+    assert test_agent.get_handler(Kind.COMMAND, 'test-command') == urgent_test_command
+
+
 def test_agent_get_handler():
     class TestAgent(BaseAgent):
         @on_event('test-event')
@@ -251,7 +276,6 @@ async def test_rate_limits():
 
 
 @pytest.mark.asyncio
-@pytest.mark.xfail(raises=RuntimeError)
 async def test_rate_limits_exceeded():
     got_frame = None
 
@@ -267,8 +291,26 @@ async def test_rate_limits_exceeded():
     got_return = await test_agent.run_handler(Kind.COMMAND, 'test-event', True, timeout=0.1)
     assert got_return is True
     assert got_frame is True
-    await test_agent.run_handler(Kind.COMMAND, 'test-event', False, timeout=0.1)
-    
+    assert await test_agent.run_handler(Kind.COMMAND, 'test-event', False, timeout=0.1) is None
+    assert got_frame is True
+    assert test_agent.rate_limit_stats()['COMMAND:test-event:test_event']['shed'] == 1
+
+@pytest.mark.asyncio
+async def test_rate_limits_delay_smooths_bursts():
+    test_agent = BaseAgent()
+    handled = []
+
+    @test_agent.on_event('test-event', rate_limits=['2/s', '20/m'], rate_limit_policy='delay')
+    async def test_event(frame):
+        handled.append(frame)
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    await asyncio.gather(*[test_agent.run_handler(Kind.EVENT, 'test-event', i, timeout=1) for i in range(3)])
+    assert handled == [0, 1, 2]
+    assert loop.time() - start >= 0.45
+    assert test_agent.rate_limit_stats()['EVENT:test-event:test_event']['delayed'] == 1
+
 
 @pytest.mark.asyncio
 @pytest.mark.xfail(raises=TimeoutError)
@@ -386,3 +428,307 @@ async def test_spawn_exception_is_forwarded():
     
     name, task = test_agent.spawn('test-task', test_task())
     await asyncio.gather(task)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_handler_concurrency_must_be_positive():
+    class TestAgent(BaseAgent):
+        @on_event('test-event', concurrency=0)
+        async def test_event(self):
+            pass
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_handler_executor_must_be_known():
+    class TestAgent(BaseAgent):
+        @on_event('test-event', executor='fibers')
+        def test_event(self):
+            pass
+
+
+@pytest.mark.xfail(raises=TypeError)
+def test_handler_option_must_be_known():
+    BaseAgent().on_event('test-event', concurency=2)(lambda: None)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_handler_cache_only_on_requests():
+    class TestAgent(BaseAgent):
+        @on_event('test-event', cache=60)
+        async def test_event(self):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_sync_handler_runs_on_shared_thread_pool():
+    class TestAgent(BaseAgent):
+        @on_event('test-event', executor='shared')
+        def test_event(self):
+            return threading.current_thread().name
+
+    test_agent = TestAgent()
+    handler = test_agent.get_handler(Kind.EVENT, 'test-event')
+    assert handler in test_agent._sync_runners
+    thread_name = await test_agent.run_handler(Kind.EVENT, 'test-event', None, timeout=1)
+    assert thread_name.startswith('zentropi-shared')
+    test_agent.shutdown_executors(wait=True)
+    assert test_agent._executors == {}
+
+
+@pytest.mark.asyncio
+async def test_sync_handlers_run_concurrently_on_dedicated_pool():
+    barrier = threading.Barrier(2, timeout=1)
+    test_agent = BaseAgent()
+
+    @test_agent.on_event('test-event', executor='dedicated', concurrency=2)
+    def test_event():
+        barrier.wait()
+        return threading.current_thread().name
+
+    names = await asyncio.gather(
+        test_agent.run_handler(Kind.EVENT, 'test-event', None, timeout=1),
+        test_agent.run_handler(Kind.EVENT, 'test-event', None, timeout=1),
+    )
+    assert all(name.startswith('zentropi-test_event') for name in names)
+    test_agent.shutdown_executors(wait=True)
+
+
+@pytest.mark.asyncio
+async def test_sync_handler_runs_on_given_executor():
+    executor = ThreadPoolExecutor(thread_name_prefix='test-executor')
+    test_agent = BaseAgent()
+
+    @test_agent.on_event('test-event', executor=executor)
+    def test_event():
+        return threading.current_thread().name
+
+    thread_name = await test_agent.run_handler(Kind.EVENT, 'test-event', None, timeout=1)
+    assert thread_name.startswith('test-executor')
+    test_agent.shutdown_executors()
+    assert executor.submit(int).result() == 0
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_sync_handler_runs_on_process_pool():
+    test_agent = BaseAgent()
+    test_agent.add_handler(Kind.REQUEST, 'test-process-pid', process_pid)
+    pid = await test_agent.run_handler(Kind.REQUEST, 'test-process-pid', None, timeout=10)
+    assert pid != os.getpid()
+    test_agent.shutdown_executors(wait=True)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_process_handler_must_not_be_a_method():
+    ProcessAgent()
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_process_handler_must_not_be_nested():
+    test_agent = BaseAgent()
+
+    @test_agent.on_request('test-process-pid', executor='process')
+    def process_pid():
+        return os.getpid()
+
+
+def test_agent_get_handler_by_pattern():
+    class TestAgent(BaseAgent):
+        @on_event('sensor.*')
+        async def test_sensor(self):
+            pass
+
+        @on_event(re.compile(r'switch-\d+'))
+        async def test_switch(self):
+            pass
+
+        @on_event('*')
+        async def test_all_events(self):
+            pass
+
+    test_agent = TestAgent()
+    assert test_agent.get_handler(Kind.EVENT, 'sensor.temperature') == test_agent.test_sensor
+    assert test_agent.get_handler(Kind.EVENT, 'switch-1') == test_agent.test_switch
+    assert test_agent.get_handler(Kind.EVENT, 'switch-on') == test_agent.test_all_events
+    assert test_agent.get_handler(Kind.COMMAND, 'sensor.temperature') is None
+
+
+@pytest.mark.asyncio
+async def test_agent_fan_out_sequential():
+    calls = []
+    test_agent = BaseAgent()
+
+    @test_agent.on_request('test-request')
+    async def first(frame):
+        calls.append(('first', frame))
+        await asyncio.sleep(0.01)
+
+    @test_agent.on_request('test-request')
+    async def second(frame):
+        calls.append(('second', frame))
+        return 'second'
+
+    @test_agent.on_request('test-request', priority=-1)
+    def third(frame):
+        calls.append(('third', frame))
+        return 'third'
+
+    frame = object()
+    assert await test_agent.run_handler(Kind.REQUEST, 'test-request', frame, timeout=1) == 'second'
+    assert calls == [('first', frame), ('second', frame), ('third', frame)]
+
+
+@pytest.mark.asyncio
+async def test_agent_fan_out_concurrent():
+    started = []
+    both_started = asyncio.Event()
+    test_agent = BaseAgent(fan_out='concurrent')
+
+    async def handler(frame):
+        started.append(frame)
+        if len(started) == 2:
+            both_started.set()
+        await asyncio.wait_for(both_started.wait(), timeout=1)
+
+    test_agent.on_event('test-event')(handler)
+    test_agent.on_event('test-event')(lambda: None)
+    test_agent.on_event('test-event')(handler)
+    await test_agent.run_handler(Kind.EVENT, 'test-event', 'frame', timeout=1)
+    assert started == ['frame', 'frame']
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=NotImplementedError)
+async def test_agent_fan_out_raises_after_all_handlers_ran():
+    ran = False
+    test_agent = BaseAgent()
+
+    @test_agent.on_event('test-event', priority=1)
+    async def failing():
+        raise NotImplementedError('boom')
+
+    @test_agent.on_event('test-event')
+    async def succeeding():
+        nonlocal ran
+        ran = True
+
+    try:
+        await test_agent.run_handler(Kind.EVENT, 'test-event', None, timeout=1)
+    finally:
+        assert ran is True
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_agent_invalid_fan_out():
+    BaseAgent(fan_out='random')
+
+
+@pytest.mark.asyncio
+async def test_handler_timeout_overrides_default():
+    test_agent = BaseAgent()
+
+    @test_agent.on_request('test-request', timeout=0.05)
+    async def test_request():
+        await asyncio.sleep(1)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        await test_agent.run_handler(Kind.REQUEST, 'test-request', None, timeout=10)
+    assert time.monotonic() - start < 0.5
+    assert test_agent._stats.handler(Kind.REQUEST, 'test-request').timeouts == 1
+
+
+@pytest.mark.asyncio
+async def test_handler_cancelled_at_frame_deadline():
+    cancelled = False
+    test_agent = BaseAgent()
+
+    @test_agent.on_request('test-request')
+    async def test_request():
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    frame = Frame('test-request', kind=Kind.REQUEST, meta={'deadline': time.time() + 0.05})
+    with pytest.raises(TimeoutError):
+        await test_agent.run_handler(Kind.REQUEST, 'test-request', frame, timeout=10)
+    assert cancelled is True
+
+
+@pytest.mark.asyncio
+async def test_handler_skipped_after_frame_deadline():
+    test_agent = BaseAgent()
+
+    @test_agent.on_request('test-request')
+    def test_request():
+        raise AssertionError('Handler should not run')
+
+    frame = Frame('test-request', kind=Kind.REQUEST, meta={'deadline': time.time() - 1})
+    with pytest.raises(TimeoutError):
+        await test_agent.run_handler(Kind.REQUEST, 'test-request', frame, timeout=10)
+
+
+@pytest.mark.asyncio
+async def test_cached_request_handler():
+    test_agent = BaseAgent()
+    calls = []
+
+    @test_agent.on_request('test-request', cache=60)
+    async def test_request(frame):
+        calls.append(frame.data)
+        await asyncio.sleep(0.01)
+        return {'value': frame.data['value']}
+
+    frames = [Frame('test-request', data={'value': 1, 'other': 2}) for _ in range(3)]
+    frames.append(Frame('test-request', data={'other': 2, 'value': 1}))
+    frames.append(Frame('test-request', data={'value': 2}))
+    results = await asyncio.gather(
+        *[test_agent.run_handler(Kind.REQUEST, 'test-request', frame, timeout=1) for frame in frames])
+    assert [result['value'] for result in results] == [1, 1, 1, 1, 2]
+    assert len(calls) == 2
+    await test_agent.run_handler(Kind.REQUEST, 'test-request', frames[0], timeout=1)
+    stats = test_agent.cache_stats()['REQUEST:test-request:test_request']
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['coalesced'] == 3
+    assert stats['size'] == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_request_handler_per_agent():
+    class WhoAmI(BaseAgent):
+        def __init__(self, name):
+            self.name = name
+            super().__init__()
+
+        @on_request('whoami', cache=60)
+        async def whoami(self):
+            return self.name
+
+    alpha, beta = WhoAmI('alpha'), WhoAmI('beta')
+    frame = Frame('whoami')
+    assert await alpha.run_handler(Kind.REQUEST, 'whoami', frame, timeout=1) == 'alpha'
+    assert await beta.run_handler(Kind.REQUEST, 'whoami', frame, timeout=1) == 'beta'
+    assert alpha.cache_stats()['REQUEST:whoami:whoami']['misses'] == 1
+    assert beta.cache_stats()['REQUEST:whoami:whoami']['misses'] == 1
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_cached_handler_invalid_ttl():
+    test_agent = BaseAgent()
+
+    @test_agent.on_request('test-request', cache=0)
+    async def test_request():
+        pass
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_cached_stream_handler():
+    test_agent = BaseAgent()
+
+    @test_agent.on_request('test-request', cache=60)
+    async def test_request():
+        yield 1
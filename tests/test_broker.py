@@ -0,0 +1,225 @@
+import asyncio
+import os
+import socket
+from asyncio import Event
+
+import pytest
+
+from zentropi import Agent
+from zentropi import Frame
+from zentropi import Kind
+from zentropi.broker import Broker
+from zentropi.broker import local_broker
+from zentropi.codec import get_codec
+from zentropi.transport.shm import rendezvous_path
+from zentropi.transport.shm import shm_available
+
+needs_unix = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='Needs unix domain sockets')
+needs_shm = pytest.mark.skipif(not shm_available(), reason='Needs multiprocessing.shared_memory and named pipes')
+
+
+async def until(condition):
+    for _ in range(1000):
+        if condition():
+            return
+        await asyncio.sleep(0.001)
+    raise TimeoutError('Condition not met')
+
+
+async def start_agents(broker, endpoint, *agents, spaces=None):
+    stops = []
+    for agent in agents:
+        shutdown_trigger = Event()
+        task = asyncio.create_task(agent.start(
+            endpoint, 'test-token', join_all_spaces=spaces is None,
+            shutdown_trigger=shutdown_trigger, handle_signals=False))
+        await until(lambda: 'frame-send-loop' in agent._spawned_tasks)
+        if spaces is not None:
+            await agent.join(spaces[agent.name])
+        stops.append((shutdown_trigger, task))
+    await until(lambda: len(broker._subscribers) >= len(agents)
+                and all(s.spaces and s.names is not None for s in broker._subscribers))
+
+    async def stop():
+        for shutdown_trigger, task in stops:
+            shutdown_trigger.set()
+            await task
+        await broker.close()
+
+    return stop
+
+
+def test_broker_filters():
+    broker = Broker()
+    delivered = []
+    sender = broker.connect('sender', lambda frame: None)
+    subscriber = broker.connect('test', delivered.append)
+    for s in (sender, subscriber):
+        broker.receive(s, Frame('login', kind=Kind.COMMAND))
+        broker.receive(s, Frame('join', kind=Kind.COMMAND, data={'spaces': ['home']}))
+
+    def routed(frame):
+        broker.route(sender, frame)
+        return bool(delivered and delivered.pop() is frame)
+
+    assert routed(Frame('anything'))
+    broker.receive(subscriber, Frame('filter', kind=Kind.COMMAND, data={
+        'names': {'event': ['exact'], 'message': ['*'], 'request': []},
+        'patterns': {'event': {'glob': ['sensor.*'], 'regex': ['^temp-[0-9]+$', '(']}},
+        'size': 100,
+    }))
+    assert routed(Frame('exact'))
+    assert routed(Frame('sensor.humidity'))
+    assert routed(Frame('temp-12'))
+    assert not routed(Frame('temp-x'))
+    assert routed(Frame('anything', kind=Kind.MESSAGE))
+    assert not routed(Frame('anything', kind=Kind.REQUEST))
+    assert routed(Frame('anything', kind=Kind.COMMAND))
+    codec = get_codec('json')
+    assert routed(codec.loads(codec.dumps(Frame('exact')), lazy=True))
+    assert not routed(codec.loads(codec.dumps(Frame('exact', data={'value': 'x' * 100})), lazy=True))
+
+
+def test_broker_index():
+    broker = Broker()
+    delivered = {}
+
+    def subscribe(name, spaces, names=None, patterns=None):
+        subscriber = broker.connect(name, lambda frame: delivered.setdefault(frame.uuid, []).append(name))
+        broker.receive(subscriber, Frame('login', kind=Kind.COMMAND))
+        broker.receive(subscriber, Frame('join', kind=Kind.COMMAND, data={'spaces': spaces}))
+        if names is not None:
+            data = {'names': {'event': names}, 'patterns': {'event': {'glob': patterns or []}}}
+            broker.receive(subscriber, Frame('filter', kind=Kind.COMMAND, data=data))
+        return subscriber
+
+    def route(sender, frame):
+        broker.route(sender, frame)
+        return sorted(delivered.pop(frame.uuid, []))
+
+    home = subscribe('home', ['home'], names=['on'])
+    office = subscribe('office', ['office'], names=['on'])
+    everywhere = subscribe('everywhere', ['*'], names=['off'], patterns=['o*'])
+    unfiltered = subscribe('unfiltered', ['home'])
+    assert route(home, Frame('on')) == ['everywhere', 'unfiltered']
+    assert route(home, Frame('off')) == ['everywhere', 'unfiltered']
+    assert route(everywhere, Frame('on')) == ['home', 'office', 'unfiltered']
+    assert route(office, Frame('test', kind=Kind.COMMAND)) == ['everywhere']
+    broker.receive(office, Frame('join', kind=Kind.COMMAND, data={'spaces': ['home']}))
+    assert route(unfiltered, Frame('on')) == ['everywhere', 'home', 'office']
+    broker.receive(office, Frame('leave', kind=Kind.COMMAND, data={'spaces': ['home', 'office']}))
+    assert route(unfiltered, Frame('on')) == ['everywhere', 'home']
+    broker.disconnect(everywhere)
+    broker.disconnect(unfiltered)
+    assert route(home, Frame('test', kind=Kind.COMMAND)) == []
+    broker.disconnect(home)
+    assert broker.stats()['index_keys'] == 0
+
+
+def test_broker_replaces_session():
+    broker = Broker()
+    delivered = []
+
+    def login(name, session):
+        subscriber = broker.connect(name, lambda frame: delivered.append((name, frame.name)))
+        broker.receive(subscriber, Frame('login', kind=Kind.COMMAND, data={'session': session}))
+        broker.receive(subscriber, Frame('join', kind=Kind.COMMAND, data={'spaces': ['home']}))
+        return subscriber
+
+    sender = login('sender', None)
+    before = login('dgram:port-1', 'test-session')
+    after = login('dgram:port-2', 'test-session')
+    assert not before.connected and after.connected
+    delivered.clear()
+    broker.route(sender, Frame('test-event'))
+    assert delivered == [('dgram:port-2', 'test-event')]
+    broker.disconnect(after)
+    assert not broker._sessions
+
+
+@pytest.mark.asyncio
+async def test_broker_routes_in_process():
+    broker = Broker()
+    broker.serve_queue('test-broker')
+    sender, receiver, elsewhere = Agent('sender'), Agent('receiver'), Agent('elsewhere')
+    received = []
+
+    @receiver.on_event('test-event')
+    async def receiver_event(frame):
+        received.append(('receiver', frame))
+
+    @elsewhere.on_event('test-event')
+    async def elsewhere_event(frame):
+        received.append(('elsewhere', frame))
+
+    @receiver.on_request('double')
+    async def double(frame):
+        return frame.data['value'] * 2
+
+    spaces = {'sender': 'home', 'receiver': 'home', 'elsewhere': 'office'}
+    stop = await start_agents(broker, 'queue://test-broker', sender, receiver, elsewhere, spaces=spaces)
+    await sender.emit('test-event', value=1)
+    await sender.emit('other-event', value=2)
+    assert await sender.request('double', timeout=1, value=21) == 42
+    await until(lambda: received)
+    assert [(name, frame.data) for name, frame in received] == [('receiver', {'value': 1})]
+    assert broker.stats()['delivered'] == 3  # The event, the request and its response.
+    await stop()
+    assert local_broker('test-broker') is None
+
+
+@pytest.mark.asyncio
+async def test_broker_login_fails_with_unknown_token():
+    broker = Broker(tokens=['other-token'])
+    broker.serve_queue('test-broker')
+    agent = Agent('test-agent')
+    await agent.start('queue://test-broker', 'test-token', shutdown_trigger=Event(), handle_signals=False)
+    assert not agent._connected
+    assert broker.stats()['subscribers'] == 0
+    await broker.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('scheme', [
+    'ws', 'dgram', 'tcp',
+    pytest.param('unix', marks=needs_unix),
+    pytest.param('seqpacket', marks=needs_unix),
+    pytest.param('shm', marks=needs_shm),
+])
+async def test_broker_routes_remote_agents(tmp_path, scheme):
+    broker = Broker()
+    broker.serve_queue('test-broker')
+    leftovers = []  # Paths the broker removes when closed.
+    if scheme == 'ws':
+        endpoint = f'ws://127.0.0.1:{await broker.serve_websocket(port=0)}'
+    elif scheme == 'tcp':
+        endpoint = f'tcp://127.0.0.1:{await broker.serve_tcp(port=0)}'
+    elif scheme == 'dgram':
+        endpoint = f'dgram://127.0.0.1:{await broker.serve_datagram(port=0)}'
+    elif scheme == 'shm':
+        await broker.serve_shm('test-broker')
+        endpoint = 'shm://test-broker'
+        leftovers.append(rendezvous_path('test-broker'))
+    else:
+        path = f'{tmp_path}/test.sock'
+        await broker.serve_unix(path, seqpacket=scheme == 'seqpacket')
+        endpoint = f'unix://{path}?seqpacket' if scheme == 'seqpacket' else f'unix://{path}'
+        leftovers.append(path)
+    local, remote = Agent('local'), Agent('remote')
+
+    @remote.on_request('double')
+    async def double(frame):
+        return frame.data['value'] * 2
+
+    stop_local = await start_agents(broker, 'queue://test-broker', local)
+    stop_remote = await start_agents(broker, endpoint, remote)
+    if scheme == 'shm':
+        leftovers.append(f'/dev/shm/zentropi-{remote._connection._channel.id}')
+    assert await local.request('double', timeout=1, value=21) == 42
+    assert await local.request('double', timeout=1, value='x' * 500) == 'x' * 1000
+    values = range(1, 101)
+    assert await asyncio.gather(*[local.request('double', timeout=1, value=i) for i in values]) == [
+        i * 2 for i in values]
+    await stop_remote()
+    await stop_local()
+    assert not any(os.path.exists(path) for path in leftovers)
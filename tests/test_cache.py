@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from zentropi.cache import ResponseCache
+from zentropi.cache import canonical_key
+
+
+def test_canonical_key_ignores_key_order():
+    assert canonical_key('test', {'a': 1, 'b': [1, 2]}) == canonical_key('test', {'b': [1, 2], 'a': 1})
+    assert canonical_key('test', None) == canonical_key('test', {})
+    assert canonical_key('test', {'a': 1}) != canonical_key('test', {'a': 2})
+    assert canonical_key('test', {'a': 1}) != canonical_key('other', {'a': 1})
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_response_cache_requires_positive_ttl():
+    ResponseCache(ttl=0)
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(ttl=60, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_response_cache_expires():
+    cache = ResponseCache(ttl=0.001)
+    cache.set('a', 1)
+    cache._entries['a'] = (0, 1)
+    assert cache.get('a', 'missing') == 'missing'
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_response_cache_coalesces_concurrent_misses():
+    cache = ResponseCache(ttl=60)
+    runs = 0
+
+    async def run():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        return runs
+
+    results = await asyncio.gather(*[cache.get_or_run('a', run) for _ in range(5)])
+    assert results == [1] * 5
+    assert await cache.get_or_run('a', run) == 1
+    assert runs == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['coalesced'] == 4
+    assert cache.stats()['hits'] == 1
+
+
+@pytest.mark.asyncio
+async def test_response_cache_does_not_keep_errors():
+    cache = ResponseCache(ttl=60)
+    runs = 0
+
+    async def run():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError('failed')
+
+    results = await asyncio.gather(*[cache.get_or_run('a', run) for _ in range(2)], return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert runs == 1
+    with pytest.raises(RuntimeError):
+        await cache.get_or_run('a', run)
+    assert runs == 2
+
+
+@pytest.mark.asyncio
+async def test_response_cache_does_not_keep_none():
+    cache = ResponseCache(ttl=60)
+    runs = 0
+
+    async def run():
+        nonlocal runs
+        runs += 1
+
+    assert await cache.get_or_run('a', run) is None
+    assert await cache.get_or_run('a', run) is None
+    assert runs == 2
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_response_cache_retries_when_shared_run_is_cancelled():
+    cache = ResponseCache(ttl=60)
+
+    async def run():
+        await asyncio.sleep(0.01)
+        return 'done'
+
+    first = asyncio.ensure_future(cache.get_or_run('a', run))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(cache.get_or_run('a', run))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 'done'
+    assert first.cancelled()
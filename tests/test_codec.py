@@ -0,0 +1,149 @@
+import json
+from uuid import uuid4
+
+import pytest
+
+from zentropi import Frame
+from zentropi import Kind
+from zentropi.codec import CODECS
+from zentropi.codec import JSON_CODEC
+from zentropi.codec import available_codecs
+from zentropi.codec import get_codec
+from zentropi.codec import negotiate_codec
+from zentropi.frame import LazyFrame
+
+msgpack = pytest.importorskip('msgpack')
+
+
+def test_json_codec_roundtrip():
+    uuid = uuid4().hex
+    f = Frame('test-frame', kind=Kind.REQUEST, uuid=uuid, data={'test': 'item'})
+    fbytes = f.to_bytes()
+    assert json.loads(fbytes.decode('utf-8'))['uuid'] == uuid
+    f_ = Frame.from_bytes(fbytes)
+    assert f_.to_dict() == f.to_dict()
+
+
+def test_msgpack_codec_roundtrip():
+    uuid = uuid4().hex
+    f = Frame('test-frame', kind=Kind.REQUEST, uuid=uuid, data={'test': 'item'}, meta={'reply_to': uuid})
+    fbytes = f.to_bytes(codec='msgpack')
+    f_ = Frame.from_bytes(fbytes, codec='msgpack')
+    assert f_.to_dict() == f.to_dict()
+    assert f_.kind == Kind.REQUEST
+
+
+def test_msgpack_codec_is_compact():
+    f = Frame('test-frame', data={'value': 42})
+    name, kind, uuid, data, meta = msgpack.unpackb(f.to_bytes(codec='msgpack'), raw=False)
+    assert kind == int(Kind.EVENT)
+    assert uuid == bytes.fromhex(f.uuid)
+    assert meta is None
+    assert len(f.to_bytes(codec='msgpack')) < len(f.to_bytes(codec='json'))
+
+
+def test_msgpack_codec_keeps_non_hex_uuid():
+    f = Frame('test-frame', uuid='not-a-hex-uuid')
+    f_ = Frame.from_bytes(f.to_bytes(codec='msgpack'), codec='msgpack')
+    assert f_.uuid == 'not-a-hex-uuid'
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_msgpack_codec_rejects_garbage():
+    Frame.from_bytes(b'\x93\x01\x02\x03', codec='msgpack')
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_get_codec_unknown():
+    get_codec('morse')
+
+
+def test_available_codecs_prefer_binary():
+    assert available_codecs() == ['msgpack', 'json']
+
+
+def test_negotiate_codec():
+    assert negotiate_codec(['cbor', 'msgpack', 'json']) is CODECS['msgpack']
+    assert negotiate_codec([None]) is JSON_CODEC
+    assert negotiate_codec([]) is JSON_CODEC
+
+
+@pytest.mark.parametrize('codec', ['json', 'msgpack'])
+@pytest.mark.parametrize('size', [1, 1000])
+def test_lazy_frame(codec, size):
+    data = {'values': list(range(size))}
+    f = Frame('test-frame', kind=Kind.RESPONSE, data=data, meta={'reply_to': uuid4().hex})
+    codec = get_codec(codec)
+    payload = codec.dumps(f)
+    lf = codec.loads(payload, lazy=True)
+    assert isinstance(lf, LazyFrame)
+    assert lf.name == 'test-frame'
+    assert lf.kind == Kind.RESPONSE
+    assert lf.uuid == f.uuid
+    assert lf.meta == f.meta
+    assert lf.data == data
+    assert lf.to_dict() == f.to_dict()
+
+
+def test_lazy_frame_defers_data():
+    f = Frame('test-frame', data={'values': list(range(1000))}, meta={'reply_to': uuid4().hex})
+    lf = CODECS['msgpack'].loads(f.to_bytes(codec='msgpack'), lazy=True)
+    assert lf._data_raw is not None
+    assert lf.meta.get('reply_to') == f.meta['reply_to']
+    assert lf._data_raw is not None
+    assert lf.data['values'][-1] == 999
+    assert lf._data_raw is None
+
+
+@pytest.mark.parametrize('codec', ['json', 'msgpack'])
+def test_lazy_frame_relays_raw_payload(codec):
+    f = Frame('test-frame', data={'values': list(range(1000))})
+    codec = get_codec(codec)
+    payload = codec.dumps(f)
+    lf = codec.loads(payload, lazy=True)
+    assert codec.dumps(lf) is payload
+    assert lf.meta.get('reply_to') is None
+    assert codec.dumps(lf) is payload
+
+
+@pytest.mark.parametrize('codec', ['json', 'msgpack'])
+def test_lazy_frame_copy_relays_raw_payload(codec):
+    f = Frame('test-frame', data={'values': [1, 2, 3]})
+    codec = get_codec(codec)
+    payload = codec.dumps(f)
+    lf = codec.loads(payload, lazy=True)
+    copy = lf.copy()
+    copy.data['values'] = []
+    assert codec.dumps(lf) is payload
+    assert codec.loads(codec.dumps(copy)).data == {'values': []}
+    assert lf.data == {'values': [1, 2, 3]}
+
+
+@pytest.mark.parametrize('codec', ['json', 'msgpack'])
+def test_lazy_frame_reencodes_when_changed(codec):
+    f = Frame('test-frame', data={'values': [1, 2, 3]})
+    codec = get_codec(codec)
+    payload = codec.dumps(f)
+
+    lf = codec.loads(payload, lazy=True)
+    lf.meta['source'] = 'relay'
+    assert codec.loads(codec.dumps(lf)).meta == {'source': 'relay'}
+
+    lf = codec.loads(payload, lazy=True)
+    lf.data['values'].append(4)
+    assert codec.loads(codec.dumps(lf)).data == {'values': [1, 2, 3, 4]}
+
+
+@pytest.mark.parametrize('codec', ['json', 'msgpack'])
+def test_lazy_frame_reencodes_when_nested_meta_changed(codec):
+    f = Frame('test-frame', meta={'trace': ['origin']})
+    codec = get_codec(codec)
+    lf = codec.loads(codec.dumps(f), lazy=True)
+    lf.meta['trace'].append('relay')
+    assert codec.loads(codec.dumps(lf)).meta == {'trace': ['origin', 'relay']}
+
+
+def test_lazy_frame_is_not_relayed_across_codecs():
+    f = Frame('test-frame', data={'test': 'item'})
+    lf = JSON_CODEC.loads(JSON_CODEC.dumps(f), lazy=True)
+    assert Frame.from_bytes(lf.to_bytes(codec='msgpack'), codec='msgpack').to_dict() == f.to_dict()
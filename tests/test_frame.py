@@ -1,4 +1,5 @@
 import json
+from timeit import repeat
 from uuid import uuid4
 
 import pytest
@@ -164,3 +165,46 @@ def test_frame_validate_data_must_be_dict():
 @pytest.mark.xfail(raises=TypeError)
 def test_frame_validate_meta_must_be_dict():
     Frame('test-frame', meta='expect failure')
+
+
+def test_frame_trusted():
+    uuid = uuid4().hex
+    f = Frame._trusted('test-frame', kind=4, uuid=uuid, data={'test': 'item'})
+    assert f.name == 'test-frame'
+    assert f.kind is Kind.REQUEST
+    assert f.uuid == uuid
+    assert f.data == {'test': 'item'}
+    assert f.meta == {}
+    assert len(Frame._trusted('test-frame').uuid) == 32
+
+
+def test_frame_from_dict_without_validation():
+    uuid = uuid4().hex
+    frame_as_dict = {'name': 'test-frame', 'uuid': uuid, 'kind': Kind.EVENT}
+    f = Frame.from_dict(frame_as_dict, validate=False)
+    assert f.to_dict() == frame_as_dict
+
+
+def test_frame_reply_without_validation():
+    f = Frame('test-frame', kind=Kind.REQUEST)
+    freply = f.reply(data={'test': 'item'}, validate=False)
+    assert freply.kind == Kind.RESPONSE
+    assert freply.meta.get('reply_to') == f.uuid
+
+
+def test_frame_copy():
+    frame = Frame('test-frame', kind=Kind.EVENT, data={'test': 'item'}, meta={'source': 'test'})
+    copy = frame.copy()
+    copy.data['test'] = 'changed'
+    copy.meta['source'] = 'changed'
+    assert (copy.name, copy.kind, copy.uuid) == (frame.name, frame.kind, frame.uuid)
+    assert frame.data == {'test': 'item'}
+    assert frame.meta == {'source': 'test'}
+
+
+def test_frame_trusted_construction_is_faster():
+    number = 5000
+    # The best of several rounds, as a single one may be slowed down by anything else running.
+    validated = min(repeat(lambda: Frame('test-frame', kind=Kind.EVENT, data={'test': 'item'}), number=number))
+    trusted = min(repeat(lambda: Frame._trusted('test-frame', kind=Kind.EVENT, data={'test': 'item'}), number=number))
+    assert trusted < validated
@@ -0,0 +1,53 @@
+import asyncio
+from asyncio import Event
+
+import pytest
+
+from zentropi import Agent
+from zentropi import Frame
+from zentropi.metrics import render_metrics
+
+
+def test_render_metrics_for_new_agent():
+    text = render_metrics(Agent('test "agent"'))
+    assert '# TYPE zentropi_tasks gauge' in text
+    assert 'zentropi_tasks{agent="test \\"agent\\""} 0.0' in text
+    assert 'zentropi_send_queue_depth' not in text
+
+
+@pytest.mark.asyncio
+async def test_metrics_exporter_serves_metrics():
+    agent = Agent('test-agent', metrics_port=0)
+
+    @agent.on_event('test-event')
+    async def test_event():
+        pass
+
+    shutdown_trigger = Event()
+    task = asyncio.create_task(agent.start(
+        'queue://', 'test-token', shutdown_trigger=shutdown_trigger, handle_signals=False))
+    while not agent._connected:
+        await asyncio.sleep(0)
+    await agent._connection.queue_recv.put(Frame('test-event'))
+    for _ in range(100):
+        if agent.stats()['handlers']:
+            break
+        await asyncio.sleep(0.01)
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', agent._metrics_exporter.port)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    response = await get('/metrics')
+    assert response.startswith('HTTP/1.1 200 OK')
+    assert 'zentropi_frames_received_total{agent="test-agent",kind="event"} 1.0' in response
+    assert 'zentropi_handler_calls_total{agent="test-agent",kind="event",name="test-event"} 1.0' in response
+    assert 'zentropi_handler_latency_seconds{agent="test-agent",kind="event",name="test-event",quantile="0.99"}' in response
+    assert 'zentropi_transport_bytes_sent_total{agent="test-agent",transport="QueueTransport"} 0.0' in response
+    assert 'zentropi_send_queue_depth{agent="test-agent"}' in response
+    assert (await get('/')).startswith('HTTP/1.1 404')
+    shutdown_trigger.set()
+    await task
@@ -0,0 +1,42 @@
+import re
+
+from zentropi.patterns import PatternTable
+from zentropi.patterns import is_pattern
+
+
+def test_is_pattern():
+    assert is_pattern('sensor.*')
+    assert is_pattern('*')
+    assert is_pattern(re.compile('sensor'))
+    assert not is_pattern('sensor.temperature')
+
+
+def test_pattern_table_prefix_and_suffix():
+    table = PatternTable()
+    table.add('sensor.*')
+    table.add('sensor.temp*')
+    table.add('*-on')
+    assert table.match('sensor.humidity') == 'sensor.*'
+    assert table.match('sensor.temperature') == 'sensor.temp*'
+    assert table.match('light-on') == '*-on'
+    assert table.match('sensor.light-on') == 'sensor.*'
+    assert table.match('light-off') is None
+
+
+def test_pattern_table_regex_and_catch_all():
+    table = PatternTable()
+    table.add('*')
+    table.add('room-*-light')
+    table.add(re.compile(r'switch-\d+', re.IGNORECASE))
+    assert table.match('room-kitchen-light') == 'room-*-light'
+    assert table.match('Switch-42') == table.patterns()[1]
+    assert table.match('switch-x') == '*'
+    assert table.match('room.kitchen-light') == '*'
+
+
+def test_pattern_table_describe():
+    table = PatternTable()
+    for pattern in ['*', 'b-*', '*-a', 'c*d', re.compile('e+')]:
+        table.add(pattern)
+    assert len(table) == 5
+    assert table.describe() == {'glob': ['*-a', 'b-*', 'c*d'], 'regex': ['e+']}
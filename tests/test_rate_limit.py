@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from zentropi import Frame
+from zentropi.rate_limit import RateLimiter
+from zentropi.rate_limit import TokenBucket
+from zentropi.rate_limit import sender_of
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(2, 1)
+    bucket.tokens = 0
+    bucket.refill(bucket.updated + 0.25)
+    assert bucket.tokens == 0.5
+    assert bucket.wait_time() == 0.25
+    bucket.refill(bucket.updated + 10)
+    assert bucket.full
+
+
+def test_sender_of():
+    assert sender_of(Frame('test', meta={'source': {'name': 'a', 'uuid': 'b'}})) == 'b'
+    assert sender_of(Frame('test', meta={'source': 'a'})) == 'a'
+    assert sender_of(Frame('test')) is None
+    assert sender_of(None) is None
+
+
+def test_rate_limiter_sheds():
+    limiter = RateLimiter([(2, 60)])
+    assert limiter.reserve(None) == 0
+    assert limiter.reserve(None) == 0
+    assert limiter.reserve(None) is None
+    assert limiter.stats()['shed'] == 1
+
+
+def test_rate_limiter_delays_in_order():
+    limiter = RateLimiter([(10, 1)], policy='delay', max_delay=0.35)
+    waits = [limiter.reserve(None) for _ in range(13)]
+    assert waits[:10] == [0] * 10
+    assert 0.09 < waits[10] < waits[11] < waits[12] <= 0.31
+    assert limiter.stats()['delayed'] == 3
+    assert limiter.reserve(None) is None
+
+
+def test_rate_limiter_per_sender():
+    limiter = RateLimiter([(1, 60)], key='sender')
+    alice = Frame('test', meta={'source': 'alice'})
+    bob = Frame('test', meta={'source': 'bob'})
+    assert limiter.reserve(alice) == 0
+    assert limiter.reserve(bob) == 0
+    assert limiter.reserve(alice) is None
+    assert limiter.stats()['senders'] == 2
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_rate_limiter_invalid_policy():
+    RateLimiter([(1, 1)], policy='queue')
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_returns_tokens_of_cancelled_waits():
+    limiter = RateLimiter([(1, 60)], policy='delay', max_delay=120)
+    assert await limiter.acquire(None)
+    task = asyncio.create_task(limiter.acquire(None))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert limiter.reserve(None) == pytest.approx(60, abs=0.1)
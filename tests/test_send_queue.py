@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from zentropi import Agent
+from zentropi import Frame
+from zentropi import Kind
+from zentropi.send_queue import Overflow
+from zentropi.send_queue import SendQueue
+
+
+def drain(queue):
+    frames = []
+    while not queue.empty():
+        frames.append(queue.get_nowait())
+    return frames
+
+
+@pytest.mark.asyncio
+async def test_send_queue_blocks_when_full():
+    queue = SendQueue(maxsize=1)
+    await queue.put(Frame('first'))
+    put = asyncio.create_task(queue.put(Frame('second')))
+    await asyncio.sleep(0)
+    assert not put.done()
+    assert queue.get_nowait().name == 'first'
+    await put
+    assert queue.get_nowait().name == 'second'
+
+
+@pytest.mark.xfail(raises=asyncio.QueueFull)
+def test_send_queue_block_put_nowait_raises():
+    queue = SendQueue(maxsize=1)
+    queue.put_nowait(Frame('first'))
+    queue.put_nowait(Frame('second'))
+
+
+@pytest.mark.asyncio
+async def test_send_queue_drop_oldest():
+    queue = SendQueue(maxsize=2, overflow='drop-oldest')
+    for name in ['a', 'b', 'c']:
+        await queue.put(Frame(name))
+    assert [f.name for f in drain(queue)] == ['b', 'c']
+    assert queue.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_send_queue_drop_newest():
+    queue = SendQueue(maxsize=2, overflow=Overflow.DROP_NEWEST)
+    for name in ['a', 'b', 'c']:
+        await queue.put(Frame(name))
+    assert [f.name for f in drain(queue)] == ['a', 'b']
+    assert queue.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_send_queue_coalesce():
+    queue = SendQueue(maxsize=2, overflow='coalesce')
+    await queue.put(Frame('temperature', data={'value': 1}))
+    await queue.put(Frame('humidity', data={'value': 2}))
+    await queue.put(Frame('temperature', data={'value': 3}))
+    assert queue.coalesced == 1
+    assert queue.dropped == 0
+    assert [(f.name, f.data['value']) for f in drain(queue)] == [('temperature', 3), ('humidity', 2)]
+
+
+@pytest.mark.asyncio
+async def test_send_queue_coalesce_only_events():
+    queue = SendQueue(maxsize=2, overflow='coalesce')
+    await queue.put(Frame('status', kind=Kind.REQUEST))
+    await queue.put(Frame('temperature'))
+    await queue.put(Frame('status', kind=Kind.REQUEST))
+    assert queue.coalesced == 0
+    assert queue.dropped == 1
+    assert [f.name for f in drain(queue)] == ['temperature', 'status']
+
+
+def test_send_queue_stats():
+    queue = SendQueue(maxsize=3, overflow='drop-newest')
+    queue.put_nowait(Frame('test-frame'))
+    stats = queue.stats()
+    assert stats.pop('delay')['count'] == 0
+    assert stats == {
+        'depth': 1,
+        'maxsize': 3,
+        'overflow': 'drop-newest',
+        'dropped': 0,
+        'coalesced': 0,
+    }
+    queue.get_nowait()
+    assert queue.stats()['delay']['count'] == 1
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_agent_invalid_overflow():
+    Agent('test-agent', send_queue_overflow='explode')
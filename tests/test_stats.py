@@ -0,0 +1,41 @@
+from zentropi.kind import Kind
+from zentropi.stats import Histogram
+from zentropi.stats import Stats
+
+
+def test_histogram_percentiles_within_precision():
+    histogram = Histogram()
+    for millis in range(1, 1001):
+        histogram.record(millis / 1000)
+    assert histogram.count == 1000
+    assert histogram.min == 0.001
+    assert histogram.max == 1.0
+    for percentile, expected in [(50, 0.5), (90, 0.9), (99, 0.99)]:
+        assert abs(histogram.percentile(percentile) - expected) / expected < 0.04
+    snapshot = histogram.snapshot()
+    assert abs(snapshot['mean'] - 0.5005) < 1e-9
+    assert snapshot['p99.9'] <= 1.0
+
+
+def test_histogram_small_values_are_exact():
+    histogram = Histogram()
+    histogram.record(0.000005)
+    histogram.record(-1)
+    assert histogram.percentile(100) == 0.000005
+    assert histogram.percentile(1) == 0.0
+
+
+def test_empty_histogram_snapshot():
+    assert Histogram().snapshot() == {
+        'count': 0, 'min': 0.0, 'max': 0.0, 'mean': 0.0, 'sum': 0.0, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'p99.9': 0.0}
+
+
+def test_stats_snapshot():
+    stats = Stats()
+    stats.handler(Kind.EVENT, 'test-event').record(0.01)
+    stats.handler(Kind.EVENT, 'test-event').record(0.02, error=True)
+    stats.request('test-request').record(1, timeout=True)
+    snapshot = stats.snapshot()
+    assert snapshot['handlers']['EVENT:test-event']['calls'] == 2
+    assert snapshot['handlers']['EVENT:test-event']['errors'] == 1
+    assert snapshot['requests']['test-request']['timeouts'] == 1
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from zentropi.timer import TimerWheel
+
+
+@pytest.mark.asyncio
+async def test_timer_wheel_expires_futures():
+    loop = asyncio.get_event_loop()
+    timers = TimerWheel(resolution=0.01)
+    short, long_ = loop.create_future(), loop.create_future()
+    timers.add(long_, 0.5)
+    timers.add(short, 0.01, 'short timed out')
+    with pytest.raises(TimeoutError, match='short timed out'):
+        await short
+    assert not long_.done()
+    with pytest.raises(TimeoutError):
+        await long_
+    assert len(timers) == 0
+
+
+@pytest.mark.asyncio
+async def test_timer_wheel_skips_done_futures():
+    loop = asyncio.get_event_loop()
+    timers = TimerWheel(resolution=0.01)
+    future = loop.create_future()
+    timers.add(future, 0.01)
+    future.set_result(True)
+    await asyncio.sleep(0.03)
+    assert future.result() is True
+    assert len(timers) == 0
+
+
+@pytest.mark.asyncio
+async def test_timer_wheel_shares_buckets():
+    loop = asyncio.get_event_loop()
+    timers = TimerWheel(resolution=10)
+    for _ in range(100):
+        timers.add(loop.create_future(), 1)
+    assert len(timers) == 100
+    assert len(timers._buckets) <= 2
+    timers.cancel()
+    assert len(timers) == 0
+
+
+@pytest.mark.asyncio
+async def test_timer_wheel_discards_futures():
+    loop = asyncio.get_event_loop()
+    timers = TimerWheel(resolution=0.01)
+    future = loop.create_future()
+    handle = timers.add(future, 60)
+    future.set_result(True)
+    timers.discard(future, handle)
+    assert len(timers) == 0
+    timers.discard(future, handle)
+    timers.cancel()
+
+
+@pytest.mark.asyncio
+async def test_timer_wheel_never_expires_early():
+    loop = asyncio.get_event_loop()
+    timers = TimerWheel(resolution=0.01)
+    late = []
+    for i in range(50):
+        future = loop.create_future()
+        deadline = loop.time() + i * 0.001
+        future.add_done_callback(lambda f, deadline=deadline: late.append(loop.time() - deadline))
+        timers.add(future, i * 0.001)
+        await asyncio.sleep(0.0005)
+    while len(late) < 50:
+        await asyncio.sleep(0.01)
+    assert min(late) >= 0
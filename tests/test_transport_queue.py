@@ -4,7 +4,10 @@ import pytest
 
 from zentropi import Agent
 from zentropi import Frame
+from zentropi import Kind
 from zentropi import QueueTransport
+from zentropi.broker import OUTBOX_SIZE
+from zentropi.broker import Broker
 
 
 @pytest.mark.asyncio
@@ -24,6 +27,34 @@ async def test_queue_transport():
     assert qt.connected is False
 
 
+@pytest.mark.asyncio
+async def test_queue_transport_send_batch():
+    qt = QueueTransport()
+    frames = [Frame('test-frame'), Frame('test-frame')]
+    await qt.connect('test-endpoint', 'test-token')
+    await qt.send_batch(frames, max_bytes=1)
+    assert qt.queue_send.get_nowait() == frames[0]
+    assert qt.queue_send.get_nowait() == frames[1]
+
+
+@pytest.mark.asyncio
+async def test_queue_transport_through_broker_delivers_copies():
+    broker = Broker()
+    broker.serve_queue('test-queue')
+    sender, first, second = QueueTransport(), QueueTransport(), QueueTransport()
+    for qt in (sender, first, second):
+        await qt.connect('queue://test-queue', 'test-token')
+        await qt.send(Frame('join', kind=Kind.COMMAND, data={'spaces': ['*']}))
+    assert first.queue_recv.maxsize == OUTBOX_SIZE
+    frame = Frame('test-frame', data={'value': 1})
+    await sender.send(frame)
+    received = await first.recv()
+    received.data['value'] = 2
+    received.meta['changed'] = True
+    assert (await second.recv()).to_dict() == frame.to_dict()
+    assert frame.data == {'value': 1}
+    await broker.close()
+
 # @pytest.mark.asyncio
 # async def test_agent_with_queue_endpoint():
 #     a = Agent('test-agent')
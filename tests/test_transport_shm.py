@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+import os
+
+import pytest
+
+from zentropi import Frame
+from zentropi.broker import Broker
+from zentropi.transport.shm import RING_SIZE
+from zentropi.transport.shm import Ring
+from zentropi.transport.shm import ShmTransport
+from zentropi.transport.shm import _wakeup_path
+from zentropi.transport.shm import shm_available
+
+pytestmark = pytest.mark.skipif(not shm_available(), reason='Needs multiprocessing.shared_memory and named pipes')
+
+
+def test_ring_wraps_around():
+    ring = Ring(memoryview(bytearray(64 + 32)), 32)
+    assert ring.get() is None
+    for i in range(10):
+        payload = bytes([i]) * 10
+        assert ring.put(payload)
+        assert ring.get() == payload
+    assert ring.put(b'a' * 10)
+    assert ring.put(b'b' * 10)
+    assert not ring.put(b'c' * 10)
+    assert ring.get() == b'a' * 10
+    assert ring.put(b'c' * 10)
+    assert ring.get() == b'b' * 10
+    assert ring.get() == b'c' * 10
+    assert ring.get() is None
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_ring_payload_too_large():
+    Ring(memoryview(bytearray(64 + 32)), 32).put(b'a' * 29)
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=ConnectionError)
+async def test_shm_transport_without_broker():
+    await ShmTransport().connect('shm://test-nobody', 'test-token')
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=ConnectionError)
+async def test_shm_transport_recv_garbage():
+    broker = Broker()
+    await broker.serve_shm('test-shm-garbage')
+    transport = ShmTransport()
+    await transport.connect('shm://test-shm-garbage', 'test-token')
+    try:
+        assert transport._channel._in.put(b'{not json')
+        await asyncio.wait_for(transport.recv(), timeout=1)
+    finally:
+        await transport.close()
+        await broker.close()
+
+
+@pytest.mark.asyncio
+async def test_shm_transport_drops_oversized(caplog):
+    broker = Broker()
+    await broker.serve_shm('test-shm-oversized')
+    transport = ShmTransport()
+    await transport.connect('shm://test-shm-oversized', 'test-token')
+    await transport.send(Frame('too-large', data={'value': 'x' * RING_SIZE}))
+    assert 'Dropped a payload' in caplog.text
+    assert not transport._channel.closed
+    await transport.close()
+    while broker.stats()['subscribers']:
+        await asyncio.sleep(0.001)
+    await broker.close()
+
+
+def connect_and_wait(ready):
+    async def run():
+        transport = ShmTransport()
+        await transport.connect('shm://test-shm-killed', 'test-token')
+        ready.set()
+        await asyncio.sleep(60)
+
+    asyncio.run(run())
+
+
+@pytest.mark.asyncio
+async def test_shm_channel_removed_when_agent_dies():
+    broker = Broker()
+    await broker.serve_shm('test-shm-killed')
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=connect_and_wait, args=(ready,))
+    process.start()
+    while not ready.is_set():
+        await asyncio.sleep(0.01)
+    channel_id = broker._subscribers[0].name.split(':', 1)[1]
+    paths = [f'/dev/shm/zentropi-{channel_id}'] + [_wakeup_path(channel_id, d) for d in ('up', 'down')]
+    assert all(os.path.exists(path) for path in paths)
+    process.kill()
+    process.join()
+    while broker.stats()['subscribers']:
+        await asyncio.sleep(0.001)
+    assert not any(os.path.exists(path) for path in paths)
+    await broker.close()
@@ -0,0 +1,52 @@
+import asyncio
+import socket
+
+import pytest
+
+from zentropi import Frame
+from zentropi import Kind
+from zentropi.transport.stream import HEADER
+from zentropi.transport.stream import MAX_PACKET_SIZE
+from zentropi.transport.stream import PacketConnection
+from zentropi.transport.tcp import TcpTransport
+from zentropi.transport.unix import UnixTransport
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='Needs unix domain sockets')
+
+
+async def serve_garbage(reader, writer):
+    """Accept any login, then send a payload that is not a frame."""
+    length, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    await reader.readexactly(length)
+    for payload in (Frame('login-ok', kind=Kind.COMMAND).to_json().encode('utf-8'), b'{not json'):
+        writer.write(HEADER.pack(len(payload)) + payload)
+    await writer.drain()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('scheme', ['unix', 'tcp'])
+@pytest.mark.xfail(raises=ConnectionError)
+async def test_stream_transport_recv_garbage(tmp_path, scheme):
+    if scheme == 'unix':
+        server = await asyncio.start_unix_server(serve_garbage, f'{tmp_path}/test.sock')
+        transport, endpoint = UnixTransport(), f'unix://{tmp_path}/test.sock'
+    else:
+        server = await asyncio.start_server(serve_garbage, '127.0.0.1', 0)
+        transport, endpoint = TcpTransport(), f'tcp://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+    try:
+        await transport.connect(endpoint, 'test-token')
+        await asyncio.wait_for(transport.recv(), timeout=1)
+    finally:
+        await transport.close()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_packet_connection_drops_oversized():
+    left, right = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    sender, receiver = PacketConnection(left), PacketConnection(right)
+    await sender.send([b'a' * (MAX_PACKET_SIZE + 1), b'fits'])
+    assert await asyncio.wait_for(receiver.read(), timeout=1) == b'fits'
+    await sender.close()
+    await receiver.close()
@@ -0,0 +1,65 @@
+import asyncio
+import socket
+
+import pytest
+
+from zentropi.broker import Broker
+from zentropi.transport.tcp import TcpTransport
+from zentropi.transport.tcp import tcp_address
+
+
+def test_tcp_address():
+    assert tcp_address('tcp://127.0.0.1:1234') == ('127.0.0.1', 1234, True)
+    assert tcp_address('tcp://localhost?nodelay=0') == ('localhost', 26514, False)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_tcp_address_invalid():
+    tcp_address('tcp://127.0.0.1:1234?nodelay=maybe')
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=OSError)
+async def test_tcp_transport_without_broker():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    await TcpTransport().connect(f'tcp://127.0.0.1:{port}', 'test-token')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('nodelay', [True, False])
+async def test_tcp_transport_nodelay(nodelay):
+    broker = Broker()
+    port = await broker.serve_tcp(port=0)
+    transport = TcpTransport()
+    await transport.connect(f'tcp://127.0.0.1:{port}?nodelay={int(nodelay)}', 'test-token')
+    sock = transport.connection._writer.get_extra_info('socket')
+    assert bool(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)) == nodelay
+    assert transport.connected
+    await transport.close()
+    while broker.stats()['subscribers']:
+        await asyncio.sleep(0.001)
+    await broker.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=PermissionError)
+async def test_tcp_transport_login_fail():
+    broker = Broker(tokens=['other-token'])
+    port = await broker.serve_tcp(port=0)
+    try:
+        await TcpTransport().connect(f'tcp://127.0.0.1:{port}', 'test-token')
+    finally:
+        await broker.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=ConnectionError)
+async def test_tcp_transport_broker_closed():
+    broker = Broker()
+    port = await broker.serve_tcp(port=0)
+    transport = TcpTransport()
+    await transport.connect(f'tcp://127.0.0.1:{port}', 'test-token')
+    await broker.close()
+    await asyncio.wait_for(transport.recv(), timeout=1)
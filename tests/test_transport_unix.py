@@ -0,0 +1,38 @@
+import os
+import socket
+import stat
+
+import pytest
+
+from zentropi.broker import Broker
+from zentropi.transport.unix import UnixTransport
+from zentropi.transport.unix import unix_address
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='Needs unix domain sockets')
+
+
+def test_unix_address():
+    assert unix_address('unix:///tmp/test.sock') == ('/tmp/test.sock', False)
+    assert unix_address('unix:///tmp/test.sock?seqpacket') == ('/tmp/test.sock', True)
+    assert unix_address('unix://test.sock') == ('test.sock', False)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_unix_address_invalid():
+    unix_address('unix:///tmp/test.sock?datagram')
+
+
+@pytest.mark.asyncio
+@pytest.mark.xfail(raises=OSError)
+async def test_unix_transport_without_broker(tmp_path):
+    await UnixTransport().connect(f'unix://{tmp_path}/nobody.sock', 'test-token')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('seqpacket', [False, True])
+async def test_unix_broker_mode(tmp_path, seqpacket):
+    path = f'{tmp_path}/test.sock'
+    broker = Broker()
+    await broker.serve_unix(path, seqpacket=seqpacket, mode=0o600)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    await broker.close()
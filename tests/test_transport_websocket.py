@@ -7,11 +7,14 @@ from zentropi.transport import websocket
 
 
 class MockWebsockets(object):
-    def __init__(self, login_ok=True, send_ok=True, recv_ok=True):
+    def __init__(self, login_ok=True, send_ok=True, recv_ok=True, codec=None, batch=False):
         self._login_ok = login_ok
         self._send_ok = send_ok
         self._recv_ok = recv_ok
+        self._codec = codec
+        self._batch = batch
         self.frame = None
+        self.sent = 0
 
     async def connect(self, endpoint):
         return self
@@ -22,9 +25,17 @@ class MockWebsockets(object):
     async def send(self, data):
         if not self._send_ok:
             raise ConnectionAbortedError()
+        self.sent += 1
+        if isinstance(data, bytes) or data.startswith('['):
+            self.frame = data
+            return
         frame = Frame.from_json(data)
         if frame.name == 'login':
-            if self._login_ok:
+            if self._login_ok and self._batch and frame.data.get('batch'):
+                self.frame = frame.reply('login-ok', data={'codec': self._codec, 'batch': True}).to_json()
+            elif self._login_ok and self._codec in frame.data.get('codecs', []):
+                self.frame = frame.reply('login-ok', data={'codec': self._codec}).to_json()
+            elif self._login_ok:
                 self.frame = frame.reply('login-ok').to_json()
             else:
                 self.frame = frame.reply('login-failed').to_json()
@@ -54,6 +65,74 @@ async def test_websocket_transport(monkeypatch):
     assert wt.connected is False
 
 
+@pytest.mark.asyncio
+async def test_websocket_transport_negotiates_codec(monkeypatch):
+    pytest.importorskip('msgpack')
+    monkeypatch.setattr(websocket, 'websockets', MockWebsockets(codec='msgpack'))
+    wt = WebsocketTransport()
+    frame = Frame('test-frame', data={'test': 'item'})
+    await wt.connect('ws://localhost:6789/', 'test-token')
+    assert wt.codec.name == 'msgpack'
+    await wt.send(frame)
+    assert isinstance(wt.connection.frame, bytes)
+    frame_recv = await wt.recv()
+    assert frame_recv.to_dict() == frame.to_dict()
+    await wt.close()
+
+
+@pytest.mark.asyncio
+async def test_websocket_transport_falls_back_to_json(monkeypatch):
+    monkeypatch.setattr(websocket, 'websockets', MockWebsockets())
+    wt = WebsocketTransport()
+    await wt.connect('ws://localhost:6789/', 'test-token')
+    assert wt.codec.name == 'json'
+    await wt.send(Frame('test-frame'))
+    assert isinstance(wt.connection.frame, str)
+    await wt.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('codec', ['json', 'msgpack'])
+async def test_websocket_transport_batch(monkeypatch, codec):
+    pytest.importorskip('msgpack')
+    monkeypatch.setattr(websocket, 'websockets', MockWebsockets(codec=codec, batch=True))
+    wt = WebsocketTransport()
+    await wt.connect('ws://localhost:6789/', 'test-token')
+    assert wt.batch is True
+    frames = [Frame(f'test-frame-{i}', data={'value': i}) for i in range(3)]
+    sent = wt.connection.sent
+    await wt.send_batch(frames, max_bytes=64 * 1024)
+    assert wt.connection.sent == sent + 1
+    for frame in frames:
+        frame_recv = await wt.recv()
+        assert frame_recv.to_dict() == frame.to_dict()
+    await wt.close()
+
+
+@pytest.mark.asyncio
+async def test_websocket_transport_batch_splits_on_max_bytes(monkeypatch):
+    monkeypatch.setattr(websocket, 'websockets', MockWebsockets(codec='json', batch=True))
+    wt = WebsocketTransport()
+    await wt.connect('ws://localhost:6789/', 'test-token')
+    frames = [Frame(f'test-frame-{i}') for i in range(4)]
+    sent = wt.connection.sent
+    await wt.send_batch(frames, max_bytes=1)
+    assert wt.connection.sent == sent + 4
+    await wt.close()
+
+
+@pytest.mark.asyncio
+async def test_websocket_transport_without_batch_sends_frames(monkeypatch):
+    monkeypatch.setattr(websocket, 'websockets', MockWebsockets())
+    wt = WebsocketTransport()
+    await wt.connect('ws://localhost:6789/', 'test-token')
+    assert wt.batch is False
+    sent = wt.connection.sent
+    await wt.send_batch([Frame('test-frame'), Frame('test-frame')], max_bytes=64 * 1024)
+    assert wt.connection.sent == sent + 2
+    await wt.close()
+
+
 @pytest.mark.asyncio
 @pytest.mark.xfail(raises=PermissionError)
 async def test_websocket_transport_login_fail(monkeypatch):